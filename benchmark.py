@@ -0,0 +1,302 @@
+"""Benchmarks of the board primitives and of the solve engines
+
+Two parts:
+    micro: the operations of `chessboard.Board` and `bitboard.BitBoard` the
+        solver is built on, and `solve.similar`/`solve.find_state`, timed on
+        a fixed corpus of random legal positions
+    solve: the engines solving `ordering.BENCHMARK_POSITIONS`, mid-game
+        positions that finish in seconds
+
+The results are written as JSON and compared with a stored baseline, e.g.
+
+    python benchmark.py --output new.json
+    python benchmark.py --save-baseline  # after an intended change
+"""
+
+import io
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+
+import dfpn
+import solve
+from bitboard import BitBoard
+from chessboard import Board
+from ordering import BENCHMARK_POSITIONS, ThreatFirst
+
+BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+
+#
+# [Result]
+# {
+#   "machine": {...},
+#   "micro": {name: {"ns_per_op": float, "ops_per_s": float}},
+#   "solve": {engine: {"seconds": float, "nodes": int, "results": [bool]}},
+# }
+# The node counts and the results do not depend on the machine, a change of
+# them is a change of the engine.
+#
+
+
+def corpus(n: int = 1000, seed: int = 0) -> list:
+    """Return a fixed corpus of random legal positions
+
+    The positions are taken from random games (uniform movements) and the
+    finished games are skipped.
+
+    Returns
+    -------
+    list
+        [(BitBoard.key, player to move)] of n positions
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        board = BitBoard()
+        player = 1
+        for _ in range(rng.randrange(1, 40)):
+            board.make_move(rng.choice(board.available_move(player)), player,
+                            False)
+            player = 3 - player
+            if board.check_win():
+                break
+            positions.append((board.key, player))
+    return positions[:n]
+
+
+def _time(function, number: int, repeat: int = 5) -> float:
+    """Return the best time in seconds of one call"""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def _time_fresh(setup, function, repeat: int = 5) -> float:
+    """Return the best time of function(setup()), for the operations that
+    change their input"""
+    best = float("inf")
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def micro(positions: list, repeat: int = 5) -> dict:
+    """Time the board primitives on the positions
+
+    Returns
+    -------
+    dict
+        {name: {"ns_per_op", "ops_per_s"}}, see [Result]
+    """
+    boards = [Board(BitBoard(key).board, history=[]) for key, _ in positions]
+    bitboards = [BitBoard(key) for key, _ in positions]
+    players = [player for _, player in positions]
+    pairs = list(zip(boards, players))
+    bit_pairs = list(zip(bitboards, players))
+    # one legal put and one legal move (if any) of each position
+    puts, moves = [], []
+    for i, (board, player) in enumerate(pairs):
+        movements = board.available_move(player)
+        puts += [(i, m[1], player) for m in movements if m[0] == 0][:1]
+        moves += [(i, *m[1], player) for m in movements if m[0] == 1][:1]
+
+    def put(copies):
+        for i, pos, player in puts:
+            copies[i].put(pos, player)
+
+    def move(copies):
+        for i, pre_pos, pos, player in moves:
+            copies[i].move(pre_pos, pos, player)
+
+    # half of the corpus in the tables, so find_state hits and misses
+    saved = solve.board_state_o, solve.board_state_x
+    solve.board_state_o, solve.board_state_x = {}, {}
+    for board, player in bit_pairs[::2]:
+        solve._table(3 - player)[solve.similar(board)] = True
+    try:
+        times = {
+            "Board.available_move": _time(
+                lambda: [b.available_move(p) for b, p in pairs], 1, repeat),
+            "Board.check_win": _time(
+                lambda: [b.check_win() for b in boards], 5, repeat),
+            "Board.copy": _time(
+                lambda: [b.copy() for b in boards], 5, repeat),
+            "Board.put": _time_fresh(
+                lambda: [b.copy() for b in boards], put, repeat),
+            "Board.move": _time_fresh(
+                lambda: [b.copy() for b in boards], move, repeat),
+            "BitBoard.available_move": _time(
+                lambda: [b.available_move(p) for b, p in bit_pairs], 5,
+                repeat),
+            "BitBoard.check_win": _time(
+                lambda: [b.check_win() for b in bitboards], 20, repeat),
+            "solve.similar": _time(
+                lambda: [solve.similar(b) for b in bitboards], 5, repeat),
+            "solve.find_state": _time(
+                lambda: [solve.find_state(b, 3 - p) for b, p in bit_pairs],
+                5, repeat),
+        }
+    finally:
+        solve.board_state_o, solve.board_state_x = saved
+    ops = {"Board.put": len(puts), "Board.move": len(moves)}
+    return {
+        name: {"ns_per_op": t / ops.get(name, len(positions)) * 1e9,
+               "ops_per_s": ops.get(name, len(positions)) / t}
+        for name, t in times.items()
+    }
+
+
+def _dfs(key: int, player: int) -> tuple:
+    solve.board_state_o.clear()
+    solve.board_state_x.clear()
+    solve.status.nodes = 0
+    result = solve.iterative_turns(BitBoard(key), player)
+    return result, solve.status.nodes
+
+
+def _dfpn(key: int, player: int) -> tuple:
+    dfpn.proof_numbers.clear()
+    dfpn.repetitions.clear()
+    dfpn.counter.nodes = 0
+    result = dfpn.dfpn_turns(BitBoard(key), player)
+    return result, dfpn.counter.nodes
+
+
+# name: (solve function, solve.ordering factory), all with solve.cutoff (the
+# dfs without it does not finish on the positions)
+ENGINES = {
+    "dfs": (_dfs, lambda: None),
+    "dfs+threat": (_dfs, ThreatFirst),
+    "dfpn": (_dfpn, lambda: None),
+}
+
+
+def solves(positions: list = BENCHMARK_POSITIONS) -> dict:
+    """Solve the positions with every engine of `ENGINES`
+
+    Returns
+    -------
+    dict
+        {engine: {"seconds", "nodes", "results"}}, see [Result]
+    """
+    saved = (solve.board_state_o, solve.board_state_x, solve.ordering,
+             solve.cutoff)
+    report = {}
+    try:
+        solve.board_state_o, solve.board_state_x = {}, {}
+        solve.cutoff = True
+        for name, (function, ordering) in ENGINES.items():
+            solve.ordering = ordering()
+            seconds, nodes, results = 0, 0, []
+            for key, player in positions:
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):  # Status.print_now
+                    result, n = function(key, player)
+                seconds += time.perf_counter() - start
+                nodes += n
+                results.append(result)
+            report[name] = {"seconds": seconds, "nodes": nodes,
+                            "results": results}
+    finally:
+        (solve.board_state_o, solve.board_state_x, solve.ordering,
+         solve.cutoff) = saved
+    return report
+
+
+def run(n: int = 1000, repeat: int = 5) -> dict:
+    """Run both parts, see [Result]"""
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "micro": micro(corpus(n), repeat),
+        "solve": solves(),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """Return the regressions of a result against the baseline
+
+    Parameters
+    ----------
+    result, baseline : dict
+        see [Result]
+    tolerance : float, optional
+        the slowdown allowed for the times, by default 0.2 (20%)
+
+    Returns
+    -------
+    list
+        the messages of the regressions, empty if there is none
+    """
+    regressions = []
+    for name, old in baseline.get("micro", {}).items():
+        new = result["micro"].get(name)
+        if new and new["ns_per_op"] > old["ns_per_op"] * (1 + tolerance):
+            regressions.append(
+                f"micro {name}: {new['ns_per_op']:.0f} ns/op, "
+                f"baseline {old['ns_per_op']:.0f} ns/op"
+            )
+    for name, old in baseline.get("solve", {}).items():
+        new = result["solve"].get(name)
+        if not new:
+            continue
+        if new["results"] != old["results"]:
+            regressions.append(f"solve {name}: the results changed")
+        if new["nodes"] > old["nodes"]:
+            regressions.append(f"solve {name}: {new['nodes']} nodes, "
+                               f"baseline {old['nodes']}")
+        if new["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append(f"solve {name}: {new['seconds']:.2f}s, "
+                               f"baseline {old['seconds']:.2f}s")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the solver")
+    parser.add_argument("--positions", type=int, default=1000,
+                        help="size of the corpus of the micro benchmarks")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="the best of this many runs is kept")
+    parser.add_argument("--output", help="write the result to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="the stored result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="the slowdown flagged as a regression")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the result as the new baseline")
+    args = parser.parse_args()
+
+    result = run(args.positions, args.repeat)
+    for name, r in result["micro"].items():
+        print(f"{name:>24}: {r['ns_per_op']:>9.0f} ns/op "
+              f"{r['ops_per_s']:>10.0f} ops/s")
+    for name, r in result["solve"].items():
+        print(f"{name:>24}: {r['seconds']:>9.2f} s {r['nodes']:>10} nodes")
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(result, indent=2))
+        print("Saved the baseline:", args.baseline)
+    elif Path(args.baseline).exists():
+        regressions = compare(result,
+                              json.loads(Path(args.baseline).read_text()),
+                              args.tolerance)
+        for message in regressions:
+            print("REGRESSION", message)
+        if regressions:
+            sys.exit(1)
+        print("No regression against", args.baseline)
@@ -0,0 +1,728 @@
+"""A bitboard chess board class for Gobblet Gobblers
+
+Same interface and position numbering as `chessboard.Board`, but the whole
+board is packed into one integer, so put, move, top view and win detection
+are a handful of bit operations instead of Python loops over NumPy scalars.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from chessboard import WIN_TABLE, Board
+
+#
+# [Bit layout]
+# bit = (player - 1) * 27 + position
+#
+# Player 1 (O): bit 0  ~ 26
+# Player 2 (X): bit 27 ~ 53
+#
+# Inside the 27 bits of a player, each layer uses 9 bits:
+# Layer 1 (Large): bit 0 ~ 8, Layer 2 (Medium): bit 9 ~ 17,
+# Layer 3 (Small): bit 18 ~ 26
+#
+
+LAYER_MASK = 0x1FF             # 9 bits, one layer of one player
+PLAYER_MASK = (1 << 27) - 1    # 27 bits, all layers of one player
+
+# WIN[top_o | top_x << 9]: `WIN_TABLE` indexed by the 9-bit masks of the
+# cells that O and X are on top (0 if the masks overlap)
+_mask = np.arange(512)
+_ternary = (_mask[:, None] >> np.arange(9) & 1) @ 3 ** np.arange(9)
+_code = _ternary[None, :] + 2 * _ternary[:, None]
+_code[(_mask[:, None] & _mask[None, :]) > 0] = 0
+WIN = WIN_TABLE[_code].ravel().tolist()
+del _mask, _ternary, _code
+
+# BITS[mask]: the set bits of a 9-bit mask in ascending order
+BITS = [tuple(i for i in range(9) if mask >> i & 1) for mask in range(512)]
+
+# SYMMETRY[s][mask]: the 9-bit mask after the s-th symmetry, in the same
+# order as `solve.similar`: rot90 by i, then the rot90 flipped upside down
+SYMMETRY = []
+for _i in range(4):
+    _r = np.rot90(np.arange(9).reshape(3, 3), _i)
+    for _cells in (_r.ravel(), np.flip(_r, 0).ravel()):
+        SYMMETRY.append([
+            sum(1 << j for j, cell in enumerate(_cells) if mask >> cell & 1)
+            for mask in range(512)
+        ])
+# POSITION_SYMMETRY[s][pos]: the position of the chess at pos after the
+# s-th symmetry (the same layer)
+POSITION_SYMMETRY = [
+    [layer*9 + table[1 << cell].bit_length() - 1
+     for layer in range(3) for cell in range(9)]
+    for table in SYMMETRY
+]
+# UNDO_PLIES: the initial length of the undo arrays of a board, indexed by
+# the number of movements done by `make_move` (the ply), doubled when full
+UNDO_PLIES = 64
+
+# FIXED[mask]: the bit s is set if the s-th symmetry maps the 9-bit mask
+# onto itself
+FIXED = [sum(1 << s for s, table in enumerate(SYMMETRY)
+             if table[mask] == mask)
+         for mask in range(512)]
+
+
+class BitBoard:
+    """Chess board packed in an integer
+
+    key:
+        int, see [Bit layout]
+
+    """
+
+    def __init__(self, board: int | np.ndarray | Board | BitBoard = None,
+                 history=None):
+        if board is None:
+            self.key = 0
+        elif isinstance(board, BitBoard):
+            self.key = board.key
+        elif isinstance(board, Board):
+            self.key = self.array2key(board.board)
+        elif isinstance(board, np.ndarray):
+            self.key = self.array2key(board)
+        else:
+            self.key = board
+        self.history = [] if history is None else history
+        self.chess = self.chess_left()  # the unused chess
+        # the movements and players done by `make_move`, ply entries used
+        self.ply = 0
+        self.undo_moves = [None] * UNDO_PLIES
+        self.undo_players = [0] * UNDO_PLIES
+
+    @staticmethod
+    def array2key(board: np.ndarray) -> int:
+        """Convert a board array[layer, row, column] to the packed integer"""
+        board = np.asarray(board).reshape(27)
+        key = 0
+        for pos in np.flatnonzero(board == 1):
+            key |= 1 << int(pos)
+        for pos in np.flatnonzero(board == 2):
+            key |= 1 << (int(pos) + 27)
+        return key
+
+    @property
+    def board(self) -> np.ndarray:
+        """The board as array[layer, row, column], same as `Board.board`"""
+        bits = np.unpackbits(
+            np.frombuffer(self.key.to_bytes(7, 'little'), dtype=np.uint8),
+            bitorder='little'
+        )
+        return (bits[:27] + 2 * bits[27:54]).astype(np.int8).reshape(3, 3, 3)
+
+    def __getitem__(self, key):
+        return self.board[key]
+
+    def __repr__(self):
+        return Board(self.board)._show_top_size()
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def show(self, t='ts'):
+        """Display the status of the game, see `Board.show`"""
+        Board(self.board).show(t)
+
+    def copy(self) -> BitBoard:
+        """Return BitBoard copy"""
+        board = BitBoard.__new__(BitBoard)
+        board.key = self.key
+        board.history = self.history.copy()
+        board.chess = [self.chess[0].copy(), self.chess[1].copy()]
+        board.ply = self.ply
+        board.undo_moves = self.undo_moves.copy()
+        board.undo_players = self.undo_players.copy()
+        return board
+
+    def symmetric_keys(self) -> list:
+        """Return the keys of the 8 symmetry board positions
+
+        The first one is the key of the board itself.
+        """
+        key = self.key
+        c0 = key & LAYER_MASK
+        c1 = key >> 9 & LAYER_MASK
+        c2 = key >> 18 & LAYER_MASK
+        c3 = key >> 27 & LAYER_MASK
+        c4 = key >> 36 & LAYER_MASK
+        c5 = key >> 45 & LAYER_MASK
+        return [t[c0] | t[c1] << 9 | t[c2] << 18 | t[c3] << 27 | t[c4] << 36
+                | t[c5] << 45 for t in SYMMETRY]
+
+    def stabilizer(self) -> list:
+        """Return the symmetries s (see `symmetric_keys`) that map the board
+        onto itself, [0] if the board has no symmetry"""
+        fixed = self._fixed()
+        return [s for s in range(8) if fixed >> s & 1]
+
+    def _fixed(self) -> int:
+        """Return the symmetries of `stabilizer` as the bits of an int"""
+        key = self.key
+        fixed = FIXED[key & LAYER_MASK]
+        for shift in (9, 18, 27, 36, 45):
+            if fixed == 1:
+                break
+            fixed &= FIXED[key >> shift & LAYER_MASK]
+        return fixed
+
+    def pos2ind(self, pos: int) -> tuple:
+        """Convert position to index of board
+        """
+        return pos//9, pos//3 % 3, pos % 3
+
+    def ind2pos(self, ind):
+        """Convert index of board to position
+        """
+        return ind[0]*9 + ind[1]*3 + ind[2]
+
+    def chess_left(self) -> list:
+        """Count the left chess and raise error if input invalid
+
+        Returns
+        -------
+        list
+            left chess list:
+            [
+                [first_layer, second_layer, third_layer], # player 1
+                [first_layer, second_layer, third_layer], # player 2
+            ]
+
+        """
+        key = self.key
+        if key >> 54 or (key & PLAYER_MASK) & (key >> 27):
+            raise Exception("Invalid board")
+        chess = [[2, 2, 2], [2, 2, 2]]
+        for player in range(2):
+            for i in range(3):
+                n = (key >> (player*27 + i*9) & LAYER_MASK).bit_count()
+                if n > 2:
+                    raise Exception("Exceeding the limit of two chess pieces"
+                                    " for a player.")
+                chess[player][i] -= n
+        return chess
+
+    def _layers(self):
+        """Return the occupied mask of each layer and the free masks
+
+        free[i] is the mask of cells that a chess of layer i can go, which
+        means layer 0 ~ i are all empty.
+        """
+        occ = (self.key | self.key >> 27) & PLAYER_MASK
+        occ0 = occ & LAYER_MASK
+        occ01 = occ0 | (occ >> 9 & LAYER_MASK)
+        occ012 = occ01 | occ >> 18
+        return occ0, occ01, (~occ0 & LAYER_MASK, ~occ01 & LAYER_MASK,
+                             ~occ012 & LAYER_MASK)
+
+    def top(self, player: int) -> int:
+        """Return the 9-bit mask of the cells that the player is on top"""
+        occ0, occ01, _ = self._layers()
+        p = self.key >> (player-1)*27
+        return ((p & LAYER_MASK) | (p >> 9 & ~occ0 & LAYER_MASK)
+                | (p >> 18 & ~occ01 & LAYER_MASK))
+
+    def is_legal_put(self, pos: int, player: int) -> bool:
+        """Check if the position is valid for the player to perform a 'put' action
+
+        Returns
+        -------
+        bool
+            True: Valid
+            False: Invalid
+        """
+        free = self._layers()[2]
+        if not free[pos//9] >> pos % 9 & 1:
+            print("A chess piece already occupies this position or the chess "
+                  "is not bigger than the existing chess. Cannot place here.")
+            return False
+        if self.chess[player-1][pos//9] == 0:
+            print("Exceeding the limit of two chess pieces for a player. "
+                  "No more chess pieces available for this player.")
+            return False
+        return True
+
+    def is_legal_move(self, pre_pos: int, pos: int, player: int) -> bool:
+        """Check if the position is valid for the player to perform a 'move' action
+
+        Parameters
+        ----------
+        pre_pos : int
+            selected position
+        pos : int
+            destination position
+        player : int
+
+        Returns
+        -------
+        bool
+            True: Valid
+            False: Invalid
+        """
+        if pre_pos == pos:
+            print("pre_pos cannot be equal to pos.")
+            return False
+        if pre_pos//9 != pos//9:
+            print("The layers must be the same.")
+            return False
+        if not self.key >> ((player-1)*27 + pre_pos) & 1:
+            print("There is no chess here, or it's not your chess.")
+            return False
+        occ0, occ01, free = self._layers()
+        above = (0, occ0, occ01)[pre_pos//9]
+        if above >> pre_pos % 9 & 1:
+            print("There is a chess piece on top of the selected chess piece.")
+            return False
+        if not free[pos//9] >> pos % 9 & 1:
+            print("The selected chess piece is not bigger than the "
+                  "destination chess piece.")
+            return False
+        return True
+
+    def put(self, pos: int, player: int):
+        """Put action
+
+        Parameters
+        ----------
+        pos : int
+            destination position
+        player : int
+        """
+        if self.is_legal_put(pos, player):
+            self.key |= 1 << ((player-1)*27 + pos)
+            self.chess[player-1][pos//9] -= 1
+            self.history.append((30, pos))
+
+    def move(self, pre_pos: int, pos: int, player: int):
+        """Move action
+
+        Parameters
+        ----------
+        pre_pos : int
+            selected position
+        pos : int
+            destination position
+        player : int
+        """
+        if self.is_legal_move(pre_pos, pos, player):
+            shift = (player-1)*27
+            self.key ^= (1 << (shift + pre_pos)) | (1 << (shift + pos))
+            self.history.append((pre_pos, pos))
+
+    def make_move(self, movement: tuple, player: int,
+                  check: bool = True) -> bool:
+        """Do a movement in place and push it on the undo stack
+
+        The piece counts `chess` are kept up to date, and the movement can be
+        taken back by `unmake_move`.
+
+        Parameters
+        ----------
+        movement : tuple
+            a movement in the format of `available_move`
+        player : int
+        check : bool, optional
+            validate the movement by `is_legal_put`/`is_legal_move`, movements
+            from `available_move` are always legal and can skip it,
+            by default True
+
+        Returns
+        -------
+        bool
+            True: Done
+            False: Invalid
+        """
+        shift = (player-1)*27
+        if movement[0] == 0:
+            pos = movement[1]
+            if check and not self.is_legal_put(pos, player):
+                return False
+            self.key |= 1 << (shift + pos)
+            self.chess[player-1][pos//9] -= 1
+            self.history.append((30, pos))
+        else:
+            pre_pos, pos = movement[1]
+            if check and not self.is_legal_move(pre_pos, pos, player):
+                return False
+            self.key ^= (1 << (shift + pre_pos)) | (1 << (shift + pos))
+            self.history.append(movement[1])
+        ply = self.ply
+        if ply == len(self.undo_moves):
+            self.undo_moves += [None] * ply
+            self.undo_players += [0] * ply
+        self.undo_moves[ply] = movement
+        self.undo_players[ply] = player
+        self.ply = ply + 1
+        return True
+
+    def unmake_move(self):
+        """Take back the last movement done by `make_move`"""
+        self.ply = ply = self.ply - 1
+        movement = self.undo_moves[ply]
+        player = self.undo_players[ply]
+        shift = (player-1)*27
+        if movement[0] == 0:
+            pos = movement[1]
+            self.key ^= 1 << (shift + pos)
+            self.chess[player-1][pos//9] += 1
+        else:
+            pre_pos, pos = movement[1]
+            self.key ^= (1 << (shift + pre_pos)) | (1 << (shift + pos))
+        self.history.pop()
+
+    def check_win(self) -> int:
+        """Return the state of chess
+
+        Returns
+        -------
+        int
+            0: no one win and tie
+            1: player 1 win
+            2: player 2 win
+            3: tie
+        """
+        key = self.key
+        occ = (key | key >> 27) & PLAYER_MASK
+        occ0 = occ & LAYER_MASK
+        occ01 = occ0 | (occ >> 9 & LAYER_MASK)
+        x = key >> 27
+        return WIN[(key & LAYER_MASK) | (key >> 9 & ~occ0 & LAYER_MASK)
+                   | (key >> 18 & ~occ01 & LAYER_MASK)
+                   | ((x & LAYER_MASK) | (x >> 9 & ~occ0 & LAYER_MASK)
+                      | (x >> 18 & ~occ01 & LAYER_MASK)) << 9]
+
+    def available_move(self, player: int) -> list:
+        """Return all available move for the player
+
+        The order is the same as `Board.available_move`.
+
+        Parameters
+        ----------
+        player : int
+
+        Returns
+        -------
+        list
+            Two type of tuple:
+            1. put action:
+                (0, position)
+            2. move action
+                (1, (selected_position, destination_position))
+        """
+        available = []
+        occ0, occ01, free = self._layers()
+        # unused chess to each available position
+        chess = self.chess[player-1]
+        for i in range(3):
+            if chess[i] == 0:
+                continue
+            base = i*9
+            for cell in BITS[free[i]]:
+                available.append((0, base + cell))
+        # move chess
+        p = self.key >> (player-1)*27
+        top0 = p & LAYER_MASK
+        top1 = p >> 9 & ~occ0 & LAYER_MASK
+        top2 = p >> 18 & ~occ01 & LAYER_MASK
+        for cell in BITS[top0 | top1 | top2]:
+            if top0 >> cell & 1:
+                layer = 0
+            elif top1 >> cell & 1:
+                layer = 1
+            else:
+                layer = 2
+            base = layer*9
+            for cell2 in BITS[free[layer] & ~(1 << cell)]:
+                available.append((1, (base + cell, base + cell2)))
+        return available
+
+    def unique_moves(self, player: int) -> list:
+        """`available_move` with one movement of each class of equivalent
+        movements
+
+        When the board is symmetric, the movements that a symmetry of the
+        board (see `stabilizer`) maps onto each other lead to symmetry
+        boards with the same result. Only the first of them in the order of
+        `available_move` is kept.
+        """
+        available = self.available_move(player)
+        fixed = self._fixed()
+        if fixed == 1:
+            return available
+        perms = [POSITION_SYMMETRY[s] for s in range(1, 8) if fixed >> s & 1]
+        unique = []
+        equivalent = set()
+        for movement in available:
+            if movement in equivalent:
+                continue
+            unique.append(movement)
+            if movement[0] == 0:
+                pos = movement[1]
+                equivalent.update((0, perm[pos]) for perm in perms)
+            else:
+                pre_pos, pos = movement[1]
+                equivalent.update((1, (perm[pre_pos], perm[pos]))
+                                  for perm in perms)
+        return unique
+
+
+_WIN = np.array(WIN, dtype=np.int8)
+
+
+def top_array(keys: np.ndarray, player: int) -> np.ndarray:
+    """Vectorized `BitBoard.top` for an int64 array of keys"""
+    occ = (keys | keys >> 27) & PLAYER_MASK
+    occ0 = occ & LAYER_MASK
+    occ01 = occ0 | (occ >> 9 & LAYER_MASK)
+    p = keys >> (player-1)*27
+    return ((p & LAYER_MASK) | (p >> 9 & ~occ0 & LAYER_MASK)
+            | (p >> 18 & ~occ01 & LAYER_MASK))
+
+
+def check_win_array(keys: np.ndarray) -> np.ndarray:
+    """Vectorized `BitBoard.check_win`
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        integer array of `BitBoard.key`
+
+    Returns
+    -------
+    np.ndarray
+        int8 array of the state of each board
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    return _WIN[top_array(keys, 1) | top_array(keys, 2) << 9]
+
+
+#
+# [Move code]
+# Every movement of a player is one of 243 codes:
+#   put:  code = position (0 ~ 26)
+#   move: code = 27 + (layer*9 + cell)*8 + d, 0 <= d < 8, where the
+#         destination cell is d if d < cell else d + 1 (the same layer)
+# MOVEMENTS[code]: the movement in the format of `available_move`
+# MOVE_CODE[movement]: the code of a movement
+#
+
+MOVEMENTS = [(0, pos) for pos in range(27)] + [
+    (1, (layer*9 + cell, layer*9 + (d if d < cell else d + 1)))
+    for layer in range(3) for cell in range(9) for d in range(8)
+]
+MOVE_CODE = {movement: code for code, movement in enumerate(MOVEMENTS)}
+_POPCOUNT = np.array([bin(mask).count('1') for mask in range(512)],
+                     dtype=np.int64)
+# _CELLS[mask*9 + i]: the i-th set bit of a 9-bit mask
+_CELLS = np.array([BITS[mask] + (0,) * (9 - len(BITS[mask]))
+                   for mask in range(512)], dtype=np.int64).ravel()
+_POWER2 = 1 << np.arange(27, dtype=np.int64)
+
+
+def keys_array(boards: np.ndarray) -> np.ndarray:
+    """Vectorized `BitBoard.array2key` for boards array[n, layer, row, col]"""
+    boards = np.asarray(boards).reshape(-1, 27)
+    return (((boards == 1) @ _POWER2) | ((boards == 2) @ _POWER2) << 27)
+
+
+def boards_array(keys: np.ndarray) -> np.ndarray:
+    """Vectorized `BitBoard.board`, return int8 array[n, layer, row, col]"""
+    keys = np.asarray(keys, dtype=np.int64).reshape(-1, 1)
+    o = (keys & _POWER2) != 0
+    x = (keys >> 27 & _POWER2) != 0
+    return (o + 2 * x).astype(np.int8).reshape(-1, 3, 3, 3)
+
+
+def available_move_array(keys: np.ndarray, player: int,
+                         puts: bool = True) -> tuple:
+    """Vectorized `BitBoard.available_move` for many boards
+
+    The children of each board are in the same order as `available_move`.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        integer array of `BitBoard.key`, or boards array[n, layer, row, col]
+        (then the children are boards as well)
+    player : int
+    puts : bool, optional
+        generate the put actions, by default True
+
+    Returns
+    -------
+    tuple
+        (parent, code, child): int64 array of the index of the board, int16
+        array of the move code (see [Move code]) and the children
+    """
+    is_board = np.ndim(keys) == 4
+    keys = keys_array(keys) if is_board else np.asarray(keys, np.int64)
+    n = len(keys)
+    occ = (keys | keys >> 27) & PLAYER_MASK
+    occ0 = occ & LAYER_MASK
+    occ01 = occ0 | (occ >> 9 & LAYER_MASK)
+    free = np.stack([~occ0 & LAYER_MASK, ~occ01 & LAYER_MASK,
+                     ~(occ01 | occ >> 18) & LAYER_MASK])
+    shift = (player-1)*27
+    p = keys >> shift
+
+    # 12 groups of children for each board, in the order of available_move:
+    # the puts of the 3 layers, then the moves from the 9 cells
+    masks = np.zeros((12, n), dtype=np.int64)  # cells of the group
+    layers = np.zeros((12, n), dtype=np.int64)
+    if puts:
+        for layer in range(3):
+            # two chess of each size (see `chess_left`)
+            can_put = _POPCOUNT[p >> 9*layer & LAYER_MASK] < 2
+            masks[layer] = np.where(can_put, free[layer], 0)
+            layers[layer] = layer
+    tops = np.stack([p & LAYER_MASK, p >> 9 & ~occ0 & LAYER_MASK,
+                     p >> 18 & ~occ01 & LAYER_MASK])
+    for cell in range(9):
+        on_top = tops >> cell & 1
+        layer = np.where(on_top[0], 0, np.where(on_top[1], 1, 2))
+        has = on_top.any(axis=0)
+        layers[3 + cell] = layer
+        masks[3 + cell] = np.where(
+            has, np.take_along_axis(free, layer[None], 0)[0] & ~(1 << cell),
+            0)
+    counts = _POPCOUNT[masks]
+    offsets = np.cumsum(counts.T.ravel()).reshape(n, 12).T - counts
+    total = int(counts.sum())
+
+    parent = np.empty(total, dtype=np.int64)
+    code = np.empty(total, dtype=np.int16)
+    child = np.empty(total, dtype=np.int64)
+    for group in range(12):
+        i = np.flatnonzero(counts[group])
+        if len(i) == 0:
+            continue
+        c = counts[group, i]
+        idx = np.repeat(i, c)
+        # index of the child in the group
+        within = np.arange(len(idx)) - np.repeat(np.cumsum(c) - c, c)
+        cells = _CELLS[np.repeat(masks[group, i] * 9, c) + within]
+        out = np.repeat(offsets[group, i], c) + within
+        parent[out] = idx
+        if group < 3:
+            pos = group*9 + cells
+            code[out] = pos
+            child[out] = np.repeat(keys[i], c) | _POWER2[pos] << shift
+        else:
+            cell = group - 3
+            base = layers[group, i] * 9
+            lifted = keys[i] ^ _POWER2[base + cell] << shift
+            base = np.repeat(base, c)
+            code[out] = 27 + (base + cell)*8 + cells - (cells > cell)
+            child[out] = np.repeat(lifted, c) | _POWER2[base + cells] << shift
+    if is_board:
+        child = boards_array(child)
+    return parent, code, child
+
+
+if __name__ == "__main__":
+    # Compare with the NumPy board on random positions
+    import random
+
+    random.seed(0)
+    n_checked = 0
+    seen = []
+    for game in range(300):
+        board = Board(history=[])
+        bit_board = BitBoard()
+        player = 1
+        for turn in range(40):
+            moves = bit_board.available_move(player)
+            assert board.available_move(player) == moves
+            assert board.check_win() == bit_board.check_win()
+            assert (board.chess == np.array(bit_board.chess)).all()
+            assert (board.board == bit_board.board).all()
+            n_checked += 1
+            seen.append(bit_board.copy())
+            for movement in moves:
+                key, chess = bit_board.key, bit_board.chess_left()
+                bit_board.make_move(movement, player, False)
+                assert bit_board.chess == bit_board.chess_left()
+                bit_board.unmake_move()
+                assert bit_board.key == key and bit_board.chess == chess
+            if board.check_win():
+                break
+            movement = random.choice(moves)
+            if movement[0] == 0:
+                board.put(movement[1], player)
+                bit_board.put(movement[1], player)
+            else:
+                board.move(*movement[1], player)
+                bit_board.move(*movement[1], player)
+            player = -player + 3
+    print("Same as Board on", n_checked, "positions")
+
+    # Compare the symmetry with np.rot90 and np.flip
+    for bit_board in random.sample(seen, 500):
+        b = bit_board.board
+        for i, k in enumerate(bit_board.symmetric_keys()):
+            br = np.rot90(b, i // 2, axes=(1, 2))
+            br = np.flip(br, 1) if i % 2 else br
+            assert BitBoard(br).key == k
+    print("Same symmetry as np.rot90 and np.flip")
+
+    # unique_moves reaches the same positions under symmetry
+    symmetric = 0
+    for bit_board in seen:
+        keys = bit_board.symmetric_keys()
+        assert bit_board.stabilizer() == [s for s, k in enumerate(keys)
+                                          if k == bit_board.key]
+        symmetric += len(bit_board.stabilizer()) > 1
+        for player in (1, 2):
+            children = []
+            for moves in (bit_board.available_move(player),
+                          bit_board.unique_moves(player)):
+                b = bit_board.copy()
+                children.append(set())
+                for movement in moves:
+                    b.make_move(movement, player, False)
+                    children[-1].add(min(b.symmetric_keys()))
+                    b.unmake_move()
+            assert children[0] == children[1]
+    print("Same children of unique_moves on", len(seen), "positions,",
+          symmetric, "symmetric")
+
+    keys = np.array([b.key for b in seen], dtype=np.int64)
+    assert check_win_array(keys).tolist() == [b.check_win() for b in seen]
+
+    # Compare the batch move generation with available_move
+    import timeit
+
+    boards = np.stack([b.board for b in seen])
+    assert (keys_array(boards) == keys).all()
+    assert (boards_array(keys) == boards).all()
+    for player in (1, 2):
+        parent, code, child = available_move_array(keys, player)
+        expected = [(i, MOVE_CODE[movement])
+                    for i, b in enumerate(seen)
+                    for movement in b.available_move(player)]
+        assert list(zip(parent.tolist(), code.tolist())) == expected
+        for i, c, k in zip(parent.tolist(), code.tolist(), child.tolist()):
+            b = seen[i].copy()
+            b.make_move(MOVEMENTS[c], player, False)
+            assert b.key == k
+        _, _, child_boards = available_move_array(boards, player)
+        assert (keys_array(child_boards) == child).all()
+    print("Same as available_move on", len(seen), "positions")
+
+    keys = np.resize(keys, 100000)
+    t = min(timeit.repeat(lambda: available_move_array(keys, 1), number=1,
+                          repeat=3))
+    t1 = timeit.timeit(
+        lambda: [BitBoard(key).available_move(1) for key in keys[:10000]],
+        number=1) * 10
+    sample = [Board(b, history=[]) for b in boards_array(keys[:1000])]
+    t2 = timeit.timeit(lambda: [b.available_move(1) for b in sample],
+                       number=1) * 100
+    print(f"boards/s: available_move_array {len(keys) / t:.0f}, "
+          f"BitBoard.available_move {len(keys) / t1:.0f}, "
+          f"Board.available_move {len(keys) / t2:.0f}")
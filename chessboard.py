@@ -6,6 +6,7 @@ Provide operations for the game
 from __future__ import annotations
 
 import time
+from collections.abc import Sequence
 
 import numpy as np
 from IPython.display import clear_output
@@ -32,6 +33,47 @@ winning_combinations = [
     [0, 4, 8], [2, 4, 6]              # Diagonals
 ]
 
+# WIN_TABLE[code]: the result of `Board.check_win` for a top view, where
+# code = sum(top[cell] * 3**cell), top[cell] is 0 (empty), 1 (O) or 2 (X)
+POWER3 = 3 ** np.arange(9)
+_tops = (np.arange(3**9)[:, None] // POWER3) % 3
+_lines = _tops[:, winning_combinations]
+WIN_TABLE = (
+    (_lines == 1).all(axis=2).any(axis=1).astype(np.int8)
+    + 2 * (_lines == 2).all(axis=2).any(axis=1).astype(np.int8)
+)
+del _tops, _lines
+
+
+def top_code(boards: np.ndarray) -> np.ndarray:
+    """Return the base 3 code of the top view, see `WIN_TABLE`
+
+    Parameters
+    ----------
+    boards : np.ndarray
+        array[..., layer, row, column]
+    """
+    b = boards.reshape(boards.shape[:-3] + (3, 9))
+    top = np.where(b[..., 0, :] > 0, b[..., 0, :],
+                   np.where(b[..., 1, :] > 0, b[..., 1, :], b[..., 2, :]))
+    return top @ POWER3
+
+
+def check_win_batch(boards: np.ndarray) -> np.ndarray:
+    """Vectorized `Board.check_win` for an array of boards
+
+    Parameters
+    ----------
+    boards : np.ndarray
+        array[n, layer, row, column]
+
+    Returns
+    -------
+    np.ndarray
+        int8 array of the state of each board, see `Board.check_win`
+    """
+    return WIN_TABLE[top_code(np.asarray(boards))]
+
 
 class Board:
     """Chess board
@@ -50,6 +92,7 @@ class Board:
             self.board = board
         self.history = history
         self.chess = self.chess_left()  # the unused chess
+        self.undo = []  # (movement, player) done by `make_move`
 
     def __getitem__(self, key):
         return self.board[key]
@@ -142,7 +185,9 @@ class Board:
 
     def copy(self) -> Board:
         """Return Board copy"""
-        return Board(np.copy(self.board), history=self.history.copy())
+        board = Board(np.copy(self.board), history=self.history.copy())
+        board.undo = self.undo.copy()
+        return board
 
     def pos2ind(self, pos: int) -> tuple:
         """Convert position to index of board
@@ -270,6 +315,59 @@ class Board:
             self.board[self.pos2ind(pre_pos)] = 0
             self.history.append((pre_pos, pos))
 
+    def make_move(self, movement: tuple, player: int,
+                  check: bool = True) -> bool:
+        """Do a movement in place and push it on the undo stack
+
+        The left chess `chess` is kept up to date, and the movement can be
+        taken back by `unmake_move`.
+
+        Parameters
+        ----------
+        movement : tuple
+            a movement in the format of `available_move`
+        player : int
+        check : bool, optional
+            validate the movement by `is_legal_put`/`is_legal_move`, movements
+            from `available_move` are always legal and can skip it,
+            by default True
+
+        Returns
+        -------
+        bool
+            True: Done
+            False: Invalid
+        """
+        if movement[0] == 0:
+            pos = movement[1]
+            if check and not self.is_legal_put(pos, player):
+                return False
+            self.board[pos//9, pos//3 % 3, pos % 3] = player
+            self.chess[player-1][pos//9] -= 1
+            self.history.append((30, pos))
+        else:
+            pre_pos, pos = movement[1]
+            if check and not self.is_legal_move(pre_pos, pos, player):
+                return False
+            self.board[pos//9, pos//3 % 3, pos % 3] = player
+            self.board[pre_pos//9, pre_pos//3 % 3, pre_pos % 3] = 0
+            self.history.append((pre_pos, pos))
+        self.undo.append((movement, player))
+        return True
+
+    def unmake_move(self):
+        """Take back the last movement done by `make_move`"""
+        movement, player = self.undo.pop()
+        if movement[0] == 0:
+            pos = movement[1]
+            self.board[pos//9, pos//3 % 3, pos % 3] = 0
+            self.chess[player-1][pos//9] += 1
+        else:
+            pre_pos, pos = movement[1]
+            self.board[pre_pos//9, pre_pos//3 % 3, pre_pos % 3] = player
+            self.board[pos//9, pos//3 % 3, pos % 3] = 0
+        self.history.pop()
+
     def check_win(self) -> int:
         """Return the state of chess
 
@@ -281,34 +379,7 @@ class Board:
             2: player 2 win
             3: tie
         """
-        top = np.zeros((3, 3), dtype=np.int8)
-        for row in range(3):
-            for col in range(3):
-                for i in range(3):
-                    if self.board[i][row][col] == 1:
-                        top[row][col] = 1
-                        break
-                    elif self.board[i][row][col] == 2:
-                        top[row][col] = 2
-                        break
-                    else:
-                        pass
-
-        def player_win(player):
-            for combo in winning_combinations:
-                if all(top[i//3][i % 3] == player for i in combo):
-                    return True
-            return False
-        p1_is_win = player_win(1)
-        p2_is_win = player_win(2)
-        if p1_is_win and p2_is_win:
-            return 3
-        elif p1_is_win:
-            return 1
-        elif p2_is_win:
-            return 2
-        else:
-            return 0
+        return int(WIN_TABLE[top_code(self.board)])
 
     def available_move(self, player: int) -> list:
         """Return all available move for the player
@@ -369,25 +440,138 @@ class Board:
         return available
 
 
+class _HistoryView(Sequence):
+    """The first `length` movements of a history, without a copy"""
+
+    def __init__(self, history: list, length: int = 0):
+        self.history = history
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.history[:self.length][i]
+        if not -self.length <= i < self.length:
+            raise IndexError("history index out of range")
+        return self.history[i % self.length]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def copy(self) -> list:
+        return self.history[:self.length]
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+
 class BoardHistory:
+    """Random access to the positions of a game
+
+    A snapshot of the board is kept every `SNAPSHOT_INTERVAL` movements and
+    the history is the delta log between them, so `goto` replays at most
+    SNAPSHOT_INTERVAL // 2 movements, and `forward`/`back` apply or undo one.
+
+    Position n is the board after history[:n+1], -1 is the empty board.
+    """
+
+    SNAPSHOT_INTERVAL = 16
+
     def __init__(self, board: Board):
         self.board = board
         self.history_len = len(board.history)
+        # snapshots[k]: (board bytes, chess bytes) of the position
+        # k * SNAPSHOT_INTERVAL - 1
+        self.snapshots = []
+        # the board at position n, its history a view of board.history
+        self.current = Board(history=_HistoryView(board.history))
+        self.n = -1
+        for n in range(-1, self.history_len):
+            if n > -1:
+                self._apply(n)
+            if (n + 1) % self.SNAPSHOT_INTERVAL == 0:
+                self.snapshots.append((self.current.board.tobytes(),
+                                       self.current.chess.tobytes()))
+
+    def _apply(self, n: int):
+        """Do the movement n at position n - 1, without validation"""
+        movement = self.board.history[n]
+        player = n % 2 + 1
+        board, pos = self.current.board, movement[1]
+        board[pos//9, pos//3 % 3, pos % 3] = player
+        if movement[0] == 30:
+            self.current.chess[player-1][pos//9] -= 1
+        else:
+            pre_pos = movement[0]
+            board[pre_pos//9, pre_pos//3 % 3, pre_pos % 3] = 0
+        self.current.history.length = n + 1
+        self.n = n
+
+    def _revert(self):
+        """Undo the movement n at position n"""
+        n = self.n
+        movement = self.board.history[n]
+        player = n % 2 + 1
+        board, pos = self.current.board, movement[1]
+        board[pos//9, pos//3 % 3, pos % 3] = 0
+        if movement[0] == 30:
+            self.current.chess[player-1][pos//9] += 1
+        else:
+            pre_pos = movement[0]
+            board[pre_pos//9, pre_pos//3 % 3, pre_pos % 3] = player
+        self.current.history.length = n
+        self.n = n - 1
+
+    def _load(self, k: int):
+        """Go to the snapshot k"""
+        board, chess = self.snapshots[k]
+        n = k * self.SNAPSHOT_INTERVAL - 1
+        self.current.board[...] = np.frombuffer(
+            board, dtype=np.int8).reshape(3, 3, 3)
+        self.current.chess[...] = np.frombuffer(
+            chess, dtype=np.int8).reshape(2, 3)
+        self.current.history.length = n + 1
+        self.n = n
 
     def goto(self, n: int):
-        if n < self.history_len:
-            pass
-        else:
+        """Return the board at position n
+
+        The returned board is the same object at every call, changed by
+        the next `goto`, `forward` or `back`, and its history is a read-only
+        view of the game: use `Board.copy` to keep or change it.
+
+        Returns
+        -------
+        Board or None
+            None: n is not in the game
+        """
+        if not -1 <= n < self.history_len:
             return None
-        board = Board()
-        player = 1
-        for movement in self.board.history[:n+1]:
-            if movement[0] == 30:
-                board.put(movement[1], player)
-            else:
-                board.move(*movement, player)
-            player = -player + 3
-        return board
+        interval = self.SNAPSHOT_INTERVAL
+        # the snapshots before and after the position, or the board now
+        k = (n + 1) // interval
+        options = [(abs(n - self.n), None),
+                   (n - (k * interval - 1) + 1, k)]
+        if k + 1 < len(self.snapshots):
+            options.append(((k + 1) * interval - 1 - n + 1, k + 1))
+        _, k = min(options, key=lambda option: option[0])
+        if k is not None:
+            self._load(k)
+        while self.n < n:
+            self._apply(self.n + 1)
+        while self.n > n:
+            self._revert()
+        return self.current
+
+    def forward(self):
+        """Return the board after the next movement, see `goto`"""
+        return self.goto(self.n + 1)
+
+    def back(self):
+        """Return the board before the last movement, see `goto`"""
+        return self.goto(self.n - 1)
 
     def show(self, n: int):
         self.goto(n).show()
@@ -409,12 +593,7 @@ class BoardHistory:
             elif _input == 'q':
                 break
             else:
-                movement = self.board.history[n]
-                player = n % 2 + 1
-                if movement[0] == 30:
-                    board.put(movement[1], player)
-                else:
-                    board.move(*movement, player)
+                board = self.forward()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,13 @@
+import os
 import pickle
+import time
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
 
-def save(board_now, boards_o, board_state_o, boards_x, board_state_x, is_finish):
+
+def save(board_now, board_state_o, board_state_x, is_finish):
     date_time_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     directory_path = Path("data") / Path(date_time_str)
     directory_path.mkdir(parents=True, exist_ok=True)
@@ -12,26 +16,184 @@ def save(board_now, boards_o, board_state_o, boards_x, board_state_x, is_finish)
     with open(info_file, "w") as file:
         file.write(
             f"is_finish: {is_finish}\n"
-            f"len(boards_o): {len(boards_o)}\n"
             f"len(board_state_o): {len(board_state_o)}\n"
-            f"len(boards_x): {len(boards_x)}\n"
             f"len(board_state_x): {len(board_state_x)}\n"
         )
 
     with open(directory_path / "board_now.pkl", "wb") as file:
         pickle.dump(board_now, file)
-    with open(directory_path / "boards_o.pkl", "wb") as file:
-        pickle.dump(boards_o, file)
     with open(directory_path / "board_state_o.pkl", "wb") as file:
         pickle.dump(board_state_o, file)
-    with open(directory_path / "boards_x.pkl", "wb") as file:
-        pickle.dump(boards_x, file)
     with open(directory_path / "board_state_x.pkl", "wb") as file:
         pickle.dump(board_state_x, file)
 
     print("Data:", directory_path)
 
 
+#
+# [Checkpoint]
+# directory/segment_00000.bin, segment_00001.bin, ...:
+#   the positions solved since the previous segment, records of RECORD
+#   player: the board_state (1: board_state_o, 2: board_state_x)
+#   state: 1: True, 2: False
+# directory/stack.pkl:
+#   the board, the stack of `solve.iterative_turns` and the positions in
+#   progress (None) at the last segment, replaced atomically
+# directory/cold_o.bin, cold_x.bin:
+#   the cold tiers of `ttable.TwoTierTable` (--hot-entries), flushed with
+#   every segment and opened again by --resume
+#
+
+RECORD = np.dtype([("ha", "<u4"), ("player", "u1"), ("state", "u1")])
+
+
+def new_directory() -> Path:
+    """Return a new directory data/<date_time>"""
+    date_time_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    directory_path = Path("data") / Path(date_time_str)
+    directory_path.mkdir(parents=True, exist_ok=True)
+    return directory_path
+
+
+class Checkpoint:
+    """Incremental checkpoint of the solve
+
+    Only the positions solved since the previous checkpoint are written, a
+    long run can be continued by `load_checkpoint` after a restart.
+
+    Parameters
+    ----------
+    directory : str | Path
+    board_state_o, board_state_x : dict
+        the tables of solve.py
+    interval : float, optional
+        seconds between two checkpoints, by default 600
+    """
+
+    def __init__(self, directory, board_state_o: dict, board_state_x: dict,
+                 interval: float = 600) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.tables = (board_state_o, board_state_x)
+        self.interval = interval
+        self.segment = len(list(self.directory.glob("segment_*.bin")))
+        # entries already in a segment, dicts keep the insertion order
+        self.written = [len(board_state_o), len(board_state_x)]
+        # the positions in progress at the last segment
+        self.pending = [
+            list(table.in_progress) if hasattr(table, "take_log") else
+            [ha for ha, state in table.items() if state is None]
+            for table in self.tables
+        ]
+        for table in self.tables:
+            if hasattr(table, "take_log"):
+                table.take_log()  # start the log of a `ttable.BoundedTable`
+        self.next_time = time.time() + interval
+        self.count = 0
+        self.stop = False  # save and exit at the next step
+
+    def due(self) -> bool:
+        """Return True if it is time to `save`, cheap enough for every
+        step of the search"""
+        self.count += 1
+        if self.count & 0x3FF:
+            return self.stop
+        return self.stop or time.time() >= self.next_time
+
+    def _new_records(self, player: int) -> list:
+        table = self.tables[player-1]
+        if hasattr(table, "take_log"):
+            # a `ttable.BoundedTable` forgets the evicted positions, its log
+            # has the values stored since the last segment
+            self.pending[player-1] = list(table.in_progress)
+            return [(ha, player, 1 if state else 2)
+                    for ha, state in table.take_log()]
+        records = []
+        pending = []
+        for ha in self.pending[player-1]:
+            state = table[ha]
+            if state is None:
+                pending.append(ha)
+            else:
+                records.append((ha, player, 1 if state else 2))
+        n = len(table) - self.written[player-1]
+        for ha, state in reversed(table.items()):
+            if n == 0:
+                break
+            n -= 1
+            if state is None:
+                pending.append(ha)
+            else:
+                records.append((ha, player, 1 if state else 2))
+        self.written[player-1] = len(table)
+        self.pending[player-1] = pending
+        return records
+
+    def save(self, board, stack: list, r, result=None) -> None:
+        """Write a segment of the new positions and the search stack
+
+        Parameters
+        ----------
+        board : BitBoard
+            the board of the search
+        stack, r :
+            the state of `solve.iterative_turns`
+        result : bool, optional
+            the result of the root when the solve finished
+        """
+        records = np.array(self._new_records(1) + self._new_records(2),
+                           dtype=RECORD)
+        segment_file = self.directory / f"segment_{self.segment:05d}.bin"
+        records.tofile(segment_file.with_suffix(".tmp"))
+        os.replace(segment_file.with_suffix(".tmp"), segment_file)
+        self.segment += 1
+        for table in self.tables:
+            if hasattr(table, "flush"):
+                # the cold tier of a `ttable.TwoTierTable` keeps the
+                # positions evicted before they were in a segment
+                table.flush()
+
+        state = {"board": board, "stack": stack, "r": r,
+                 "pending": self.pending, "result": result}
+        stack_file = self.directory / "stack.pkl"
+        with open(stack_file.with_suffix(".tmp"), "wb") as file:
+            pickle.dump(state, file)
+        os.replace(stack_file.with_suffix(".tmp"), stack_file)
+        self.next_time = time.time() + self.interval
+        print("Checkpoint:", segment_file, len(records), "positions")
+        for table in self.tables:
+            if hasattr(table, "report"):
+                print(table.report())
+
+
+def load_checkpoint(directory, board_state_o: dict,
+                    board_state_x: dict) -> dict:
+    """Load the segments of a `Checkpoint` into the tables
+
+    Returns
+    -------
+    dict
+        board, stack, r, result: see `Checkpoint.save`
+    """
+    directory = Path(directory)
+    tables = (board_state_o, board_state_x)
+    for segment_file in sorted(directory.glob("segment_*.bin")):
+        if segment_file.stat().st_size == 0:
+            continue
+        records = np.memmap(segment_file, dtype=RECORD, mode="r")
+        for player, table in zip((1, 2), tables):
+            selected = records[records["player"] == player]
+            table.update(zip(selected["ha"].tolist(),
+                             (selected["state"] == 1).tolist()))
+    with open(directory / "stack.pkl", "rb") as file:
+        state = pickle.load(file)
+    for table, pending in zip(tables, state["pending"]):
+        for ha in pending:
+            # solved in a segment written after stack.pkl
+            table.setdefault(ha, None)
+    return state
+
+
 if __name__ == "__main__":
     import chessboard
 
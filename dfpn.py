@@ -0,0 +1,189 @@
+"""Depth-first proof-number search (df-pn) for "O will win"
+
+The boolean DFS of solve.py searches the children in a fixed order. df-pn
+keeps a proof number (how many positions at least must be proved) and a
+disproof number for every position in a table and always searches the
+child that is the cheapest to prove or disprove, with thresholds so that
+it stays depth-first.
+
+O to move is an OR node (O needs one winning movement), X to move is an AND
+node (O needs to win after all movements of X). The finished games follow
+`solve.o_turns`/`solve.x_turns`: a tie is not a win of O. A position that
+repeats one on the current path is not a win of O either, the same as the
+positions in progress (None) of the DFS. A disproof that relies on such a
+repetition is only reused while the repeated positions are on the path,
+otherwise a position could be disproved on one path and the result reused
+on another one where it does not hold.
+"""
+
+from bitboard import BitBoard
+from solve import similar
+
+INF = 1 << 40
+
+# proof_numbers[canonical index * 2 + player - 1]: (pn, dn) of the position
+# with the player to move
+proof_numbers = {}
+# repetitions[key]: the positions that a disproof depends on, the disproof
+# only holds while they are all on the path (they were repeated)
+repetitions = {}
+
+_UNKNOWN = (1, 1)
+_NO_REPETITION = frozenset()
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.nodes = 0  # positions expanded
+
+
+counter = Counter()
+
+
+def _lookup(child: int, path: set) -> tuple:
+    """Return (pn, dn, repeated positions) of a child"""
+    if child in path:
+        return INF, 0, frozenset((child,))
+    depends = repetitions.get(child, _NO_REPETITION)
+    if depends and not depends <= path:
+        return (*_UNKNOWN, _NO_REPETITION)  # disproved on another path
+    return (*proof_numbers.get(child, _UNKNOWN), depends)
+
+
+def _store(key: int, pn: int, dn: int, depends=_NO_REPETITION) -> None:
+    proof_numbers[key] = (pn, dn)
+    depends = depends - {key}
+    if depends:
+        repetitions[key] = depends
+    else:
+        repetitions.pop(key, None)
+
+
+def _mid(board: BitBoard, player: int, pn_th: int, dn_th: int, path: set,
+         key_of):
+    """Multiple iterative deepening of a position, a generator
+
+    Yields (player, pn threshold, dn threshold) of a child to search after
+    moving the board to it, the child is searched before the generator is
+    resumed. The result is stored in `proof_numbers`.
+    """
+    counter.nodes += 1
+    key = key_of(board) * 2 + player - 1
+    or_node = player == 1
+    children = []  # [movement, key of the child]
+    # the equivalent movements of a symmetric board are generated once, a
+    # child counted twice would add its numbers twice to the sums
+    for movement in board.unique_moves(player):
+        board.make_move(movement, player, False)
+        win_status = board.check_win()
+        child = key_of(board) * 2 + 2 - player
+        board.unmake_move()
+        if win_status:
+            if (win_status == 1) == or_node:
+                # O wins at once (OR) or O does not win at once (AND)
+                _store(key, *((0, INF) if or_node else (INF, 0)))
+                return
+            continue  # the same as a child that can not be chosen
+        children.append((movement, child))
+    if not children:
+        _store(key, *((INF, 0) if or_node else (0, INF)))
+        return
+    path.add(key)
+    while True:
+        # proof and disproof numbers of the children, the repetitions are
+        # not a win of O
+        numbers = [_lookup(child, path) for _, child in children]
+        if or_node:
+            pn = min(p for p, _, _ in numbers)
+            dn = min(sum(d for _, d, _ in numbers), INF)
+            # the child with the smallest pn
+            best = min(range(len(numbers)), key=lambda i: numbers[i][0])
+            second = min((numbers[i][0] for i in range(len(numbers))
+                          if i != best), default=INF)
+        else:
+            pn = min(sum(p for p, _, _ in numbers), INF)
+            dn = min(d for _, d, _ in numbers)
+            # the child with the smallest dn, not repeated if possible
+            best = min(range(len(numbers)),
+                       key=lambda i: (numbers[i][1], len(numbers[i][2])))
+            second = min((numbers[i][1] for i in range(len(numbers))
+                          if i != best), default=INF)
+        if pn >= pn_th or dn >= dn_th or pn == 0 or dn == 0:
+            depends = _NO_REPETITION
+            if dn == 0:
+                if or_node:
+                    depends = depends.union(*(r for _, _, r in numbers))
+                else:
+                    depends = numbers[best][2]
+            _store(key, pn, dn, depends)
+            path.discard(key)
+            return
+        child_pn, child_dn, _ = numbers[best]
+        # thresholds with the 1 + 1/4 trick, so that the search does not
+        # switch between two children too often
+        if or_node:
+            child_pn_th = min(pn_th, second + 1 + second // 4)
+            child_dn_th = min(dn_th - dn + child_dn, INF)
+        else:
+            child_pn_th = min(pn_th - pn + child_pn, INF)
+            child_dn_th = min(dn_th, second + 1 + second // 4)
+        board.make_move(children[best][0], player, False)
+        yield 3 - player, child_pn_th, child_dn_th
+        board.unmake_move()
+
+
+def dfpn_turns(board: BitBoard, player: int = 1, key_of=similar) -> bool:
+    """Return True if O will win, the df-pn version of `solve.o_turns`
+    (player 1) and `solve.x_turns` (player 2)
+
+    The children are searched through an explicit stack of `_mid`
+    generators, the board is changed in place and restored.
+
+    Parameters
+    ----------
+    board : BitBoard
+    player : int, optional
+        the player to move, by default 1
+    key_of : callable, optional
+        key_of(board) -> the key of the board in `proof_numbers`, by
+        default `solve.similar` of the imported solve (the `similar` of
+        the script solve.py with --zobrist: the Zobrist keys)
+    """
+    path = set()
+    stack = [_mid(board, player, INF, INF, path, key_of)]
+    while stack:
+        try:
+            child_player, pn_th, dn_th = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            continue
+        stack.append(_mid(board, child_player, pn_th, dn_th, path, key_of))
+    pn, _ = proof_numbers[key_of(board) * 2 + player - 1]
+    return pn == 0
+
+
+if __name__ == "__main__":
+    import time
+
+    import solve
+    from ordering import BENCHMARK_POSITIONS
+
+    # nodes expanded by df-pn and by the DFS of solve.py, with the cutoff
+    # (the DFS without it does not finish on these positions)
+    solve.cutoff = True
+    for key, player in [(0, 1)] + BENCHMARK_POSITIONS:
+        proof_numbers.clear()
+        repetitions.clear()
+        counter.nodes = 0
+        start = time.time()
+        result = dfpn_turns(BitBoard(key), player)
+        t = time.time() - start
+        solve.board_state_o.clear()
+        solve.board_state_x.clear()
+        solve.status.nodes = 0
+        start = time.time()
+        expected = solve.iterative_turns(BitBoard(key), player)
+        t0 = time.time() - start
+        assert result == expected
+        print(f"{key} {player} O will win: {result}, df-pn {counter.nodes} "
+              f"nodes {t:.2f}s, DFS {solve.status.nodes} nodes {t0:.2f}s")
@@ -0,0 +1,296 @@
+"""Compact binary records of games
+
+A movement is one byte, its `bitboard.MOVE_CODE` (27 puts and 216 moves),
+so a game of n movements takes n bytes plus 9 bytes of index, instead of
+the pickled tuples of `Board.history`. The files are memory-mapped: the
+reader gives random access by game index without loading the file, and
+the writer streams the games into a growing mapping.
+"""
+
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+
+from bitboard import MOVEMENTS
+from chessboard import Board, BoardHistory
+
+#
+# [File]
+# header (HEADER), then the movement codes of all games one after another
+# (uint8), then the index at index_offset:
+#   offsets: uint64 [games + 1], game i is the bytes offsets[i]:offsets[i+1]
+#            of the movements (counted from the end of the header)
+#   results: uint8 [games], `Board.check_win` at the end of the game
+# The header is written with games = 0 when the file is created, so a file
+# that was not closed reads as an empty file.
+#
+
+MAGIC = b"GGRC"
+VERSION = 1
+HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("reserved", "<u2"),
+                   ("games", "<u8"), ("index_offset", "<u8")])
+
+# HISTORY_CODE[entry of Board.history]: the movement code, and back
+HISTORY = [(30, m[1]) if m[0] == 0 else m[1] for m in MOVEMENTS]
+HISTORY_CODE = {entry: code for code, entry in enumerate(HISTORY)}
+
+
+def encode(history: list) -> bytes:
+    """Return the codes of a `Board.history`"""
+    return bytes(HISTORY_CODE[entry] for entry in history)
+
+
+def decode(codes) -> list:
+    """Return the `Board.history` of the codes"""
+    return [HISTORY[code] for code in bytes(codes)]
+
+
+def to_board_history(codes) -> BoardHistory:
+    """Return the `BoardHistory` of a game"""
+    board = Board(history=decode(codes))
+    history = BoardHistory(board)
+    # the board of the game is the last position
+    board.board[...] = history.current.board
+    board.chess[...] = history.current.chess
+    return history
+
+
+def from_board_history(history: BoardHistory) -> bytes:
+    """Return the codes of a `BoardHistory`"""
+    return encode(history.board.history)
+
+
+class GameWriter:
+    """Append games to a record file (see [File])
+
+    Use as a context manager or call `close`, the index is written at the
+    end.
+
+    Parameters
+    ----------
+    path : str | Path
+        the file, created (or emptied)
+    capacity : int, optional
+        the bytes of movements mapped at first, doubled when full,
+        by default 1 MiB
+    """
+
+    def __init__(self, path, capacity: int = 1 << 20) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "w+b")
+        self._capacity = max(capacity, 1)
+        self._resize(HEADER.itemsize + self._capacity)
+        self._mmap[:HEADER.itemsize] = np.array(
+            [(MAGIC, VERSION, 0, 0, HEADER.itemsize)], dtype=HEADER).tobytes()
+        self.size = 0  # bytes of movements
+        self.offsets = [0]
+        self.results = []
+
+    def _resize(self, size: int) -> None:
+        os.ftruncate(self._file.fileno(), size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def write(self, codes, result: int = 0) -> None:
+        """Append a game
+
+        Parameters
+        ----------
+        codes : bytes | np.ndarray
+            the movement codes, see `encode`
+        result : int, optional
+            `Board.check_win` at the end, by default 0
+        """
+        codes = bytes(codes)
+        end = self.size + len(codes)
+        if end > self._capacity:
+            while end > self._capacity:
+                self._capacity *= 2
+            self._mmap.close()
+            self._resize(HEADER.itemsize + self._capacity)
+        start = HEADER.itemsize + self.size
+        self._mmap[start:start + len(codes)] = codes
+        self.size = end
+        self.offsets.append(end)
+        self.results.append(result)
+
+    def write_batch(self, codes, lengths, results) -> None:
+        """Append many games at once
+
+        Parameters
+        ----------
+        codes : bytes | np.ndarray
+            the movement codes of the games one after another
+        lengths, results : array_like
+            the movements and `Board.check_win` of each game
+        """
+        ends = self.size + np.cumsum(lengths, dtype=np.int64)
+        self.write(codes, 0)
+        self.offsets[-1:] = ends.tolist()
+        self.results[-1:] = np.asarray(results, dtype=np.uint8).tolist()
+
+    def write_history(self, history: BoardHistory) -> None:
+        """Append a game from a `BoardHistory`"""
+        board = history.goto(history.history_len - 1)
+        self.write(from_board_history(history), board.check_win())
+
+    def close(self) -> None:
+        """Write the index and the header"""
+        if self._file.closed:
+            return
+        self._mmap.close()
+        index_offset = HEADER.itemsize + self.size
+        offsets = np.array(self.offsets, dtype="<u8")
+        results = np.array(self.results, dtype=np.uint8)
+        self._file.truncate(index_offset)
+        self._file.seek(index_offset)
+        self._file.write(offsets.tobytes() + results.tobytes())
+        header = np.array([(MAGIC, VERSION, 0, len(self.results),
+                            index_offset)], dtype=HEADER)
+        self._file.seek(0)
+        self._file.write(header.tobytes())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class GameReader:
+    """Random access to the games of a record file (see [File])
+
+    reader[i] is the movement codes of game i (a read-only uint8 array on
+    the mapping), `history(i)` the `Board.history` and `board_history(i)`
+    the `BoardHistory`.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._mmap, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise Exception(f"Not a game record file: {self.path}")
+        n = int(header["games"])
+        index_offset = int(header["index_offset"])
+        self.codes = np.frombuffer(self._mmap, dtype=np.uint8,
+                                   count=index_offset - HEADER.itemsize,
+                                   offset=HEADER.itemsize)
+        if n == 0:  # also a file that was not closed, without an index
+            self.offsets = np.zeros(1, dtype="<u8")
+            self.results = np.zeros(0, dtype=np.uint8)
+            return
+        self.offsets = np.frombuffer(self._mmap, dtype="<u8", count=n + 1,
+                                     offset=index_offset)
+        self.results = np.frombuffer(self._mmap, dtype=np.uint8, count=n,
+                                     offset=index_offset + 8 * (n + 1))
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        return self.codes[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self) -> np.ndarray:
+        """Return the number of movements of every game"""
+        return np.diff(self.offsets)
+
+    def history(self, i: int) -> list:
+        return decode(self[i])
+
+    def board_history(self, i: int) -> BoardHistory:
+        return to_board_history(self[i])
+
+    def close(self) -> None:
+        """Close the mapping, the arrays returned before must be deleted"""
+        del self.codes, self.offsets, self.results
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import pickle
+    import random
+    import tempfile
+    import time
+
+    from bitboard import BitBoard
+
+    # random games up to the end or 200 movements, and the boards with
+    # their history as they are pickled now
+    random.seed(0)
+    games = []
+    boards = []
+    for _ in range(10000):
+        board = BitBoard()
+        history = []
+        player = 1
+        for _ in range(200):
+            movement = random.choice(board.available_move(player))
+            board.make_move(movement, player, False)
+            history.append((30, movement[1]) if movement[0] == 0
+                           else tuple(movement[1]))
+            if board.check_win():
+                break
+            player = 3 - player
+        games.append((history, board.check_win()))
+        boards.append(Board(board.board, history=list(history)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "games.bin"
+        with GameWriter(path, capacity=4096) as writer:
+            for history, result in games:
+                writer.write(encode(history), result)
+        pickle_path = Path(directory) / "games.pkl"
+        with open(pickle_path, "wb") as file:
+            pickle.dump(boards, file)
+
+        start = time.perf_counter()
+        with open(pickle_path, "rb") as file:
+            pickle.load(file)
+        pickle_time = time.perf_counter() - start
+        start = time.perf_counter()
+        reader = GameReader(path)
+        reader.history(len(reader) // 2)
+        open_time = time.perf_counter() - start
+
+        assert len(reader) == len(games)
+        for i in random.sample(range(len(games)), 500):
+            history, result = games[i]
+            assert reader.history(i) == history
+            assert reader.results[i] == result
+            board_history = reader.board_history(i)
+            assert from_board_history(board_history) == encode(history)
+            assert board_history.board.check_win() == result
+        assert [decode(codes) for codes in reader] == [h for h, _ in games]
+        print(f"{len(games)} games, {reader.lengths().sum()} movements")
+        print(f"record: {path.stat().st_size} bytes, open and read a game "
+              f"{open_time * 1e6:.0f} us")
+        print(f"pickle of the boards: {pickle_path.stat().st_size} bytes, "
+              f"load {pickle_time * 1e6:.0f} us")
+        reader.close()
+
+        # a file that was not closed reads as an empty file
+        unclosed = GameWriter(Path(directory) / "unclosed.bin")
+        unclosed.write(encode(games[0][0]), games[0][1])
+        with GameReader(unclosed.path) as empty:
+            assert len(empty) == 0 and len(empty.lengths()) == 0
+        unclosed.close()
+        with GameReader(unclosed.path) as closed:
+            assert closed.history(0) == games[0][0]
+        print("unclosed file: empty")
@@ -0,0 +1,131 @@
+"""Collision-free index of the board positions
+
+Every legal board position (at most two chess of each size for each player,
+see `Board.chess_left`) is mapped to a unique integer in [0, N_POSITIONS)
+and back. The index is dense, so it can be used directly as the offset of a
+flat array, and N_POSITIONS = 1423^3 < 2^32, so an index fits in an uint32.
+"""
+
+import numpy as np
+
+from bitboard import LAYER_MASK
+
+#
+# [Index]
+# A layer is encoded in base 3 (0: empty, 1: O, 2: X), cell 0 is the least
+# significant digit. The legal layers sorted by this code are ranked
+# 0 ~ LAYER_SIZE-1, and a board is
+#
+#   index = (rank(layer 1) * LAYER_SIZE + rank(layer 2)) * LAYER_SIZE
+#           + rank(layer 3)
+#
+
+MAX_CHESS = 2  # chess of each size for a player
+
+# TERNARY[mask]: base 3 code of a 9-bit mask with all the digits 1
+TERNARY = [sum(3**i for i in range(9) if mask >> i & 1) for mask in range(512)]
+
+# LAYER_RANK[code]: rank of the base 3 code of a layer, -1 if illegal
+# LAYER_O[rank], LAYER_X[rank]: 9-bit masks of the ranked layer
+_layers = sorted(
+    (TERNARY[o] + 2 * TERNARY[x], o, x)
+    for o in range(512) for x in range(512)
+    if not o & x and o.bit_count() <= MAX_CHESS
+    and x.bit_count() <= MAX_CHESS
+)
+LAYER_SIZE = len(_layers)
+LAYER_RANK = np.full(3**9, -1, dtype=np.int32)
+LAYER_RANK[[code for code, _, _ in _layers]] = np.arange(LAYER_SIZE)
+LAYER_O = np.array([o for _, o, _ in _layers], dtype=np.int64)
+LAYER_X = np.array([x for _, _, x in _layers], dtype=np.int64)
+del _layers
+
+N_POSITIONS = LAYER_SIZE ** 3
+
+_rank = LAYER_RANK.tolist()
+_unrank = list(zip(LAYER_O.tolist(), LAYER_X.tolist()))
+_TERNARY = np.array(TERNARY, dtype=np.int64)
+
+
+def rank(key: int) -> int:
+    """Return the index of a `BitBoard.key`"""
+    x = key >> 27
+    return ((_rank[TERNARY[key & LAYER_MASK] + 2 * TERNARY[x & LAYER_MASK]]
+             * LAYER_SIZE
+             + _rank[TERNARY[key >> 9 & LAYER_MASK]
+                     + 2 * TERNARY[x >> 9 & LAYER_MASK]])
+            * LAYER_SIZE
+            + _rank[TERNARY[key >> 18 & LAYER_MASK]
+                    + 2 * TERNARY[x >> 18 & LAYER_MASK]])
+
+
+def unrank(index: int) -> int:
+    """Return the `BitBoard.key` of an index"""
+    index, r2 = divmod(index, LAYER_SIZE)
+    r0, r1 = divmod(index, LAYER_SIZE)
+    o0, x0 = _unrank[r0]
+    o1, x1 = _unrank[r1]
+    o2, x2 = _unrank[r2]
+    return o0 | o1 << 9 | o2 << 18 | (x0 | x1 << 9 | x2 << 18) << 27
+
+
+def rank_array(keys: np.ndarray) -> np.ndarray:
+    """Vectorized `rank`
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        integer array of `BitBoard.key`
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of index
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    index = np.zeros(keys.shape, dtype=np.int64)
+    for shift in (0, 9, 18):
+        o = keys >> shift & LAYER_MASK
+        x = keys >> (shift + 27) & LAYER_MASK
+        index *= LAYER_SIZE
+        index += LAYER_RANK[_TERNARY[o] + 2 * _TERNARY[x]]
+    return index
+
+
+def unrank_array(index: np.ndarray) -> np.ndarray:
+    """Vectorized `unrank`
+
+    Parameters
+    ----------
+    index : np.ndarray
+        integer array of index
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of `BitBoard.key`
+    """
+    index = np.asarray(index, dtype=np.int64)
+    keys = np.zeros(index.shape, dtype=np.int64)
+    for shift in (18, 9, 0):
+        index, r = np.divmod(index, LAYER_SIZE)
+        keys |= LAYER_O[r] << shift
+        keys |= LAYER_X[r] << (shift + 27)
+    return keys
+
+
+if __name__ == "__main__":
+    import random
+
+    from bitboard import BitBoard
+
+    print("positions:", N_POSITIONS, "layers:", LAYER_SIZE)
+    random.seed(0)
+    index = np.array(random.sample(range(N_POSITIONS), 10000), dtype=np.int64)
+    keys = unrank_array(index)
+    assert (rank_array(keys) == index).all()
+    for i, key in zip(index.tolist(), keys.tolist()):
+        assert unrank(i) == key and rank(key) == i
+        BitBoard(key)  # raise if illegal
+    assert rank(0) == 0 and unrank(N_POSITIONS - 1) > 0
+    print("rank and unrank are inverse on", len(index), "positions")
@@ -0,0 +1,165 @@
+"""Counters of the dfs solve, written as JSON-lines snapshots
+
+Set `solve.stats` to a `SolverStats` of the two tables to count. When it is
+None (the default) each counting point of `solve._scan` and
+`solve.iterative_turns` is a single `is not None` check, so it can stay on
+in long runs.
+"""
+
+import json
+import sys
+import time
+
+import psutil
+
+#
+# [Snapshot]
+# One JSON object per line:
+#   time, elapsed: seconds since the epoch and since the start
+#   nodes: turns expanded since the start, nodes_per_s since the last
+#       snapshot
+#   o, x: the counters of board_state_o and board_state_x:
+#       probes, hits, hit_rate: lookups of a child position in the table
+#       stores: values written (in progress, finished games and results)
+#       entries: len() of the table
+#       bytes_per_entry: estimated size in RAM of an entry, see `table_bytes`
+#   short_circuits: turns decided by the first loop (`_scan`)
+#   cutoffs: turns decided by a child in the second loop
+#   depth, max_depth: turns on the stack of iterative_turns
+#   depth_histogram: [expanded turns at depth 0, 1, ...]
+#   rss: resident memory of the process in bytes
+#
+
+# size of a key of board_state, the canonical index is below 2**32
+KEY_BYTES = sys.getsizeof(2**32 - 1)
+
+
+def table_bytes(table) -> int:
+    """Return the estimated bytes of a board_state in RAM
+
+    The dict and the keys are counted, the values are the shared True,
+    False and None. For a `TwoTierTable` only the hot tier is in RAM, a
+    `BoundedTable` has a fixed size.
+    """
+    if hasattr(table, "nbytes"):
+        return table.nbytes
+    table = getattr(table, "hot", table)
+    if not isinstance(table, dict):
+        return 0
+    return sys.getsizeof(table) + len(table) * KEY_BYTES
+
+
+class SolverStats:
+    """The counters of a solve
+
+    Parameters
+    ----------
+    board_state_o, board_state_x : dict
+        the tables of the solve
+    path : str | Path, optional
+        the JSON-lines file of the snapshots (appended), by default None
+        (snapshots are only returned)
+    interval : float, optional
+        seconds between two snapshots, by default 10
+    """
+
+    def __init__(self, board_state_o, board_state_x, path=None,
+                 interval: float = 10) -> None:
+        self.tables = board_state_o, board_state_x
+        self.path = path
+        self.interval = interval
+        # [O table, X table], the table of the player who moved
+        self.probes = [0, 0]
+        self.hits = [0, 0]
+        self.stores = [0, 0]
+        self.short_circuits = 0
+        self.cutoffs = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.depth_histogram = [0]
+        self.nodes = 0
+        self.start = self._last_time = time.time()
+        self._last_nodes = 0
+
+    def probe(self, player: int, hit: bool) -> None:
+        self.probes[player - 1] += 1
+        if hit:
+            self.hits[player - 1] += 1
+
+    def store(self, player: int) -> None:
+        self.stores[player - 1] += 1
+
+    def expand(self, depth: int) -> None:
+        """A turn at the depth is expanded, also writes the snapshots"""
+        self.depth = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+            self.depth_histogram += [0] * (depth + 1
+                                           - len(self.depth_histogram))
+        self.depth_histogram[depth] += 1
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (time.time() - self._last_time
+                                        >= self.interval):
+            self.write()
+
+    def snapshot(self) -> dict:
+        """Return the counters now, see [Snapshot]"""
+        now = time.time()
+        nodes = self.nodes
+        snapshot = {
+            "time": now,
+            "elapsed": now - self.start,
+            "nodes": nodes,
+            "nodes_per_s": ((nodes - self._last_nodes)
+                            / max(now - self._last_time, 1e-9)),
+        }
+        for name, i, table in zip("ox", (0, 1), self.tables):
+            entries = len(table)
+            snapshot[name] = {
+                "probes": self.probes[i],
+                "hits": self.hits[i],
+                "hit_rate": self.hits[i] / max(self.probes[i], 1),
+                "stores": self.stores[i],
+                "entries": entries,
+                "bytes_per_entry": table_bytes(table) / max(entries, 1),
+            }
+        snapshot.update(
+            short_circuits=self.short_circuits,
+            cutoffs=self.cutoffs,
+            depth=self.depth,
+            max_depth=self.max_depth,
+            depth_histogram=self.depth_histogram,
+            rss=psutil.Process().memory_info().rss,
+        )
+        self._last_time, self._last_nodes = now, nodes
+        return snapshot
+
+    def write(self) -> dict:
+        """Take a snapshot and append it to the file"""
+        snapshot = self.snapshot()
+        if self.path is not None:
+            with open(self.path, "a") as file:
+                file.write(json.dumps(snapshot) + "\n")
+        return snapshot
+
+
+if __name__ == "__main__":
+    import solve
+    from bitboard import BitBoard
+    from ordering import BENCHMARK_POSITIONS
+
+    def run() -> float:
+        start = time.perf_counter()
+        for key, player in BENCHMARK_POSITIONS:
+            solve.board_state_o.clear()
+            solve.board_state_x.clear()
+            solve.iterative_turns(BitBoard(key), player)
+        return time.perf_counter() - start
+
+    solve.cutoff = True
+    disabled = min(run() for _ in range(3))
+    solve.stats = SolverStats(solve.board_state_o, solve.board_state_x)
+    enabled = min(run() for _ in range(3))
+    print(json.dumps(solve.stats.snapshot(), indent=1))
+    print(f"disabled {disabled:.2f}s, enabled {enabled:.2f}s "
+          f"(+{enabled / disabled - 1:.1%})")
@@ -0,0 +1,471 @@
+"""Best-move oracle over a finished solve
+
+`build` converts the checkpoint of a dfs solve (see `datamanager.Checkpoint`)
+into sorted arrays with the result and the best movement of every solved
+position. `Oracle` loads them memory-mapped (nothing is unpickled), and a
+lookup is one canonicalization and one binary search. `serve` answers the
+same questions over HTTP for the web game.
+
+    python oracle.py build data/<date_time>
+    python oracle.py serve data/<date_time> --port 8000
+    python oracle.py check data/<date_time>
+"""
+
+import json
+import pickle
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from bitboard import (MOVE_CODE, MOVEMENTS, BitBoard, available_move_array,
+                      check_win_array)
+from datamanager import RECORD
+from indexing import MAX_CHESS, rank, rank_array, unrank_array
+from retrograde import POPCOUNT
+from symmetry import INVERSE, canonical_array, canonical_key
+from symmetry import canonical_symmetry, transform_movement
+
+#
+# [Oracle files]
+# directory/player1_index.npy, player2_index.npy:
+#   uint32, the sorted canonical index of the solved positions with the
+#   player to move (player 1: board_state_x, player 2: board_state_o)
+# directory/player1_result.npy, player2_result.npy:
+#   bool, True: O will win
+# directory/player1_move.npy, player2_move.npy:
+#   int16, the `bitboard.MOVE_CODE` of the best movement in the frame of
+#   the canonical position, -1 if the game is finished (the tables also
+#   record the finished games) or the player has no movement
+#
+# [Best movement]
+# The first movement (in the order of `available_move`) of the best kind:
+#   3: finishes the game for the player (a tie is for X)
+#   2: goes to a solved position that is won for the player
+#   1: goes to a position that was not solved
+#   0: the others
+#
+
+CHUNK = 1 << 18  # positions expanded at once by `build`
+
+# CODE_SYMMETRY[s, code]: the movement code after the symmetry s
+CODE_SYMMETRY = np.array([
+    [MOVE_CODE[transform_movement(movement, s)] for movement in MOVEMENTS]
+    for s in range(8)
+], dtype=np.int16)
+
+
+def _find(index: np.ndarray, c: np.ndarray) -> tuple:
+    """Return (slot, found) of the canonical index c in the sorted index"""
+    slot = np.searchsorted(index, c)
+    slot = np.minimum(slot, max(len(index) - 1, 0))
+    found = (index[slot] == c) if len(index) else np.zeros(c.shape, bool)
+    return slot, found
+
+
+def _best_moves(keys: np.ndarray, player: int, index: np.ndarray,
+                result: np.ndarray) -> np.ndarray:
+    """Return the best movement code of each board (see [Best movement])
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        int64 array of `BitBoard.key` with the player to move
+    player : int
+    index, result : np.ndarray
+        the solved positions after the player moved
+    """
+    parent, code, child = available_move_array(keys, player)
+    win = check_win_array(child)
+    slot, found = _find(index, canonical_array(rank_array(child))[0])
+    good = np.zeros(len(slot), dtype=bool)
+    good[found] = result[slot[found]] == (player == 1)
+    score = np.where(good, 2, np.where(found, 0, 1))
+    score[win != 0] = 0
+    score[(win == 1) if player == 1 else (win >= 2)] = 3
+    order = np.lexsort((np.arange(len(parent)), -score, parent))
+    first = order[np.r_[True, parent[order][1:] != parent[order][:-1]]]
+    moves = np.full(len(keys), -1, dtype=np.int16)
+    moves[parent[first]] = code[first]
+    moves[check_win_array(keys) != 0] = -1
+    return moves
+
+
+def build(source, directory=None, player: int = 1,
+          verbose: bool = True) -> Path:
+    """Build the oracle of a finished dfs solve
+
+    Parameters
+    ----------
+    source : str | Path
+        the checkpoint directory of the solve
+    directory : str | Path, optional
+        the oracle directory, by default source/oracle
+    player : int, optional
+        the player to move at the root of the solve, by default 1 (the root
+        is not in the tables, its result is in stack.pkl)
+
+    Returns
+    -------
+    Path
+        the oracle directory
+    """
+    start = time.time()
+    source = Path(source)
+    directory = Path(directory) if directory else source / "oracle"
+    directory.mkdir(parents=True, exist_ok=True)
+    records = [np.memmap(f, dtype=RECORD, mode="r")
+               for f in sorted(source.glob("segment_*.bin"))
+               if f.stat().st_size]
+    stack_file = source / "stack.pkl"
+    if stack_file.exists():
+        with open(stack_file, "rb") as file:
+            state = pickle.load(file)
+        if state["result"] is not None:
+            records.append(np.array(
+                [(canonical_key(state["board"].key), 3 - player,
+                  1 if state["result"] else 2)], dtype=RECORD
+            ))
+    records = (np.concatenate(records) if records
+               else np.zeros(0, dtype=RECORD))
+    index, result = {}, {}
+    for player in (1, 2):
+        # the positions with the player to move are in the table of the
+        # other player
+        # the last record of a position is its final value, as in
+        # `datamanager.load_checkpoint`
+        selected = records[records["player"] == 3 - player][::-1]
+        i, last = np.unique(selected["ha"], return_index=True)
+        index[player] = i
+        result[player] = selected["state"][last] == 1
+    for player in (1, 2):
+        moves = [
+            _best_moves(unrank_array(index[player][begin:begin + CHUNK]),
+                        player, index[3 - player], result[3 - player])
+            for begin in range(0, len(index[player]), CHUNK)
+        ]
+        np.save(directory / f"player{player}_index.npy", index[player])
+        np.save(directory / f"player{player}_result.npy", result[player])
+        np.save(directory / f"player{player}_move.npy",
+                np.concatenate(moves) if moves else np.zeros(0, np.int16))
+    if verbose:
+        print(f"Oracle: {directory}, {len(index[1])} + {len(index[2])} "
+              f"positions, {time.time() - start:.1f}s")
+    return directory
+
+
+class Oracle:
+    """The result and the best movement of the solved positions
+
+    Parameters
+    ----------
+    directory : str | Path
+        made by `build`
+    """
+
+    def __init__(self, directory) -> None:
+        directory = Path(directory)
+        # [player to move - 1]
+        self.index, self.results, self.moves = [], [], []
+        for player in (1, 2):
+            for name, array in (("index", self.index),
+                                ("result", self.results),
+                                ("move", self.moves)):
+                array.append(np.load(directory / f"player{player}_{name}.npy",
+                                     mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.index[0]) + len(self.index[1])
+
+    def _slot(self, board: BitBoard, player: int) -> tuple:
+        """Return (slot or None, s) of the board, None also if the board is
+        not valid (see `valid_positions`)"""
+        if not _valid(board.key, player):
+            return None, 0
+        c, s = canonical_symmetry(rank(board.key))
+        index = self.index[player - 1]
+        slot = int(np.searchsorted(index, c))
+        if slot == len(index) or index[slot] != c:
+            return None, s
+        return slot, s
+
+    def result(self, board: BitBoard, player: int):
+        """Return the result of the board with the player to move
+
+        Returns
+        -------
+        bool or None
+            True: O will win, None: not solved or not a valid board
+        """
+        slot, _ = self._slot(board, player)
+        if slot is None:
+            return None
+        return bool(self.results[player - 1][slot])
+
+    def best_move(self, board: BitBoard, player: int):
+        """Return the best movement of the player (see [Best movement])
+
+        Returns
+        -------
+        tuple or None
+            the movement in the format of `available_move`, None: not solved,
+            not a valid board or the game is finished
+        """
+        slot, s = self._slot(board, player)
+        if slot is None:
+            return None
+        code = int(self.moves[player - 1][slot])
+        if code < 0:
+            return None
+        return MOVEMENTS[CODE_SYMMETRY[INVERSE[s], code]]
+
+    def query(self, keys, players) -> tuple:
+        """Batch version of `result` and `best_move`
+
+        Parameters
+        ----------
+        keys, players : array_like
+            `BitBoard.key` and the player to move of each board
+
+        Returns
+        -------
+        tuple
+            (results, codes): int8 array, 1: O will win, 0: O will not win,
+            -1: not solved or not a valid board (see `valid_positions`),
+            and int16 array of the `bitboard.MOVE_CODE` of the best
+            movement, -1: not solved, not valid or the game is finished
+        """
+        keys, valid = valid_positions(keys, players)
+        players = np.asarray(players)
+        results = np.full(len(keys), -1, dtype=np.int8)
+        codes = np.full(len(keys), -1, dtype=np.int16)
+        c = np.zeros(len(keys), dtype=np.int64)
+        s = np.zeros(len(keys), dtype=np.int64)
+        c[valid], s[valid] = canonical_array(rank_array(keys[valid]))
+        for player in (1, 2):
+            i = np.flatnonzero(valid & (players == player))
+            slot, found = _find(self.index[player - 1], c[i])
+            i, slot = i[found], slot[found]
+            results[i] = self.results[player - 1][slot]
+            code = self.moves[player - 1][slot]
+            solved = code >= 0
+            codes[i[solved]] = CODE_SYMMETRY[INVERSE[s[i[solved]]],
+                                             code[solved]]
+        return results, codes
+
+
+def valid_positions(keys, players) -> tuple:
+    """Check the boards of a query
+
+    A board is valid if 0 <= key < 2**54, no cell of a layer has both O
+    and X, a player has at most MAX_CHESS chess of a size on the board and
+    the player to move is 1 or 2.
+
+    Returns
+    -------
+    tuple
+        (keys, valid): int64 array of the keys (0 if not valid) and bool
+        array
+    """
+    keys = np.asarray(keys)
+    players = np.asarray(players)
+    # Python ints of any size are compared before the cast to int64
+    valid = np.asarray((keys >= 0) & (keys < 1 << 54), dtype=bool)
+    valid &= np.asarray((players == 1) | (players == 2), dtype=bool)
+    keys = np.where(valid, keys, 0).astype(np.int64)
+    o, x = keys & (1 << 27) - 1, keys >> 27
+    valid &= (o & x) == 0
+    for layer in range(3):
+        for chess in (o, x):
+            valid &= POPCOUNT[chess >> 9*layer & 0x1FF] <= MAX_CHESS
+    return np.where(valid, keys, 0), valid
+
+
+def _valid(key: int, player: int) -> bool:
+    """`valid_positions` of one board, without numpy"""
+    if player not in (1, 2) or not 0 <= key < 1 << 54:
+        return False
+    o, x = key & (1 << 27) - 1, key >> 27
+    return not o & x and all(
+        (chess >> 9*layer & 0x1FF).bit_count() <= MAX_CHESS
+        for chess in (o, x) for layer in range(3))
+
+
+def _movement_json(code: int):
+    """[0, pos] or [1, [pre_pos, pos]], None if code < 0"""
+    if code < 0:
+        return None
+    kind, position = MOVEMENTS[code]
+    return [kind, list(position) if kind else position]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """GET /move?key=<BitBoard.key>&player=<1|2>
+        {"result": bool | null, "move": movement | null}
+    POST /moves {"positions": [[key, player], ...]}
+        {"results": [...], "moves": [...]}
+    """
+
+    oracle = None
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _answer(self, keys: list, players: list) -> tuple:
+        """(results, moves) in JSON, None: a board is not valid"""
+        if not valid_positions(keys, players)[1].all():
+            return None
+        results, codes = self.oracle.query(keys, players)
+        return ([None if r < 0 else bool(r) for r in results.tolist()],
+                [_movement_json(code) for code in codes.tolist()])
+
+    def do_OPTIONS(self) -> None:
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        try:
+            self._get()
+        except Exception as error:
+            self._send(500, {"error": repr(error)})
+
+    def do_POST(self) -> None:
+        try:
+            self._post()
+        except Exception as error:
+            self._send(500, {"error": repr(error)})
+
+    def _get(self) -> None:
+        url = urlparse(self.path)
+        if url.path != "/move":
+            return self._send(404, {"error": "not found"})
+        query = parse_qs(url.query)
+        try:
+            key = int(query["key"][0])
+            player = int(query.get("player", ["1"])[0])
+        except (KeyError, ValueError):
+            return self._send(400, {"error": "key and player are integers"})
+        answer = self._answer([key], [player])
+        if answer is None:
+            return self._send(400, {"error": "not a valid board"})
+        results, moves = answer
+        self._send(200, {"result": results[0], "move": moves[0]})
+
+    def _post(self) -> None:
+        if urlparse(self.path).path != "/moves":
+            return self._send(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            positions = json.loads(self.rfile.read(length))["positions"]
+            keys = [int(key) for key, _ in positions]
+            players = [int(player) for _, player in positions]
+        except (KeyError, TypeError, ValueError):
+            return self._send(400, {"error": "positions: [[key, player]]"})
+        answer = self._answer(keys, players)
+        if answer is None:
+            return self._send(400, {"error": "not a valid board"})
+        results, moves = answer
+        self._send(200, {"results": results, "moves": moves})
+
+
+def serve(oracle: Oracle, host: str = "127.0.0.1", port: int = 8000):
+    """Answer the queries over HTTP until interrupted, see `_Handler`"""
+    handler = type("Handler", (_Handler,), {"oracle": oracle})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Oracle: http://{host}:{server.server_port}/move?key=0&player=1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import timeit
+
+    parser = argparse.ArgumentParser(description="Best-move oracle")
+    parser.add_argument("command",
+                        choices=["build", "serve", "bench", "check"])
+    parser.add_argument("directory", help="the checkpoint of a dfs solve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--positions", type=int, default=2000,
+                        help="check: random positions of each player")
+    args = parser.parse_args()
+
+    oracle_directory = Path(args.directory) / "oracle"
+    if args.command == "build":
+        build(args.directory, oracle_directory)
+    elif args.command == "serve":
+        serve(Oracle(oracle_directory), args.host, args.port)
+    elif args.command == "check":
+        import random
+
+        import datamanager
+        import solve
+
+        # the answers against the tables of the solve (solve.find_state),
+        # and the best movement of a won position keeps the win
+        oracle = Oracle(oracle_directory)
+        datamanager.load_checkpoint(args.directory, solve.board_state_o,
+                                    solve.board_state_x)
+        random.seed(0)
+        for player in (1, 2):
+            index = oracle.index[player - 1]
+            sample = random.sample(range(len(index)),
+                                   min(args.positions, len(index)))
+            keys = unrank_array(np.asarray(index)[sample].astype(np.int64))
+            results, codes = oracle.query(keys, [player] * len(keys))
+            won = 0
+            for key, r, code in zip(keys.tolist(), results.tolist(),
+                                    codes.tolist()):
+                board = BitBoard(key)
+                assert oracle.result(board, player) == bool(r)
+                assert solve.find_state(board, 3 - player) == bool(r)
+                if board.check_win() or bool(r) != (player == 1):
+                    continue
+                # the player to move wins: so does the best movement
+                won += 1
+                board.make_move(MOVEMENTS[code], player, False)
+                after = board.check_win()
+                if after:
+                    assert (after == 1) == (player == 1)
+                else:
+                    assert oracle.result(board, 3 - player) == (player == 1)
+            print(f"player {player}: {len(keys)} positions agree with "
+                  f"solve.find_state, {won} best movements keep the win")
+        # the boards that are not valid are not answered (BitBoard(key)
+        # refuses them, the key is set afterwards)
+        invalid = [1 << 60, (1 << 27) | 1, 0b111]
+        for key in invalid:
+            board = BitBoard()
+            board.key = key
+            assert oracle.result(board, 1) is None
+            assert oracle.best_move(board, 1) is None
+        assert oracle.best_move(BitBoard(0), 3) is None
+        assert (oracle.query(invalid + [0], [1, 1, 1, 3])[0] == -1).all()
+        print("invalid boards: not answered")
+    else:
+        oracle = Oracle(oracle_directory)
+        boards = [BitBoard(k) for k in unrank_array(oracle.index[0][:1000])]
+        t = min(timeit.repeat(
+            lambda: [oracle.best_move(b, 1) for b in boards],
+            number=1, repeat=5)) / len(boards)
+        print(f"{len(oracle)} positions, best_move {t * 1e6:.1f} us")
+        keys = [b.key for b in boards]
+        t = min(timeit.repeat(lambda: oracle.query(keys, [1] * len(keys)),
+                              number=1, repeat=5)) / len(keys)
+        print(f"query {t * 1e6:.2f} us per position")
@@ -0,0 +1,174 @@
+"""Move ordering for the second loop of the solver
+
+`solve.iterative_turns` explores the movements that do not finish the game
+in the order of `available_move`. An ordering reorders them, so with
+`solve.cutoff` the any()/all() of a turn is decided after fewer children.
+Set `solve.ordering` to one of the classes below (or `Combined`) to use it.
+"""
+
+import numpy as np
+
+from bitboard import BitBoard
+from indexing import rank
+from symmetry import INVERSE, canonical_symmetry, transform_movement
+
+#
+# [Lines]
+# The 8 lines of the board as 9-bit masks of cells.
+# OPEN_TWOS[mine | theirs << 9]: number of lines where `mine` is on top of
+# two cells and `theirs` of none, i.e. the lines that win at the next move.
+#
+
+LINES = [0b000000111, 0b000111000, 0b111000000,
+         0b001001001, 0b010010010, 0b100100100,
+         0b100010001, 0b001010100]
+
+_mask = np.arange(512)
+_count = np.zeros((512, 512), dtype=np.int8)
+for _line in LINES:
+    _mine = np.array([bin(m & _line).count('1') == 2 for m in range(512)])
+    _theirs = (_mask & _line) == 0
+    _count += _mine[None, :] & _theirs[:, None]
+OPEN_TWOS = _count.ravel().tolist()
+del _mask, _count, _line, _mine, _theirs
+
+
+class MoveOrdering:
+    """No ordering, the base class
+
+    order(board, player, movements) is called before the second loop of a
+    turn, cutoff(board, player, movement) when a movement decided the turn
+    (the result of the player was found).
+    """
+
+    def order(self, board: BitBoard, player: int, movements: list) -> list:
+        return movements
+
+    def cutoff(self, board: BitBoard, player: int, movement: tuple) -> None:
+        pass
+
+
+class ThreatFirst(MoveOrdering):
+    """The movements that create the player's two-in-a-rows or cover the
+    opponent's first"""
+
+    def score(self, board: BitBoard, player: int) -> int:
+        mine, theirs = board.top(player), board.top(3 - player)
+        return (OPEN_TWOS[mine | theirs << 9]
+                - 2 * OPEN_TWOS[theirs | mine << 9])
+
+    def order(self, board: BitBoard, player: int, movements: list) -> list:
+        scores = []
+        for movement in movements:
+            board.make_move(movement, player, False)
+            scores.append(-self.score(board, player))
+            board.unmake_move()
+        return [movements[i]
+                for i in sorted(range(len(movements)), key=scores.__getitem__)]
+
+
+class KillerHistory(MoveOrdering):
+    """The killer movements (the last 2 cutoffs at the same depth) first,
+    then the others by the number of cutoffs they made"""
+
+    def __init__(self) -> None:
+        self.killers = {}  # depth: [movement, movement]
+        self.history = {}  # (player, movement): cutoffs
+
+    def order(self, board: BitBoard, player: int, movements: list) -> list:
+        killers = self.killers.get(board.ply, ())
+        history = self.history
+        return sorted(
+            movements,
+            key=lambda m: (m not in killers, -history.get((player, m), 0))
+        )
+
+    def cutoff(self, board: BitBoard, player: int, movement: tuple) -> None:
+        killers = self.killers.setdefault(board.ply, [])
+        if movement not in killers:
+            killers.insert(0, movement)
+            del killers[2:]
+        key = (player, movement)
+        self.history[key] = self.history.get(key, 0) + 1
+
+
+class BestMove(MoveOrdering):
+    """The movement that decided the same position (under symmetry) before
+    first, a table of best movements next to board_state"""
+
+    def __init__(self) -> None:
+        self.best = {}  # (canonical index, player): movement in its frame
+
+    def order(self, board: BitBoard, player: int, movements: list) -> list:
+        c, s = canonical_symmetry(rank(board.key))
+        best = self.best.get((c, player))
+        if best is None:
+            return movements
+        best = transform_movement(best, INVERSE[s])
+        if best not in movements:
+            return movements
+        return [best] + [m for m in movements if m != best]
+
+    def cutoff(self, board: BitBoard, player: int, movement: tuple) -> None:
+        c, s = canonical_symmetry(rank(board.key))
+        self.best[(c, player)] = transform_movement(movement, s)
+
+
+class Combined(MoveOrdering):
+    """Apply the orderings one after another, the last one is the primary
+    key (the sorts are stable)"""
+
+    def __init__(self, *orderings: MoveOrdering) -> None:
+        self.orderings = orderings
+
+    def order(self, board: BitBoard, player: int, movements: list) -> list:
+        for ordering in self.orderings:
+            movements = ordering.order(board, player, movements)
+        return movements
+
+    def cutoff(self, board: BitBoard, player: int, movement: tuple) -> None:
+        for ordering in self.orderings:
+            ordering.cutoff(board, player, movement)
+
+
+# (BitBoard.key, player to move) that the solver finishes with `cutoff`
+# (without it none of them finishes in minutes)
+BENCHMARK_POSITIONS = [
+    (9007267974479888, 1),
+    (2200633933857, 2),
+    (9007203549708544, 1),
+    (8589934736, 2),
+    (4576167405293568, 1),
+    (1196268667797760, 2),
+    (35184381526016, 2),
+    (6755399441055776, 1),
+]
+
+
+if __name__ == "__main__":
+    import solve
+
+    orderings = {
+        "available_move": MoveOrdering,
+        "threat-first": ThreatFirst,
+        "killer/history": KillerHistory,
+        "best move": BestMove,
+        "all": lambda: Combined(KillerHistory(), ThreatFirst(), BestMove()),
+    }
+    solve.cutoff = True
+    results = None
+    print("nodes (turns expanded) with cutoff on", len(BENCHMARK_POSITIONS),
+          "positions")
+    for name, ordering in orderings.items():
+        solve.ordering = ordering()
+        nodes = []
+        result = []
+        for key, player in BENCHMARK_POSITIONS:
+            solve.board_state_o.clear()
+            solve.board_state_x.clear()
+            solve.status.nodes = 0
+            result.append(solve.iterative_turns(BitBoard(key), player))
+            nodes.append(solve.status.nodes)
+        assert results is None or result == results
+        results = result
+        print(f"{name:>16}: {sum(nodes):>7} nodes", nodes)
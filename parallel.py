@@ -0,0 +1,291 @@
+"""Solve on all cores with a shared board_state
+
+The tree is split at a fixed depth into independent subproblems that are
+solved by a process pool with `solve.iterative_turns`. All processes share
+the solved positions through two arrays in shared memory (one for each
+board_state), indexed by the canonical index, so a position solved by one
+worker is not searched again by the others.
+"""
+
+import time
+from contextlib import contextmanager
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import solve
+from bitboard import BitBoard
+from indexing import N_POSITIONS
+
+#
+# [SharedTable]
+# 2 bits for each canonical index, 4 positions in a byte:
+#   0: not in the table, 1: True (O win), 2: False (O lose)
+# The values only change from 0 to 1 or 2, and one byte is written at once,
+# so no lock is needed: when two processes write the same byte at the same
+# time, one of the values goes back to 0 and is solved again later.
+# The positions in progress (None) are private to the process.
+#
+
+TABLE_BYTES = (N_POSITIONS + 3) // 4
+# _ENTRIES[byte]: number of positions stored in a byte
+_ENTRIES = np.array([sum(b >> s & 3 != 0 for s in (0, 2, 4, 6))
+                     for b in range(256)], dtype=np.int64)
+
+
+class SharedTable:
+    """A board_state (see solve.py) backed by a shared memory buffer"""
+
+    def __init__(self, buf: memoryview) -> None:
+        self.buf = buf
+        self.in_progress = {}
+        self.n = 0  # values stored by this process
+
+    def __contains__(self, ha: int) -> bool:
+        return (ha in self.in_progress
+                or self.buf[ha >> 2] >> ((ha & 3) << 1) & 3 != 0)
+
+    def __getitem__(self, ha: int):
+        if ha in self.in_progress:
+            return None
+        state = self.buf[ha >> 2] >> ((ha & 3) << 1) & 3
+        if not state:
+            raise KeyError(ha)
+        return state == 1
+
+    def __setitem__(self, ha: int, state) -> None:
+        if state is None:
+            self.in_progress[ha] = None
+            return
+        self.in_progress.pop(ha, None)
+        i, shift = ha >> 2, (ha & 3) << 1
+        self.buf[i] = (self.buf[i] & ~(3 << shift)
+                       | (1 if state else 2) << shift)
+        self.n += 1
+
+    def __len__(self) -> int:
+        return self.n + len(self.in_progress)
+
+
+def table_size(buf: memoryview, block: int = 1 << 26) -> int:
+    """Return the number of positions stored in a shared table"""
+    array = np.frombuffer(buf, dtype=np.uint8)
+    return int(sum(_ENTRIES[array[i:i + block]].sum()
+                   for i in range(0, len(array), block)))
+
+
+def split(board: BitBoard, player: int, depth: int) -> list:
+    """Return the subproblems of the tree at the depth
+
+    Returns
+    -------
+    list
+        [(key, player to move)] of the distinct positions (under symmetry)
+        that do not finish the game, the deepest first. The positions
+        decided by the first loop of `o_turns`/`x_turns` are not split: O
+        wins at once, or X wins or ties (a tie is not a win of O).
+    """
+    subproblems = []
+    seen = set()
+    level = [(board.key, player)]
+    for _ in range(depth):
+        next_level = []
+        for key, p in level:
+            b = BitBoard(key)
+            children = []
+            for movement in b.available_move(p):
+                b.make_move(movement, p, False)
+                win_status = b.check_win()
+                ha = (solve.similar(b), p)
+                b.unmake_move()
+                if ((p == 1 and win_status == 1)
+                        or (p == 2 and win_status in (2, 3))):
+                    children = []  # short-circuited
+                    break
+                if not win_status:
+                    children.append((ha, movement))
+            for ha, movement in children:
+                if ha in seen:
+                    continue
+                seen.add(ha)
+                b.make_move(movement, p, False)
+                next_level.append((b.key, 3 - p))
+                b.unmake_move()
+        subproblems = next_level + subproblems
+        level = next_level
+    return subproblems
+
+
+def _attach(memories: list) -> None:
+    """Use the shared memory as the board_state of this process"""
+    solve.board_state_o = SharedTable(memories[0].buf)
+    solve.board_state_x = SharedTable(memories[1].buf)
+
+
+def _init(names: tuple, cutoff: bool) -> None:
+    global _memories
+    _memories = [shared_memory.SharedMemory(name) for name in names]
+    _attach(_memories)
+    solve.cutoff = cutoff
+
+
+def _solve(subproblem: tuple) -> None:
+    key, player = subproblem
+    board = BitBoard(key)
+    board_state = solve._table(3 - player)
+    ha = solve.similar(board)
+    if ha in board_state:
+        return
+    board_state[ha] = None
+    board_state[ha] = solve.iterative_turns(board, player)
+
+
+@contextmanager
+def _shared_tables():
+    """Yield the shared memory of the two tables, the board_state of this
+    process is restored on exit"""
+    memories = [shared_memory.SharedMemory(create=True, size=TABLE_BYTES)
+                for _ in range(2)]
+    saved = solve.board_state_o, solve.board_state_x
+    try:
+        yield memories
+    finally:
+        solve.board_state_o, solve.board_state_x = saved
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def parallel_turns(board: BitBoard, player: int = 1, workers: int = 4,
+                   depth: int = 2) -> bool:
+    """Parallel version of `solve.iterative_turns`
+
+    Parameters
+    ----------
+    board : BitBoard
+    player : int, optional
+        the player to move, by default 1
+    workers : int, optional
+        number of processes, by default 4
+    depth : int, optional
+        the depth (in turns) of the subproblems, by default 2
+
+    The workers use the `solve.cutoff` of this process.
+
+    Returns
+    -------
+    bool
+        True: O will win
+    """
+    with _shared_tables() as memories:
+        names = tuple(memory.name for memory in memories)
+        with Pool(workers, initializer=_init,
+                  initargs=(names, solve.cutoff)) as pool:
+            for _ in pool.imap_unordered(_solve, split(board, player, depth)):
+                pass
+        # the top of the tree, the subproblems are in the table already
+        _attach(memories)
+        return solve.iterative_turns(board, player)
+
+
+def throughput(board: BitBoard, player: int = 1, workers: int = 4,
+               depth: int = 2, seconds: float = 60) -> int:
+    """Run `parallel_turns` for some seconds
+
+    For the trees that are too large to finish, e.g. the empty board.
+
+    Returns
+    -------
+    int
+        number of positions solved (stored in the shared tables)
+    """
+    with _shared_tables() as memories:
+        names = tuple(memory.name for memory in memories)
+        pool = Pool(workers, initializer=_init,
+                    initargs=(names, solve.cutoff))
+        pool.map_async(_solve, split(board, player, depth), chunksize=1)
+        time.sleep(seconds)
+        pool.terminate()
+        pool.join()
+        return sum(table_size(memory.buf) for memory in memories)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parallel solve")
+    parser.add_argument("--key", type=int,
+                        help="BitBoard.key of the board, by default empty "
+                             "with --seconds, else the benchmark positions "
+                             "of ordering.py")
+    parser.add_argument("--player", type=int, default=1,
+                        help="the player to move")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument("--seconds", type=float,
+                        help="measure the positions/s in the time instead of"
+                             " solving the board")
+    args = parser.parse_args()
+
+    if args.seconds:
+        base = None
+        for workers in args.workers:
+            n = throughput(BitBoard(args.key or 0), args.player, workers,
+                           args.depth, args.seconds)
+            base = base or n
+            print(f"{workers} workers: {n / args.seconds:.0f} positions/s, "
+                  f"speedup {n / base:.2f}")
+    else:
+        from ordering import BENCHMARK_POSITIONS
+
+        positions = (BENCHMARK_POSITIONS if args.key is None
+                     else [(args.key, args.player)])
+
+        # the subproblems are the positions that the first loop of
+        # o_turns/x_turns (solve._scan) leaves to search, to the depth
+        for key, player in positions:
+            expected, seen, level = set(), set(), [(key, player)]
+            for _ in range(args.depth):
+                next_level = []
+                for k, p in level:
+                    board = BitBoard(k)
+                    movements = solve._scan(board, p)
+                    if isinstance(movements, bool):
+                        continue
+                    for movement in movements:
+                        board.make_move(movement, p, False)
+                        if (solve.similar(board), p) not in seen:
+                            seen.add((solve.similar(board), p))
+                            next_level.append((board.key, 3 - p))
+                        board.unmake_move()
+                expected.update((solve.similar(BitBoard(k)), p)
+                                for k, p in next_level)
+                level = next_level
+            subproblems = split(BitBoard(key), player, args.depth)
+            assert len(subproblems) == len(expected)
+            assert {(solve.similar(BitBoard(k)), p)
+                    for k, p in subproblems} == expected
+        solve.board_state_o.clear()
+        solve.board_state_x.clear()
+        print(f"subproblems match the serial expansion, depth {args.depth}")
+
+        # with the cutoff, so that the positions finish
+        solve.cutoff = True
+        start = time.time()
+        serial = []
+        for key, player in positions:
+            solve.board_state_o.clear()
+            solve.board_state_x.clear()
+            serial.append(solve.iterative_turns(BitBoard(key), player))
+        serial_time = time.time() - start
+        print(f"serial: {serial}, {serial_time:.2f}s")
+        for workers in args.workers:
+            start = time.time()
+            result = [parallel_turns(BitBoard(key), player, workers,
+                                     args.depth)
+                      for key, player in positions]
+            t = time.time() - start
+            assert result == serial
+            print(f"{workers} workers: same results, {t:.2f}s, "
+                  f"speedup {serial_time / t:.2f}")
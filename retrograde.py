@@ -0,0 +1,530 @@
+"""Retrograde analysis of the whole state space
+
+A second engine next to `solve.o_turns`: instead of searching from the root,
+every position is enumerated, the positions that can finish the game are
+marked with the `check_win` semantics, and the results are propagated
+backwards with per-position child counters. The number of passes is bounded
+by the longest forced win, and the positions that are never decided are
+draws, including the ones that can only be held by repeating moves.
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bitboard import LAYER_MASK, MOVEMENTS, BitBoard, available_move_array
+from bitboard import check_win_array
+from indexing import LAYER_O, LAYER_SIZE, LAYER_X, MAX_CHESS, rank_array
+from indexing import unrank_array
+from symmetry import LAYER_SYMMETRY, canonical_array
+
+#
+# [Class]
+# counts = (o1, o2, o3, x1, x2, x3), the number of chess of each layer on
+# the board for O and X. A move keeps the class and a put goes to a class
+# with one more chess, so the classes are solved from the fullest to the
+# emptiest, and a class only looks up the classes solved before it.
+#
+# [Value]
+# The result for the player to move, stored for the canonical positions of
+# a class as value[player - 1][slot]. The value of a position that already
+# finished the game (check_win != 0) is not used.
+#
+# [Depth]
+# The movements to the end of the game when the winner wins as soon as
+# possible and the loser loses as late as possible, stored as
+# depth[player - 1][slot] (uint8) next to the value:
+#   WIN:  1 + the smallest depth of the children that are a LOSS
+#   LOSS: 1 + the largest depth of the children (all a WIN), 0 without a
+#         movement
+# A finished game is a child of depth 0, and DRAW positions have depth 0.
+# The depths are found level by level: the positions of depth d decide the
+# positions before them at depth d + 1, the children in the classes solved
+# before are known from the start.
+#
+
+DRAW = 0  # also the unknown positions while solving
+WIN = 1
+LOSS = 2
+
+MAX_DEPTH = 254  # 255 is an unknown depth while solving
+
+CHUNK = 1 << 18  # boards expanded at once
+
+POPCOUNT = np.array([bin(mask).count('1') for mask in range(512)],
+                    dtype=np.int8)
+_LAYER_COUNT_O = POPCOUNT[LAYER_O]
+_LAYER_COUNT_X = POPCOUNT[LAYER_X]
+# layer ranks that are the smallest of their symmetry layers
+_LAYER_MINIMAL = LAYER_SYMMETRY.min(axis=0) == np.arange(LAYER_SIZE)
+
+
+def successors(keys: np.ndarray, player: int, puts: bool = True):
+    """Generate all movements of the player for an array of boards
+
+    Moves are reversible, so the moves of the player from a board are also
+    the moves that lead to it.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        int64 array of `BitBoard.key`
+    player : int
+    puts : bool, optional
+        generate the put actions, by default True
+
+    Returns
+    -------
+    tuple
+        (parent, child, put): the index of the board in keys, the key of the
+        child and whether the movement is a put action
+    """
+    parent, code, child = available_move_array(keys, player, puts)
+    return parent, child, code < 27
+
+
+def class_of(keys: np.ndarray) -> np.ndarray:
+    """Return the class code sum(counts[k] * 3**k) of each board"""
+    keys = np.asarray(keys, dtype=np.int64)
+    code = np.zeros(keys.shape, dtype=np.int64)
+    for k in range(6):
+        code += POPCOUNT[keys >> 9*k & LAYER_MASK].astype(np.int64) * 3**k
+    return code
+
+
+def class_code(counts: tuple) -> int:
+    """Return the class code of counts"""
+    return sum(c * 3**k for k, c in enumerate(counts))
+
+
+def class_counts(code: int) -> tuple:
+    """Return the counts of a class code"""
+    return tuple(code // 3**k % 3 for k in range(6))
+
+
+def all_classes() -> list:
+    """Return the counts of all classes in solving order"""
+    classes = [class_counts(code) for code in range(3**6)]
+    classes = [c for c in classes if max(c) <= MAX_CHESS]
+    return sorted(classes, key=lambda c: (-sum(c), c))
+
+
+def class_positions(counts: tuple) -> np.ndarray:
+    """Return the sorted canonical index of all positions in a class"""
+    layers = [
+        np.flatnonzero((_LAYER_COUNT_O == counts[layer])
+                       & (_LAYER_COUNT_X == counts[3 + layer]))
+        for layer in range(3)
+    ]
+    index12 = (layers[1][:, None] * LAYER_SIZE + layers[2][None, :]).ravel()
+    positions = []
+    # a canonical index starts with the smallest of its symmetry layers
+    for r0 in layers[0][_LAYER_MINIMAL[layers[0]]]:
+        index = r0 * LAYER_SIZE**2 + index12
+        positions.append(index[canonical_array(index)[0] == index])
+    if not positions:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(positions)
+
+
+def _slots(ids: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Return the slot in ids of the canonical position of each key"""
+    return np.searchsorted(ids, canonical_array(rank_array(keys))[0])
+
+
+def solve_class(counts: tuple, load, verbose: bool = True,
+                depth: bool = False):
+    """Solve all positions of a class
+
+    Parameters
+    ----------
+    counts : tuple
+        the class to solve
+    load : callable
+        load(counts) -> (ids, value) of a class solved before, or
+        (ids, value, depth) when the depth is solved
+    verbose : bool, optional
+        print the progress, by default True
+    depth : bool, optional
+        also solve the depth (see [Depth]), by default False
+
+    Returns
+    -------
+    tuple
+        (ids, value, depth, passes): sorted canonical index, int8 array
+        value[player - 1][slot] (see [Value]), uint8 array
+        depth[player - 1][slot] (None if not solved) and the number of
+        passes
+    """
+    start = time.time()
+    ids = class_positions(counts)
+    n = len(ids)
+    keys = unrank_array(ids)
+    terminal = check_win_array(keys) != 0
+    value = np.zeros((2, n), dtype=np.int8)
+    counter = np.zeros((2, n), dtype=np.int16)  # unknown children left
+    has_draw = np.zeros((2, n), dtype=bool)
+    playing = np.flatnonzero(~terminal)
+    if depth:
+        # the depth of a WIN and the least depth of a LOSS from the
+        # finished games and the classes solved before
+        win_depth = np.full((2, n), 255, dtype=np.uint8)
+        loss_depth = np.zeros((2, n), dtype=np.uint8)
+
+    # children of every position: the finished games, the classes solved
+    # before (puts) and the distinct children in this class (moves)
+    for player in (1, 2):
+        v, c, d = value[player-1], counter[player-1], has_draw[player-1]
+        for begin in range(0, len(playing), CHUNK):
+            slot = playing[begin:begin + CHUNK]
+            parent, child, put = successors(keys[slot], player)
+            parent = slot[parent]
+            result = check_win_array(child)
+            v[parent[result == player]] = WIN
+            d[parent[result == 3]] = True
+            if depth:
+                win_depth[player-1][parent[result == player]] = 1
+                np.maximum.at(loss_depth[player-1],
+                              parent[result == 3 - player], 1)
+            # puts: look up the class of the child
+            later = np.flatnonzero(put & (result == 0))
+            codes = class_of(child[later])
+            for code in np.unique(codes):
+                i = later[codes == code]
+                loaded = load(class_counts(code))
+                child_slots = _slots(loaded[0], child[i])
+                r = np.asarray(loaded[1][2-player])[child_slots]
+                v[parent[i[r == LOSS]]] = WIN
+                d[parent[i[r == DRAW]]] = True
+                if depth:
+                    r_depth = np.asarray(loaded[2][2-player])[child_slots]
+                    if r_depth.max(initial=0) >= MAX_DEPTH:
+                        raise Exception(f"Depth over {MAX_DEPTH}: {counts}")
+                    r_depth = r_depth + np.uint8(1)
+                    np.minimum.at(win_depth[player-1], parent[i[r == LOSS]],
+                                  r_depth[r == LOSS])
+                    np.maximum.at(loss_depth[player-1], parent[i[r == WIN]],
+                                  r_depth[r == WIN])
+            # moves: count the distinct children
+            i = np.flatnonzero(~put & (result == 0))
+            edges = np.unique(parent[i] * n + _slots(ids, child[i]))
+            p, k = np.unique(edges // n, return_counts=True)
+            c[p] = k
+    if depth:
+        moves = counter.astype(np.uint8)  # distinct children in the class
+    counter[:, terminal] = 0
+    counter[value == WIN] = 0
+    done = (counter == 0) & (value != WIN) & ~terminal[None, :]
+    value[done & ~has_draw] = LOSS
+    front = [np.flatnonzero((v != DRAW) & ~terminal) for v in value]
+
+    # propagate the decided positions to the positions before them
+    passes = 0
+    while len(front[0]) or len(front[1]):
+        passes += 1
+        new_front = [[], []]
+        for t in (1, 2):  # the player to move at the decided positions
+            m = 3 - t  # the player who moved to them
+            v_t = value[t-1]
+            v_m, c_m, d_m = value[m-1], counter[m-1], has_draw[m-1]
+            for begin in range(0, len(front[t-1]), CHUNK):
+                slot = front[t-1][begin:begin + CHUNK]
+                i, pre, _ = successors(keys[slot], m, puts=False)
+                edges = np.unique(_slots(ids, pre) * n + slot[i])
+                p, child = edges // n, edges % n
+                win = p[v_t[child] == LOSS]
+                win = np.unique(win[c_m[win] > 0])
+                v_m[win] = WIN
+                c_m[win] = 0
+                new_front[m-1].append(win)
+                p, k = np.unique(p[v_t[child] == WIN], return_counts=True)
+                k = k[c_m[p] > 0]
+                p = p[c_m[p] > 0]
+                c_m[p] -= k
+                lose = p[(c_m[p] == 0) & ~d_m[p]]
+                v_m[lose] = LOSS
+                new_front[m-1].append(lose)
+        front = [np.concatenate(f) if f else np.zeros(0, np.int64)
+                 for f in new_front]
+    depths = None
+    if depth:
+        del counter, has_draw
+        depths = _solve_depth(keys, ids, value, terminal, moves, win_depth,
+                              loss_depth, counts)
+    if verbose:
+        print(f"class {counts}: {n} positions, {passes} passes, "
+              f"O to move win/loss {np.count_nonzero(value[0] == WIN)}/"
+              f"{np.count_nonzero(value[0] == LOSS)}, "
+              + (f"max depth {depths.max()}, " if depth else "")
+              + f"{time.time() - start:.1f}s")
+    return ids, value, depths, passes
+
+
+def _solve_depth(keys: np.ndarray, ids: np.ndarray, value: np.ndarray,
+                 terminal: np.ndarray, moves: np.ndarray,
+                 win_depth: np.ndarray, loss_depth: np.ndarray,
+                 counts: tuple) -> np.ndarray:
+    """Return the depth of a solved class, see [Depth]
+
+    moves are the distinct children in the class, win_depth and loss_depth
+    what the finished games and the classes solved before give.
+    """
+    n = len(ids)
+    depth = np.full((2, n), 255, dtype=np.uint8)
+    due = np.full((2, n), 255, dtype=np.uint8)  # the depth when known
+    for v, m, w, l, u in zip(value, moves, win_depth, loss_depth, due):
+        win = (v == WIN) & ~terminal
+        u[win] = w[win]
+        loss = (v == LOSS) & ~terminal & (m == 0)
+        u[loss] = l[loss]
+    left = [np.count_nonzero((v != DRAW) & ~terminal) for v in value]
+    level = 0
+    while left[0] or left[1]:
+        if level > MAX_DEPTH:
+            raise Exception(f"Depth over {MAX_DEPTH}: {counts}")
+        front = []
+        for p in (0, 1):
+            f = np.flatnonzero((due[p] == level) & (depth[p] == 255))
+            depth[p][f] = level
+            left[p] -= len(f)
+            front.append(f)
+        for t in (1, 2):  # the player to move at the positions of the level
+            m = 3 - t
+            v_t = value[t-1]
+            v_m, c_m, u_m = value[m-1], moves[m-1], due[m-1]
+            for begin in range(0, len(front[t-1]), CHUNK):
+                slot = front[t-1][begin:begin + CHUNK]
+                i, pre, _ = successors(keys[slot], m, puts=False)
+                edges = np.unique(_slots(ids, pre) * n + slot[i])
+                p, child = edges // n, edges % n
+                # the first LOSS child gives the depth of a WIN
+                win = p[v_t[child] == LOSS]
+                win = win[v_m[win] == WIN]
+                u_m[win] = np.minimum(u_m[win], level + 1)
+                # the last WIN child gives the depth of a LOSS
+                p, k = np.unique(p[v_t[child] == WIN], return_counts=True)
+                p, k = p[v_m[p] == LOSS], k[v_m[p] == LOSS]
+                c_m[p] -= k.astype(np.uint8)
+                lose = p[c_m[p] == 0]
+                u_m[lose] = np.maximum(loss_depth[m-1][lose], level + 1)
+        level += 1
+    depth[depth == 255] = 0  # DRAW and the finished games
+    return depth
+
+
+def _path(directory: Path, counts: tuple) -> tuple:
+    name = "class_" + "".join(map(str, counts))
+    return (directory / f"{name}_index.npy", directory / f"{name}_value.npy")
+
+
+def _depth_path(directory: Path, counts: tuple) -> Path:
+    return directory / f"class_{''.join(map(str, counts))}_depth.npy"
+
+
+def load_class(directory, counts: tuple, depth: bool = False) -> tuple:
+    """Load a solved class (memory-mapped)
+
+    Returns
+    -------
+    tuple
+        (ids, value), or (ids, value, depth) if depth is True, see
+        `solve_class`
+    """
+    index_file, value_file = _path(Path(directory), counts)
+    loaded = (np.load(index_file, mmap_mode='r'),
+              np.load(value_file, mmap_mode='r'))
+    if depth:
+        loaded += (np.load(_depth_path(Path(directory), counts),
+                           mmap_mode='r'),)
+    return loaded
+
+
+def solve_all(directory, verbose: bool = True, classes: list = None,
+              depth: bool = False):
+    """Solve every class and save them in the directory
+
+    The classes already in the directory are skipped, so an interrupted run
+    can be continued. `classes` (in solving order, see `all_classes`) only
+    solves these, a class must come after the classes one chess fuller.
+    With depth the depths are solved and saved too (see [Depth]).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    loaded = {}
+
+    def load(counts):
+        if counts not in loaded:
+            loaded[counts] = load_class(directory, counts, depth)
+        return loaded[counts]
+
+    for counts in all_classes() if classes is None else classes:
+        index_file, value_file = _path(directory, counts)
+        depth_file = _depth_path(directory, counts)
+        if (index_file.exists() and value_file.exists()
+                and (not depth or depth_file.exists())):
+            continue
+        ids, value, depths, _ = solve_class(counts, load, verbose, depth)
+        if depth:
+            np.save(depth_file, depths)
+        np.save(value_file, value)
+        np.save(index_file, ids.astype(np.uint32))
+
+
+def probe(directory, key: int, player: int) -> int:
+    """Return the value of a position for the player to move
+
+    Returns
+    -------
+    int
+        DRAW, WIN or LOSS
+    """
+    keys = np.array([key], dtype=np.int64)
+    ids, value = load_class(directory, class_counts(int(class_of(keys)[0])))
+    return int(value[player-1][_slots(ids, keys)[0]])
+
+
+def best_movement(directory, key: int, player: int) -> tuple:
+    """Return the movement of perfect play that ends the game the soonest
+    when winning and the latest when losing
+
+    One lookup of the value and the depth (see [Depth]) for each movement,
+    the classes must be solved with the depth.
+
+    Returns
+    -------
+    tuple
+        (movement, value, depth) for the player to move, movement None if
+        the player has no movement
+    """
+    parent, code, child = available_move_array(
+        np.array([key], dtype=np.int64), player)
+    if not len(code):
+        return None, LOSS, 0
+    result = check_win_array(child)
+    value = np.where(result == player, WIN,
+                     np.where(result == 3, DRAW, LOSS)).astype(np.int8)
+    depth = np.ones(len(code), dtype=np.int64)
+    playing = np.flatnonzero(result == 0)
+    codes = class_of(child[playing])
+    for class_code_ in np.unique(codes):
+        i = playing[codes == class_code_]
+        ids, child_value, child_depth = load_class(
+            directory, class_counts(int(class_code_)), True)
+        slots = _slots(ids, child[i])
+        r = np.asarray(child_value[2-player])[slots]
+        # the value of the child for the opponent, turned for the player
+        value[i] = np.choose(r, [DRAW, LOSS, WIN])
+        depth[i] = np.asarray(child_depth[2-player])[slots].astype(
+            np.int64) + 1
+    # WIN with the smallest depth, then DRAW, then LOSS with the largest
+    rank = np.choose(value, [0, 1000 - depth, depth - 1000])
+    best = int(np.argmax(rank))
+    return (MOVEMENTS[code[best]], int(value[best]),
+            int(depth[best]) if value[best] != DRAW else 0)
+
+
+def perfect_game(directory, key: int = 0, player: int = 1) -> BitBoard:
+    """Play `best_movement` for both players until the game ends
+
+    The winner takes the shortest win, so the history is as long as the
+    depth of the position (see [Depth]); a draw stops after MAX_DEPTH
+    movements. `chessboard.BoardHistory` replays the history of a game
+    from the empty board.
+
+    Returns
+    -------
+    BitBoard
+        the board at the end, history: the movements from key
+    """
+    board = BitBoard(key)
+    for _ in range(MAX_DEPTH):
+        if board.check_win():
+            break
+        movement, _, _ = best_movement(directory, board.key, player)
+        if movement is None:
+            break
+        board.make_move(movement, player, False)
+        player = 3 - player
+    return board
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description="Retrograde analysis")
+    parser.add_argument("directory", nargs="?", default="data/retrograde")
+    parser.add_argument("--depth", action="store_true",
+                        help="also solve the depth to the end of the game")
+    parser.add_argument("--check", action="store_true",
+                        help="check the solved classes of the directory "
+                             "instead of solving")
+    parser.add_argument("--positions", type=int, default=200,
+                        help="check: random positions of each class")
+    parser.add_argument("--search", type=int, default=20,
+                        help="check: of them compared with wdl.py")
+    args = parser.parse_args()
+
+    if not args.check:
+        solve_all(args.directory, depth=args.depth)
+    else:
+        import wdl
+
+        directory = Path(args.directory)
+        loaded = {}
+
+        def stored(key: int, player: int) -> int:
+            keys = np.array([key], dtype=np.int64)
+            counts = class_counts(int(class_of(keys)[0]))
+            if counts not in loaded:
+                loaded[counts] = load_class(directory, counts)
+            ids, value = loaded[counts]
+            return int(value[player-1][_slots(ids, keys)[0]])
+
+        # each value is the one of value iteration from the stored values
+        # of the children (a fixpoint), the depths satisfy [Depth] and the
+        # wdl search from the position gives the same value
+        random.seed(0)
+        for index_file in sorted(directory.glob("class_*_index.npy")):
+            counts = tuple(int(c) for c in index_file.name[6:12])
+            depth = _depth_path(directory, counts).exists()
+            if depth:
+                ids, value, depths = load_class(directory, counts, True)
+            else:
+                ids, value = load_class(directory, counts)
+            slots = random.sample(range(len(ids)),
+                                  min(args.positions, len(ids)))
+            keys = unrank_array(np.asarray(ids)[slots].astype(np.int64))
+            checked = searched = 0
+            for slot, key in zip(slots, keys.tolist()):
+                board = BitBoard(key)
+                if board.check_win():
+                    continue
+                for player in (1, 2):
+                    values = []
+                    for movement in board.available_move(player):
+                        board.make_move(movement, player, False)
+                        result = board.check_win()
+                        values.append(
+                            (WIN if result == player else
+                             DRAW if result == 3 else LOSS) if result else
+                            (DRAW, LOSS, WIN)[stored(board.key, 3 - player)])
+                        board.unmake_move()
+                    expected = (WIN if WIN in values else
+                                DRAW if DRAW in values else LOSS)
+                    assert value[player-1][slot] == expected, (key, player)
+                    if depth:
+                        _, v, d = best_movement(directory, key, player)
+                        assert v == expected
+                        assert d == depths[player-1][slot], (key, player)
+                    if searched < args.search:
+                        wdl.clear()
+                        assert {wdl.WIN: WIN, wdl.DRAW: DRAW,
+                                wdl.LOSS: LOSS}[wdl.wdl_turns(
+                                    BitBoard(key), player)] == expected
+                        searched += 1
+                    checked += 1
+            print(f"class {counts}: {checked} values"
+                  + (" and depths" if depth else "")
+                  + f" checked, {searched} with wdl.py")
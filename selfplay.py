@@ -0,0 +1,344 @@
+"""Play many games at once
+
+All games of a batch advance one ply together: the movements of every
+board are generated by `available_move_array`, a policy scores them and
+one movement per board is chosen (the best score, ties at random). The
+batches run on a process pool and the games are written as game records
+(see gamerecord.py) with the aggregate statistics.
+
+    python selfplay.py --games 1000000 --o random --x greedy --output g.bin
+    python selfplay.py --check
+"""
+
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from bitboard import available_move_array, check_win_array, top_array
+from ordering import OPEN_TWOS
+
+_OPEN_TWOS = np.array(OPEN_TWOS, dtype=np.int64)
+
+
+class Policy:
+    """Uniform random, the base class
+
+    scores(keys, player, parent, code, child) returns a score for each
+    movement (the arrays of `available_move_array` of the boards keys), or
+    None for all the same. The movement with the best score is played, the
+    ties are broken at random.
+    """
+
+    def scores(self, keys: np.ndarray, player: int, parent: np.ndarray,
+               code: np.ndarray, child: np.ndarray):
+        return None
+
+
+class Greedy(Policy):
+    """Win at once if possible, never finish the game for the opponent,
+    then block the opponent's two-in-a-rows and make the player's own"""
+
+    def scores(self, keys, player, parent, code, child):
+        mine, theirs = top_array(child, player), top_array(child, 3 - player)
+        scores = _OPEN_TWOS[mine | theirs << 9] - 2 * _OPEN_TWOS[theirs
+                                                                 | mine << 9]
+        win = check_win_array(child)
+        scores[win != 0] = -100  # the opponent wins or a tie
+        scores[win == player] = 100
+        return scores
+
+
+class OraclePolicy(Policy):
+    """The best movement of an `oracle.Oracle`, random where the oracle
+    does not know the position
+
+    Parameters
+    ----------
+    directory : str | Path
+        the oracle directory, opened in each process
+    """
+
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        self._oracle = None
+
+    def __getstate__(self) -> dict:
+        return {"directory": self.directory, "_oracle": None}
+
+    def scores(self, keys, player, parent, code, child):
+        if self._oracle is None:
+            from oracle import Oracle
+
+            self._oracle = Oracle(self.directory)
+        _, best = self._oracle.query(keys, np.full(len(keys), player))
+        return (code == best[parent]).astype(np.int64)
+
+
+POLICIES = {"random": Policy, "greedy": Greedy}
+
+
+def _choose(scores, parent: np.ndarray, starts: np.ndarray,
+            counts: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Return the index of the chosen movement of each board (-1 if the
+    board has no movement)"""
+    chosen = np.full(len(counts), -1, dtype=np.int64)
+    has = counts > 0
+    if scores is None:
+        chosen[has] = (starts[has]
+                       + (rng.random(np.count_nonzero(has))
+                          * counts[has]).astype(np.int64))
+        return chosen
+    key = scores + rng.random(len(scores)) * 0.5  # the ties at random
+    best = np.maximum.reduceat(key, starts[has])
+    index = np.flatnonzero(key == np.repeat(best, counts[has]))
+    boards, first = np.unique(parent[index], return_index=True)
+    chosen[boards] = index[first]
+    return chosen
+
+
+def play_batch(n: int, policies: tuple, seed: int = 0,
+               max_moves: int = 200) -> dict:
+    """Play n games from the empty board
+
+    Parameters
+    ----------
+    n : int
+    policies : tuple
+        (policy of O, policy of X)
+    seed : int, optional
+    max_moves : int, optional
+        the games that are not finished after it have the result 0,
+        by default 200
+
+    Returns
+    -------
+    dict
+        codes: the movement codes of the games one after another (uint8)
+        lengths, results: movements and result of each game, the result is
+        `check_win` at the end, or the winner when the player to move has
+        no movement (see `solve.o_turns`)
+        positions, movements: boards expanded and movements generated
+    """
+    rng = np.random.default_rng(seed)
+    keys = np.zeros(n, dtype=np.int64)
+    moves = np.zeros((n, max_moves), dtype=np.uint8)
+    lengths = np.full(n, max_moves, dtype=np.int64)
+    results = np.zeros(n, dtype=np.int8)
+    active = np.arange(n)
+    player = 1
+    positions = movements = 0
+    for ply in range(max_moves):
+        if not len(active):
+            break
+        board_keys = keys[active]
+        parent, code, child = available_move_array(board_keys, player)
+        counts = np.bincount(parent, minlength=len(active))
+        starts = np.cumsum(counts) - counts
+        positions += len(active)
+        movements += len(parent)
+        scores = policies[player - 1].scores(board_keys, player, parent,
+                                             code, child)
+        chosen = _choose(scores, parent, starts, counts, rng)
+        stuck = chosen < 0
+        results[active[stuck]] = 3 - player
+        lengths[active[stuck]] = ply
+        playing = active[~stuck]
+        chosen = chosen[~stuck]
+        keys[playing] = child[chosen]
+        moves[playing, ply] = code[chosen]
+        win = check_win_array(keys[playing])
+        results[playing] = win
+        lengths[playing[win != 0]] = ply + 1
+        active = playing[win == 0]
+        player = 3 - player
+    codes = moves[np.arange(max_moves)[None, :] < lengths[:, None]]
+    return {"codes": codes, "lengths": lengths, "results": results,
+            "positions": positions, "movements": movements}
+
+
+class Stats:
+    """Aggregate statistics of the games"""
+
+    def __init__(self, max_moves: int = 200) -> None:
+        self.games = 0
+        self.results = np.zeros(4, dtype=np.int64)  # by `check_win`
+        self.lengths = np.zeros(max_moves + 1, dtype=np.int64)  # histogram
+        self.positions = 0
+        self.movements = 0
+
+    def add(self, batch: dict) -> None:
+        self.games += len(batch["lengths"])
+        self.results += np.bincount(batch["results"], minlength=4)
+        self.lengths += np.bincount(batch["lengths"],
+                                    minlength=len(self.lengths))
+        self.positions += batch["positions"]
+        self.movements += batch["movements"]
+
+    def report(self) -> dict:
+        games = max(self.games, 1)
+        return {
+            "games": self.games,
+            "o_win_rate": self.results[1] / games,  # the first player
+            "x_win_rate": self.results[2] / games,
+            "tie_rate": self.results[3] / games,
+            "unfinished_rate": self.results[0] / games,
+            "mean_length": (self.lengths @ np.arange(len(self.lengths))
+                            / games),
+            "length_histogram": self.lengths.tolist(),
+            "branching_factor": self.movements / max(self.positions, 1),
+        }
+
+
+def replay_check(reader, max_moves: int = 200) -> int:
+    """Replay the games of a record with `BitBoard.available_move` and
+    `make_move`, raise AssertionError if a movement is not legal or a
+    result does not match the board at the end (see `play_batch`)
+
+    Returns
+    -------
+    int
+        the movements replayed
+    """
+    from bitboard import MOVEMENTS, BitBoard
+
+    replayed = 0
+    for i, codes in enumerate(reader):
+        board, player = BitBoard(), 1
+        for ply, code in enumerate(codes.tolist()):
+            assert not board.check_win(), f"game {i}: ended before {ply}"
+            movement = MOVEMENTS[code]
+            assert movement in board.available_move(player), (
+                f"game {i}: {movement} is not legal at {ply}")
+            board.make_move(movement, player, False)
+            player = 3 - player
+        replayed += len(codes)
+        if board.check_win():
+            expected = board.check_win()
+        elif len(codes) < max_moves:
+            assert not board.available_move(player), (
+                f"game {i}: stopped with movements left")
+            expected = 3 - player
+        else:
+            expected = 0
+        assert reader.results[i] == expected, (
+            f"game {i}: result {reader.results[i]}, replayed {expected}")
+    return replayed
+
+
+def _play(task: tuple) -> dict:
+    return play_batch(*task)
+
+
+def simulate(games: int, policies: tuple, workers: int = 4,
+             batch: int = 8192, seed: int = 0, max_moves: int = 200,
+             writer=None) -> Stats:
+    """Play the games on a process pool
+
+    Parameters
+    ----------
+    games : int
+    policies : tuple
+        (policy of O, policy of X)
+    workers : int, optional
+        processes, 0 plays in this process, by default 4
+    batch : int, optional
+        games played at once by a process, by default 8192
+    seed : int, optional
+        batch i uses the seed (seed, i)
+    writer : gamerecord.GameWriter, optional
+        where the games are written, by default None
+
+    Returns
+    -------
+    Stats
+    """
+    tasks = [(min(batch, games - begin), policies, (seed, i), max_moves)
+             for i, begin in enumerate(range(0, games, batch))]
+    stats = Stats(max_moves)
+
+    def collect(results):
+        for result in results:
+            stats.add(result)
+            if writer is not None:
+                writer.write_batch(result["codes"], result["lengths"],
+                                   result["results"])
+
+    if workers:
+        with Pool(workers) as pool:
+            collect(pool.imap_unordered(_play, tasks))
+    else:
+        collect(map(_play, tasks))
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import tempfile
+    from pathlib import Path
+
+    from gamerecord import GameReader, GameWriter
+
+    parser = argparse.ArgumentParser(description="Self-play simulator")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--o", default="random",
+                        choices=["random", "greedy", "oracle"],
+                        help="the policy of O")
+    parser.add_argument("--x", default="random",
+                        choices=["random", "greedy", "oracle"],
+                        help="the policy of X")
+    parser.add_argument("--oracle", metavar="DIR",
+                        help="the oracle directory of the oracle policy")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="processes, 0: no pool")
+    parser.add_argument("--batch", type=int, default=8192)
+    parser.add_argument("--max-moves", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the games to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="play a small batch of each pair of the random "
+                             "and greedy policies and replay the games")
+    args = parser.parse_args()
+
+    if args.check:
+        # a batch size that is not a divisor of the games, so a partial
+        # batch is written too
+        with tempfile.TemporaryDirectory() as directory:
+            for o in ("random", "greedy"):
+                for x in ("random", "greedy"):
+                    path = Path(directory) / f"{o}_{x}.bin"
+                    with GameWriter(path, capacity=4096) as writer:
+                        stats = simulate(1000, (POLICIES[o](), POLICIES[x]()),
+                                         args.workers, 300, args.seed,
+                                         args.max_moves, writer)
+                    with GameReader(path) as reader:
+                        assert len(reader) == stats.games
+                        assert (np.bincount(reader.results, minlength=4)
+                                == stats.results).all()
+                        replayed = replay_check(reader, args.max_moves)
+                    print(f"{o} vs {x}: {stats.games} games, {replayed} "
+                          "movements replayed")
+    else:
+        policies = tuple(
+            OraclePolicy(args.oracle) if name == "oracle" else POLICIES[name]()
+            for name in (args.o, args.x)
+        )
+        start = time.time()
+        if args.output:
+            with GameWriter(args.output) as writer:
+                stats = simulate(args.games, policies, args.workers,
+                                 args.batch, args.seed, args.max_moves,
+                                 writer)
+        else:
+            stats = simulate(args.games, policies, args.workers, args.batch,
+                             args.seed, args.max_moves)
+        t = time.time() - start
+        report = stats.report()
+        histogram = report.pop("length_histogram")
+        print(json.dumps(report, indent=1))
+        print("length percentiles (25, 50, 75, 99):", [
+            int(np.searchsorted(np.cumsum(histogram), q * stats.games))
+            for q in (0.25, 0.5, 0.75, 0.99)
+        ])
+        print(f"{stats.games / t * 60:.0f} games/min, {t:.1f}s")
@@ -1,34 +1,20 @@
 """The main script to solve the problem"""
-# PYTHONHASHSEED=0
-# import sys
 
+from pathlib import Path
 
-import numpy as np
 import psutil
 
 import datamanager
-from chessboard import Board
-
-# sys.setrecursionlimit(sys.getrecursionlimit()+1500)
+from bitboard import BitBoard
+from symmetry import canonical_key
+from ttable import BoundedTable, TwoTierTable
 
 # The Terms and Variables Definition use in the code
 #
-# boards:
-#   Recode the relation of symmetry board positions
-#
-#   {
-#       representative_board_hash: None,
-#       symmetry_board_hash: representative_board_hash
-#       , ...
-#   }
-#
-#   The value is 'None,' representing that it is representative of all
-#   symmetry board positions
-#
-#
 # board_state:
 #   Record all board position (only representative board) that have been occur.
-#   key: hash of the board position
+#   key: canonical index of the board position, all the symmetry board
+#        positions share it (see symmetry.py)
 #   value:
 #       True: O win
 #       False: O lose
@@ -36,15 +22,32 @@ from chessboard import Board
 #
 
 
-boards_o = {}
 board_state_o = {}
-boards_x = {}
 board_state_x = {}
 
+# `ordering.MoveOrdering` of the second loop of `iterative_turns`
+ordering = None
+# stop a turn at the first child with the result of the player, the
+# remaining children are not searched (and not recorded)
+cutoff = False
+# `instrumentation.SolverStats` of the solve, None: not counted
+stats = None
+# `tablebase.Tablebase` looked up before a child is searched, None: no
+# endgame tablebase
+tablebase = None
+# generate one movement of each class of equivalent movements at the
+# symmetric boards (`BitBoard.unique_moves`)
+symmetric_moves = False
+# key the tables by the Zobrist keys of a `zobrist.ZobristBoard` instead of
+# the canonical index (see `similar`), the tables must be dicts
+zobrist = False
+
 
 class Status:
     def __init__(self) -> None:
         self.n = 0
+        self.nodes = 0  # turns expanded by `_scan`
+        self.checkpoint = None  # datamanager.Checkpoint of the solve
 
     def print_now(self, board):
         if len(board_state_o) // 1000 > self.n:
@@ -54,8 +57,18 @@ class Status:
 
     def check_memory_use(self, board):
         if psutil.virtual_memory()[2] >= 95:
+            if isinstance(board_state_o, TwoTierTable):
+                # move half of the hot tier to disk and go on
+                for board_state in (board_state_o, board_state_x):
+                    board_state.shrink(board_state.capacity // 2)
+                    print(board_state.report())
+                return
+            if self.checkpoint is not None:
+                # saved and exit by `iterative_turns` at the next step
+                self.checkpoint.stop = True
+                return
             datamanager.save(
-                board, boards_o, board_state_o, boards_x, board_state_x, False
+                board, board_state_o, board_state_x, False
             )
             print("The system ran out of memory")
             exit(1)
@@ -64,153 +77,478 @@ class Status:
 status = Status()
 
 
-def o_turns(board: Board):
+def o_turns(board: BitBoard) -> bool:
+    """Return True if O (to move) will win
+
+    The board is changed in place by `make_move`/`unmake_move` and is
+    restored before returning.
+    """
     status.print_now(board)
 
-    next_chess = board.available_move(1)
-    results = []
-    boards_next = []  # the movement that not win or tie
-    for movement in next_chess:
-        if movement[0] == 0:
-            board_next = board.copy()
-            board_next.put(movement[1], 1)
+    movements_next = []  # the movement that not win or tie
+    movements = (board.unique_moves(1) if symmetric_moves
+                 else board.available_move(1))
+    for movement in movements:
+        board.make_move(movement, 1, False)
+        ha = similar(board)
+        if ha in board_state_o:
+            state = board_state_o[ha]
         else:
-            board_next = board.copy()
-            board_next.move(*movement[1], 1)
-        if have_similar(board_next, boards_o):
-            state = find_state(board_next, boards_o, board_state_o)
-            results.append(state)
-            if state:
-                return any(results)
-            continue
-        else:
-            win_status = board_next.check_win()
+            win_status = board.check_win()
             if win_status == 1:
-                ha = similar(board_next, boards_o)
-                board_state_o[ha] = True
-                results.append(True)
-                return any(results)
+                board_state_o[ha] = state = True
             elif win_status in (3, 2):
-                ha = similar(board_next, boards_o)
-                board_state_o[ha] = False
-                results.append(False)
+                board_state_o[ha] = state = False
+            elif tablebase is not None and (state := tablebase.o_wins(
+                    board.key, 2, None if zobrist else ha)) is not None:
+                board_state_o[ha] = state
             else:
-                boards_next.append(board_next)
-    for board_next in boards_next:
-        if have_similar(board_next, boards_o):
-            state = find_state(board_next, boards_o, board_state_o)
-            results.append(state)
+                movements_next.append(movement)
+                state = False
+        board.unmake_move()
+        if state:
+            return True
+    result = False
+    for movement in movements_next:
+        board.make_move(movement, 1, False)
+        ha = similar(board)
+        if ha in board_state_o:
+            state = board_state_o[ha]
+            board.unmake_move()
             if state:
-                return any(results)
-            continue
-        else:
-            ha = similar(board_next, boards_o)
-            board_state_o[ha] = None
-            r = x_turns(board_next)
-            results.append(r)
-            board_state_o[ha] = r
-
-    return any(results)
-
-
-def x_turns(board: Board):
-    next_chess = board.available_move(2)
-    results = []
-    boards_next = []  # the movement that not win or tie
-    for movement in next_chess:
-        if movement[0] == 0:
-            board_next = board.copy()
-            board_next.put(movement[1], 2)
-        else:
-            board_next = board.copy()
-            board_next.move(*movement[1], 2)
-        if have_similar(board_next, boards_x):
-            state = find_state(board_next, boards_x, board_state_x)
-            results.append(state)
-            if not state:
-                return all(results)
+                return True
             continue
+        board_state_o[ha] = None
+        r = x_turns(board)
+        board_state_o[ha] = r
+        board.unmake_move()
+        result = result or r
+    return result
+
+
+def x_turns(board: BitBoard) -> bool:
+    """Return True if O will win after X (to move)
+
+    The board is changed in place by `make_move`/`unmake_move` and is
+    restored before returning.
+    """
+    movements_next = []  # the movement that not win or tie
+    movements = (board.unique_moves(2) if symmetric_moves
+                 else board.available_move(2))
+    for movement in movements:
+        board.make_move(movement, 2, False)
+        ha = similar(board)
+        if ha in board_state_x:
+            state = board_state_x[ha]
         else:
-            win_status = board_next.check_win()
+            win_status = board.check_win()
             if win_status in (3, 2):
-                ha = similar(board_next, boards_x)
-                board_state_x[ha] = False
-                results.append(False)
-                return all(results)
+                board_state_x[ha] = state = False
             elif win_status == 1:
-                ha = similar(board_next, boards_x)
-                board_state_x[ha] = True
-                results.append(True)
+                board_state_x[ha] = state = True
+            elif tablebase is not None and (state := tablebase.o_wins(
+                    board.key, 1, None if zobrist else ha)) is not None:
+                board_state_x[ha] = state
             else:
-                boards_next.append(board_next)
-    for board_next in boards_next:
-        if have_similar(board_next, boards_x):
-            state = find_state(board_next, boards_x, board_state_x)
-            results.append(state)
+                movements_next.append(movement)
+                state = True
+        board.unmake_move()
+        if not state:
+            return False
+    result = True
+    for movement in movements_next:
+        board.make_move(movement, 2, False)
+        ha = similar(board)
+        if ha in board_state_x:
+            state = board_state_x[ha]
+            board.unmake_move()
             if not state:
-                return all(results)
+                return False
             continue
+        board_state_x[ha] = None
+        r = o_turns(board)
+        board_state_x[ha] = r
+        board.unmake_move()
+        result = result and r
+    return result
+
+
+def _table(player: int) -> dict:
+    """Return the board_state of the positions after the player moved"""
+    if player == 1:
+        return board_state_o
+    return board_state_x
+
+
+def _scan(board: BitBoard, player: int):
+    """The first loop of `o_turns`/`x_turns`
+
+    Check all movements of the player without going deeper, record the
+    movements that finish the game.
+
+    Returns
+    -------
+    bool or list
+        bool: the turn is short-circuited with this result
+        list: the movements that not win or tie
+    """
+    status.nodes += 1
+    if player == 1:
+        status.print_now(board)
+    board_state = _table(player)
+    target = player == 1  # O takes any(), X takes all()
+    movements_next = []
+    movements = (board.unique_moves(player) if symmetric_moves
+                 else board.available_move(player))
+    for movement in movements:
+        board.make_move(movement, player, False)
+        ha = similar(board)
+        hit = ha in board_state
+        if stats is not None:
+            stats.probe(player, hit)
+        if hit:
+            state = bool(board_state[ha])
         else:
-            ha = similar(board_next, boards_x)
-            board_state_x[ha] = None
-            r = o_turns(board_next)
-            results.append(r)
-            board_state_x[ha] = r
-    return all(results)
+            win_status = board.check_win()
+            if win_status:
+                state = win_status == 1
+            elif tablebase is not None:
+                # a position of the tablebase is decided without a search
+                state = tablebase.o_wins(board.key, 3 - player,
+                                         None if zobrist else ha)
+            else:
+                state = None
+            if state is None:
+                movements_next.append(movement)
+                state = not target
+            else:
+                board_state[ha] = state
+                if stats is not None:
+                    stats.store(player)
+        board.unmake_move()
+        if state == target:
+            if stats is not None:
+                stats.short_circuits += 1
+            return target
+    if ordering is not None:
+        movements_next = ordering.order(board, player, movements_next)
+    return movements_next
+
 
+def iterative_turns(board: BitBoard, player: int = 1, checkpoint=None,
+                    stack: list = None, r=None) -> bool:
+    """Non-recursive version of `o_turns` (player 1) and `x_turns` (player 2)
 
-def similar(board: Board, boards) -> int:
-    """Find all symmetry chess position and update the relation to `boards`
+    The alternation of the turns is driven by an explicit stack, so the depth
+    of the tree is only limited by memory. The board is changed in place and
+    the same positions are recorded in the same order as the recursive
+    version.
+
+    Parameters
+    ----------
+    board : BitBoard
+    player : int, optional
+        the player to move, by default 1
+    checkpoint : datamanager.Checkpoint, optional
+        save the search periodically, by default None
+    stack, r : optional
+        continue the search saved by the checkpoint (the board must be the
+        saved one), by default None
 
     Returns
     -------
-    int
-        hash of input board
+    bool
+        True: O will win
     """
-    b = board.board.copy()
-    hashs = []
-    for i in range(4):
-        br = np.rot90(b, i, axes=(1, 2))
-        hashs.append(hash(br.tobytes()))
-        hashs.append(hash(np.flip(br, 1).tobytes()))
-    boards.update({hashs[0]: None})
-    for h in set(hashs) - {hashs[0]}:
-        boards.update({h: hashs[0]})
-    return hashs[0]
+    if stack is None:
+        if stats is not None:
+            stats.expand(0)
+        scanned = _scan(board, player)
+        if isinstance(scanned, bool):
+            return scanned
+        # frame: [player, movements not win or tie, next index,
+        #         partial result, index of the child in progress]
+        stack = [[player, scanned, 0, player != 1, None]]
+        r = None  # result of the child frame just finished
+    while True:
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save(board, stack, r)
+            if checkpoint.stop:
+                print("The system ran out of memory")
+                exit(1)
+        frame = stack[-1]
+        player, movements_next, i, result, ha = frame
+        board_state = _table(player)
+        target = player == 1  # O takes any(), X takes all()
+        if r is not None:
+            board_state[ha] = r
+            board.unmake_move()
+            if stats is not None:
+                stats.store(player)
+            if r == target:
+                result = target
+                if stats is not None:
+                    stats.cutoffs += 1
+                if ordering is not None:
+                    ordering.cutoff(board, player, movements_next[i-1])
+                if cutoff:
+                    i = len(movements_next)
+            r = None
+        scanned = None
+        while i < len(movements_next):
+            board.make_move(movements_next[i], player, False)
+            i += 1
+            ha = similar(board)
+            hit = ha in board_state
+            if stats is not None:
+                stats.probe(player, hit)
+            if hit:
+                state = bool(board_state[ha])
+                board.unmake_move()
+                if state == target:
+                    result = target
+                    if stats is not None:
+                        stats.cutoffs += 1
+                    if ordering is not None:
+                        ordering.cutoff(board, player, movements_next[i-1])
+                    break
+                continue
+            board_state[ha] = None
+            if stats is not None:
+                stats.store(player)
+                stats.expand(len(stack))
+            scanned = _scan(board, 3 - player)
+            if isinstance(scanned, list):
+                break
+            board_state[ha] = scanned
+            board.unmake_move()
+            if stats is not None:
+                stats.store(player)
+            if scanned == target:
+                result = target
+                if stats is not None:
+                    stats.cutoffs += 1
+                if ordering is not None:
+                    ordering.cutoff(board, player, movements_next[i-1])
+                if cutoff:
+                    i = len(movements_next)
+            scanned = None
+        if scanned is not None:
+            frame[2:] = i, result, ha
+            stack.append([3 - player, scanned, 0, player == 1, None])
+            continue
+        stack.pop()
+        if not stack:
+            return result
+        r = result
 
 
-def have_similar(board: Board, boards) -> bool:
-    """Check if the board was record in the `boards`"""
-    return hash(board.board.tobytes()) in boards
+def similar(board: BitBoard) -> int:
+    """Return the key of the board in `board_state`
 
+    All the symmetry board positions have the same key.
 
-def find_state(board: Board, boards, board_state):
-    """Find the recoded state of the board
+    Returns
+    -------
+    int
+        canonical index of input board, or the smallest of its Zobrist keys
+        when `zobrist` is True
+    """
+    if zobrist:
+        return min(board.zobrist)
+    return canonical_key(board.key)
+
+
+def find_state(board: BitBoard, player: int):
+    """Find the recorded state of the board after the player moved
+
+    Works with the dicts, `TwoTierTable` and `BoundedTable`.
 
     Returns
     -------
     bool or None
+        None: not recorded or not finished
     """
-    board_hash = hash(board.board.tobytes())
-    while True:
-        if boards[board_hash] is None:
-            break
-        board_hash = boards[board_hash]
-    return board_state[board_hash]
+    return _table(player).get(similar(board))
 
 
 if __name__ == "__main__":
-    board = Board()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Solve Gobblet Gobblers")
+    parser.add_argument(
+        "--engine", choices=["dfs", "retrograde", "dfpn", "wdl"],
+        default="dfs",
+        help="dfs: search from the board (iterative_turns), "
+             "retrograde: solve every position (retrograde.py), "
+             "dfpn: proof-number search from the board (dfpn.py), "
+             "wdl: win/draw/loss search from the board (wdl.py)"
+    )
+    parser.add_argument(
+        "--resume", metavar="DIR",
+        help="continue the dfs solve from the checkpoint in DIR"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=600,
+        help="seconds between two checkpoints of the dfs solve"
+    )
+    parser.add_argument(
+        "--hot-entries", type=int,
+        help="keep at most this many positions of each table in RAM, the "
+             "others go to a file on disk (see ttable.py)"
+    )
+    parser.add_argument(
+        "--tt-mb", type=float,
+        help="keep the tables of the dfs solve in this many MiB (half for "
+             "each), the positions that do not fit are forgotten and "
+             "searched again (see ttable.BoundedTable)"
+    )
+    parser.add_argument(
+        "--cutoff", action="store_true",
+        help="stop a turn at the first child that decides it"
+    )
+    parser.add_argument(
+        "--ordering", choices=["threat", "killer", "best", "all"],
+        help="move ordering of the dfs solve (see ordering.py)"
+    )
+    parser.add_argument(
+        "--symmetric-moves", action="store_true",
+        help="skip the movements that are equivalent by a symmetry of the "
+             "board"
+    )
+    parser.add_argument(
+        "--tablebase", metavar="FILE",
+        help="look the endgame positions up in FILE instead of searching "
+             "them (see tablebase.py)"
+    )
+    parser.add_argument(
+        "--zobrist", action="store_true",
+        help="key the tables by the Zobrist keys of the 8 symmetries (see "
+             "zobrist.py), no checkpoint is written"
+    )
+    parser.add_argument(
+        "--verify-zobrist", action="store_true",
+        help="--zobrist and check every key against a full recomputation"
+    )
+    parser.add_argument(
+        "--stats", metavar="FILE",
+        help="append JSON-lines snapshots of the counters of the dfs solve "
+             "to FILE (see instrumentation.py)"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=10,
+        help="seconds between two snapshots"
+    )
+    args = parser.parse_args()
+    zobrist = args.zobrist or args.verify_zobrist
+    if zobrist and (args.engine == "wdl" or args.resume or args.hot_entries
+                    or args.tt_mb):
+        parser.error("the Zobrist keys only work with the dict tables of "
+                     "the dfs and dfpn engines, without --resume")
+
+    cutoff = args.cutoff
+    symmetric_moves = args.symmetric_moves
+    if args.tablebase:
+        from tablebase import Tablebase
+
+        tablebase = Tablebase(args.tablebase)
+    if args.ordering:
+        import ordering as move_ordering
+
+        ordering = {
+            "threat": move_ordering.ThreatFirst,
+            "killer": move_ordering.KillerHistory,
+            "best": move_ordering.BestMove,
+            "all": lambda: move_ordering.Combined(
+                move_ordering.KillerHistory(), move_ordering.ThreatFirst(),
+                move_ordering.BestMove()
+            ),
+        }[args.ordering]()
+
+    if zobrist:
+        import zobrist as zobrist_hashing
+
+        zobrist_hashing.verify = args.verify_zobrist
+        board = zobrist_hashing.ZobristBoard()
+    else:
+        board = BitBoard()
     # board.put(0, 1)
     # board.put(3, 2)
     # board.put(4, 2)
     # board.put(6, 1)
     # board.show()
-    # print(hash(board.board.tobytes()))
-
-    result = o_turns(board)
-    # result = x_turns(board)
-    print("O will win:", result)
-    print("finished!")
-    datamanager.save(board, boards_o, board_state_o,
-                     boards_x, board_state_x, True)
+    # print(board.key)
+
+    if args.engine == "retrograde":
+        import retrograde
+
+        retrograde.solve_all("data/retrograde")
+        value = retrograde.probe("data/retrograde", board.key, 1)
+        print("O will win:", value == retrograde.WIN,
+              "(draw)" if value == retrograde.DRAW else "")
+        print("finished!")
+    elif args.engine == "dfpn":
+        import dfpn
+
+        result = dfpn.dfpn_turns(board, 1, similar)
+        print("O will win:", result)
+        print("nodes:", dfpn.counter.nodes)
+        print("finished!")
+    elif args.engine == "wdl":
+        import wdl
+
+        wdl.ordering = ordering
+        value = wdl.wdl_turns(board, 1)
+        print("O (first player):",
+              {wdl.WIN: "win", wdl.DRAW: "draw", wdl.LOSS: "loss"}[value])
+        print("nodes:", wdl.counter.nodes)
+        print("finished!")
+    else:
+        directory = args.resume or datamanager.new_directory()
+        if args.hot_entries:
+            board_state_o = TwoTierTable(
+                Path(directory) / "cold_o.bin", args.hot_entries,
+                bool(args.resume)
+            )
+            board_state_x = TwoTierTable(
+                Path(directory) / "cold_x.bin", args.hot_entries,
+                bool(args.resume)
+            )
+        elif args.tt_mb:
+            board_state_o = BoundedTable(args.tt_mb / 2)
+            board_state_x = BoundedTable(args.tt_mb / 2)
+        if args.resume:
+            state = datamanager.load_checkpoint(
+                directory, board_state_o, board_state_x
+            )
+            board, stack, r = state["board"], state["stack"], state["r"]
+            print("Resume:", directory, len(board_state_o),
+                  len(board_state_x))
+        else:
+            stack = r = state = None
+        if zobrist:
+            checkpoint = None  # the segments store the canonical index
+        else:
+            checkpoint = datamanager.Checkpoint(
+                directory, board_state_o, board_state_x, args.interval
+            )
+        status.checkpoint = checkpoint
+        if args.stats:
+            from instrumentation import SolverStats
+
+            stats = SolverStats(board_state_o, board_state_x, args.stats,
+                                args.stats_interval)
+        if state is not None and state["result"] is not None:
+            result = state["result"]
+        else:
+            result = iterative_turns(board, 1, checkpoint, stack, r)
+            # result = iterative_turns(board, 2, checkpoint, stack, r)
+            if checkpoint is not None:
+                checkpoint.save(board, [], None, result)
+        if stats is not None:
+            stats.write()
+        print("O will win:", result)
+        if args.hot_entries or args.tt_mb:
+            print("board_state_o:", board_state_o.report())
+            print("board_state_x:", board_state_x.report())
+        print("finished!")
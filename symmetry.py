@@ -0,0 +1,156 @@
+"""The 8 symmetries (rotations and flips) of the board
+
+Every operation is a lookup in a precomputed permutation table, no board is
+rotated. A class of symmetry positions is represented by its canonical
+index: the smallest index (see indexing.py) among the 8 positions.
+"""
+
+import numpy as np
+
+from bitboard import SYMMETRY
+from indexing import LAYER_O, LAYER_RANK, LAYER_SIZE, LAYER_X, TERNARY, rank
+
+#
+# [Symmetry]
+# s = 0 ~ 7, in the same order as `BitBoard.symmetric_keys`:
+#   s = 2*i    : np.rot90 by i
+#   s = 2*i + 1: np.rot90 by i, then flipped upside down
+#
+# The chess at cell c moves to cell CELL_PERMUTATION[s][c].
+#
+
+CELL_PERMUTATION = np.array(
+    [[table[1 << c].bit_length() - 1 for c in range(9)] for table in SYMMETRY],
+    dtype=np.int8
+)
+# the chess at position p moves to position POSITION_PERMUTATION[s][p]
+POSITION_PERMUTATION = np.array(
+    [np.concatenate([perm, perm + 9, perm + 18]) for perm in CELL_PERMUTATION],
+    dtype=np.int8
+)
+# INVERSE[s]: the symmetry that undoes s
+INVERSE = np.array(
+    [next(t for t in range(8)
+          if (CELL_PERMUTATION[t][CELL_PERMUTATION[s]] == np.arange(9)).all())
+     for s in range(8)],
+    dtype=np.int8
+)
+# LAYER_SYMMETRY[s][rank]: rank of the layer after the symmetry s
+LAYER_SYMMETRY = np.array(
+    [LAYER_RANK[[TERNARY[table[o]] + 2 * TERNARY[table[x]]
+                 for o, x in zip(LAYER_O.tolist(), LAYER_X.tolist())]]
+     for table in SYMMETRY],
+    dtype=np.int32
+)
+
+_layer_symmetry = LAYER_SYMMETRY.tolist()
+_position_permutation = POSITION_PERMUTATION.tolist()
+_size2 = LAYER_SIZE * LAYER_SIZE
+
+
+def transform(index: int, s: int) -> int:
+    """Return the index of the position after the symmetry s"""
+    r01, r2 = divmod(index, LAYER_SIZE)
+    r0, r1 = divmod(r01, LAYER_SIZE)
+    table = _layer_symmetry[s]
+    return table[r0] * _size2 + table[r1] * LAYER_SIZE + table[r2]
+
+
+def canonical(index: int) -> int:
+    """Return the canonical index of the position"""
+    r01, r2 = divmod(index, LAYER_SIZE)
+    r0, r1 = divmod(r01, LAYER_SIZE)
+    return min(t[r0] * _size2 + t[r1] * LAYER_SIZE + t[r2]
+               for t in _layer_symmetry)
+
+
+def canonical_key(key: int) -> int:
+    """Return the canonical index of a `BitBoard.key`"""
+    return canonical(rank(key))
+
+
+def canonical_symmetry(index: int) -> tuple:
+    """Return the canonical index and the symmetry s that maps the position
+    to it
+
+    Returns
+    -------
+    tuple
+        (canonical index, s), transform(index, s) == canonical index
+    """
+    r01, r2 = divmod(index, LAYER_SIZE)
+    r0, r1 = divmod(r01, LAYER_SIZE)
+    return min(
+        (t[r0] * _size2 + t[r1] * LAYER_SIZE + t[r2], s)
+        for s, t in enumerate(_layer_symmetry)
+    )
+
+
+def transform_movement(movement: tuple, s: int) -> tuple:
+    """Return the movement (format of `Board.available_move`) after the
+    symmetry s"""
+    perm = _position_permutation[s]
+    if movement[0] == 0:
+        return (0, perm[movement[1]])
+    pre_pos, pos = movement[1]
+    return (1, (perm[pre_pos], perm[pos]))
+
+
+def transform_board(board: np.ndarray, s: int) -> np.ndarray:
+    """Return the board array[layer, row, column] after the symmetry s"""
+    new_board = np.empty(27, dtype=board.dtype)
+    new_board[POSITION_PERMUTATION[s]] = board.reshape(27)
+    return new_board.reshape(3, 3, 3)
+
+
+def canonical_array(index: np.ndarray) -> tuple:
+    """Vectorized `canonical_symmetry`
+
+    Parameters
+    ----------
+    index : np.ndarray
+        integer array of index
+
+    Returns
+    -------
+    tuple
+        (int64 array of canonical index, int8 array of s)
+    """
+    index = np.asarray(index, dtype=np.int64)
+    r01, r2 = np.divmod(index, LAYER_SIZE)
+    r0, r1 = np.divmod(r01, LAYER_SIZE)
+    all_index = (LAYER_SYMMETRY[:, r0].astype(np.int64) * _size2
+                 + LAYER_SYMMETRY[:, r1] * LAYER_SIZE
+                 + LAYER_SYMMETRY[:, r2])
+    s = np.argmin(all_index, axis=0).astype(np.int8)
+    return np.take_along_axis(all_index, s[None].astype(np.int64), 0)[0], s
+
+
+if __name__ == "__main__":
+    import random
+
+    from bitboard import BitBoard
+    from indexing import N_POSITIONS, unrank
+
+    random.seed(0)
+    index = random.sample(range(N_POSITIONS), 2000)
+    for i in index:
+        bit_board = BitBoard(unrank(i))
+        keys = bit_board.symmetric_keys()
+        assert [transform(i, s) for s in range(8)] == [rank(k) for k in keys]
+        c, s = canonical_symmetry(i)
+        assert c == canonical(i) == min(rank(k) for k in keys)
+        assert transform(c, INVERSE[s]) == i
+        b = transform_board(bit_board.board, s)
+        assert rank(BitBoard(b).key) == c
+        for movement in bit_board.available_move(1):
+            b = bit_board.copy()
+            b.make_move(movement, 1, False)
+            t = BitBoard(unrank(c))
+            t.make_move(transform_movement(movement, s), 1)
+            assert canonical_key(t.key) == canonical_key(b.key)
+            assert rank(t.key) == transform(rank(b.key), s)
+    c, s = canonical_array(index)
+    assert c.tolist() == [canonical(i) for i in index]
+    assert [transform(i, t) for i, t in zip(index, s.tolist())] == c.tolist()
+    print("Symmetry tables checked on", len(index), "positions")
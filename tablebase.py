@@ -0,0 +1,296 @@
+"""Endgame tablebase of the positions with (almost) all chess on the board
+
+When both players have put all their chess (`Board.chess` all zero) only
+moves are left, a small part of the space that the dfs reaches again and
+again from every line. The classes of these positions (see retrograde.py)
+are solved once by retrograde analysis and packed into one file, and
+`solve._scan` looks a child up before searching it, so a whole subtree is
+one lookup. The classes with 1 or 2 chess in reserve can be included too.
+
+    python tablebase.py build data/tablebase.bin --reserves 0
+    python tablebase.py check data/tablebase.bin
+"""
+
+import mmap
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy as np
+
+import retrograde
+from indexing import MAX_CHESS
+from retrograde import DRAW, LOSS, WIN, all_classes, class_code
+from symmetry import canonical_key
+
+PIECES = 6 * MAX_CHESS  # chess of both players
+BUCKET_BITS = 16
+
+#
+# [File]
+# header (HEADER), the class table (CLASS [classes]), then the arrays of
+# each class at their offsets (8-byte aligned, little-endian):
+#   buckets: uint32 [count], the positions with index >> BUCKET_BITS == b
+#            are the slots buckets[b]:buckets[b+1]
+#   lows: uint16 [n], index & 0xFFFF of the sorted canonical index
+#   values: uint8 [(n + 1) // 2], a nibble for each slot (slot 0 in the
+#           low nibble): bit 0-1 the retrograde value with O to move,
+#           bit 2-3 with X to move (DRAW, WIN or LOSS for the player to
+#           move, see retrograde.py [Value])
+# 2 bytes of index and half a byte of values for each canonical position,
+# instead of the 4 + 2 of the class files of retrograde.py.
+#
+
+MAGIC = b"GGTB"
+VERSION = 1
+HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("classes", "<u2")])
+CLASS = np.dtype([("counts", "u1", 6), ("reserved", "u1", 2), ("n", "<u8"),
+                  ("buckets", "<u8"), ("bucket_offset", "<u8"),
+                  ("low_offset", "<u8"), ("value_offset", "<u8")])
+
+
+def endgame_classes(reserves: int = 0) -> list:
+    """Return the classes with at most `reserves` chess not on the board,
+    in solving order"""
+    return [c for c in all_classes() if sum(c) >= PIECES - reserves]
+
+
+def pack(path, directory, classes: list) -> None:
+    """Write the solved classes of a retrograde directory as a tablebase
+
+    Parameters
+    ----------
+    path : str | Path
+        the tablebase file, created (or emptied)
+    directory : str | Path
+        the directory of `retrograde.solve_all`
+    classes : list
+        the counts of the classes
+    """
+    table = np.zeros(len(classes), dtype=CLASS)
+    offset = HEADER.itemsize + CLASS.itemsize * len(classes)
+    with open(path, "wb") as file:
+        file.seek(offset)
+        for entry, counts in zip(table, classes):
+            ids, value = retrograde.load_class(directory, counts)
+            n = len(ids)
+            top = int(ids[-1]) >> BUCKET_BITS if n else 0
+            buckets = np.searchsorted(ids >> BUCKET_BITS,
+                                      np.arange(top + 2)).astype("<u4")
+            lows = (ids & 0xFFFF).astype("<u2")
+            nibbles = (value[0].astype(np.uint8)
+                       | value[1].astype(np.uint8) << 2)
+            if n & 1:
+                nibbles = np.append(nibbles, np.uint8(0))
+            values = nibbles[0::2] | nibbles[1::2] << 4
+            entry["counts"] = counts
+            entry["n"] = n
+            entry["buckets"] = len(buckets)
+            for name, array in (("bucket_offset", buckets),
+                                ("low_offset", lows),
+                                ("value_offset", values)):
+                offset = -(-offset // 8) * 8
+                file.seek(offset)
+                file.write(array.tobytes())
+                entry[name] = offset
+                offset += array.nbytes
+        file.seek(0)
+        file.write(np.array([(MAGIC, VERSION, len(classes))],
+                            dtype=HEADER).tobytes())
+        file.write(table.tobytes())
+
+
+def build(path, reserves: int = 0, directory="data/retrograde",
+          verbose: bool = True) -> None:
+    """Solve the endgame classes and pack them
+
+    Parameters
+    ----------
+    path : str | Path
+        the tablebase file
+    reserves : int, optional
+        also the classes with up to this many chess not on the board,
+        by default 0 (only all chess on the board)
+    directory : str | Path, optional
+        the retrograde directory of the solved classes, the classes already
+        in it are not solved again, by default "data/retrograde"
+    """
+    classes = endgame_classes(reserves)
+    retrograde.solve_all(directory, verbose, classes)
+    pack(path, directory, classes)
+
+
+class Tablebase:
+    """The values of the endgame positions (see [File])
+
+    The file is memory-mapped, a probe is a binary search in one bucket of
+    the class.
+
+    Parameters
+    ----------
+    path : str | Path
+        the tablebase file
+    """
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._mmap, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise Exception(f"Not a tablebase file: {self.path}")
+        table = np.frombuffer(self._mmap, dtype=CLASS,
+                              count=int(header["classes"]),
+                              offset=HEADER.itemsize)
+        view = memoryview(self._mmap)
+        # class code: (buckets, lows, values) as memoryviews, indexing them
+        # is faster than numpy for one position
+        self.classes = {}
+        for entry in table:
+            n, count = int(entry["n"]), int(entry["buckets"])
+            buckets = int(entry["bucket_offset"])
+            lows = int(entry["low_offset"])
+            values = int(entry["value_offset"])
+            self.classes[class_code(tuple(entry["counts"].tolist()))] = (
+                view[buckets:buckets + 4 * count].cast("I"),
+                view[lows:lows + 2 * n].cast("H"),
+                view[values:values + (n + 1) // 2],
+            )
+        self.min_pieces = min((int(entry["counts"].sum()) for entry in table),
+                              default=PIECES + 1)
+
+    def probe(self, key: int, player: int, index: int = None):
+        """Return the value of a position for the player to move
+
+        Parameters
+        ----------
+        key : int
+            `BitBoard.key`
+        player : int
+            the player to move
+        index : int, optional
+            the canonical index of the key if known, see `solve.similar`
+
+        Returns
+        -------
+        int or None
+            DRAW, WIN or LOSS, None: the class is not in the tablebase.
+            The value of a finished game is not meaningful.
+        """
+        if key.bit_count() < self.min_pieces:
+            return None
+        code = 0
+        for k in range(6):
+            code += (key >> 9*k & 0x1FF).bit_count() * 3**k
+        entry = self.classes.get(code)
+        if entry is None:
+            return None
+        buckets, lows, values = entry
+        if index is None:
+            index = canonical_key(key)
+        b = index >> BUCKET_BITS
+        slot = bisect_left(lows, index & 0xFFFF, buckets[b], buckets[b + 1])
+        nibble = values[slot >> 1] >> ((slot & 1) << 2)
+        return nibble >> ((player - 1) << 1) & 3
+
+    def o_wins(self, key: int, player: int, index: int = None):
+        """Return True if O will win, in the terms of `solve.board_state`
+
+        A draw is False. None: the class is not in the tablebase.
+        """
+        value = self.probe(key, player, index)
+        if value is None:
+            return None
+        return value == (WIN if player == 1 else LOSS)
+
+    def close(self) -> None:
+        """Close the mapping"""
+        for views in self.classes.values():
+            for view in views:
+                view.release()
+        self.classes.clear()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Endgame tablebase")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("path", help="the tablebase file")
+    parser.add_argument("--reserves", type=int, default=0,
+                        help="build: also the classes with up to this many "
+                             "chess not on the board")
+    parser.add_argument("--work", default="data/retrograde",
+                        help="build: the directory of the solved classes")
+    parser.add_argument("--positions", type=int, default=200,
+                        help="check: random endgame positions compared")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.time()
+        build(args.path, args.reserves, args.work)
+        print(f"{args.path}: {Path(args.path).stat().st_size} bytes, "
+              f"{time.time() - start:.0f}s")
+    else:
+        import solve
+        import wdl
+        from bitboard import BitBoard
+
+        # random games up to the first position in the tablebase, compared
+        # with the wdl search, and the dfs solve with and without the
+        # tablebase from the positions 2 chess before it
+        random.seed(0)
+        tablebase = Tablebase(args.path)
+        positions, starts = [], []
+        while len(positions) < args.positions:
+            board, player = BitBoard(), 1
+            before = None
+            for _ in range(200):
+                if board.check_win() or not board.available_move(player):
+                    break
+                if tablebase.probe(board.key, player) is not None:
+                    positions.append((board.key, player))
+                    if before is not None:
+                        starts.append(before)
+                    break
+                if board.key.bit_count() == tablebase.min_pieces - 2:
+                    before = board.key, player
+                board.make_move(random.choice(board.available_move(player)),
+                                player, False)
+                player = 3 - player
+        start = time.perf_counter()
+        values = [tablebase.probe(key, player) for key, player in positions]
+        probe_time = (time.perf_counter() - start) / len(positions)
+        for (key, player), value in zip(positions, values):
+            wdl.clear()
+            assert wdl.wdl_turns(BitBoard(key), player) == {
+                WIN: wdl.WIN, DRAW: wdl.DRAW, LOSS: wdl.LOSS}[value]
+        print(f"{len(positions)} positions agree with wdl.py, "
+              f"probe {probe_time * 1e6:.1f} us")
+
+        solve.cutoff = True
+        results = {}
+        for use in (None, tablebase):
+            solve.tablebase = use
+            solve.status.nodes = 0
+            start = time.perf_counter()
+            results[use] = []
+            for key, player in starts[:20]:
+                solve.board_state_o.clear()
+                solve.board_state_x.clear()
+                results[use].append(
+                    solve.iterative_turns(BitBoard(key), player))
+            print("tablebase" if use else "no tablebase",
+                  f"{solve.status.nodes} nodes,",
+                  f"{time.perf_counter() - start:.2f}s")
+        print("same results:", sum(a == b for a, b in zip(*results.values())),
+              "of", len(results[None]))
+        tablebase.close()
@@ -0,0 +1,457 @@
+"""Bounded board_state: a two-tier table and a fixed-size table
+
+With ~10^9 positions the tables of solve.py do not fit in memory. A
+`TwoTierTable` keeps at most `capacity` positions in the hot tier (a dict,
+the oldest are evicted first) and moves the evicted positions to the cold
+tier, a memory-mapped file indexed by the canonical index. The solve slows
+down to disk speed instead of running out of memory.
+
+A `BoundedTable` is an array of a fixed number of bytes: a position that
+does not fit replaces the position of the smallest subtree in its bucket
+and is forgotten, the solve searches it again if it comes back.
+"""
+
+import mmap
+import os
+from array import array
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from indexing import N_POSITIONS
+
+#
+# [Cold tier]
+# 2 bits for each canonical index, 4 positions in a byte (same as
+# parallel.SharedTable):
+#   0: not in the table, 1: True (O win), 2: False (O lose)
+# The file is sparse, only the pages with evicted positions use disk space.
+#
+
+COLD_BYTES = (N_POSITIONS + 3) // 4
+
+
+class TwoTierTable:
+    """A board_state (see solve.py) with a hot tier in RAM and a cold tier
+    on disk
+
+    The positions in progress (None) are never evicted. A position evicted
+    before it was written to a checkpoint is kept by the cold tier, which
+    `datamanager.Checkpoint` flushes to disk with every segment.
+
+    Parameters
+    ----------
+    path : str | Path
+        the file of the cold tier
+    capacity : int
+        the positions kept in the hot tier
+    resume : bool, optional
+        keep the positions of an existing file (`--resume`), by default
+        False: the file is created (or emptied)
+    """
+
+    def __init__(self, path, capacity: int, resume: bool = False) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.hot = {}
+        with open(self.path, "ab" if resume else "wb") as file:
+            os.ftruncate(file.fileno(), COLD_BYTES)
+        self._file = open(self.path, "r+b")
+        self.cold = mmap.mmap(self._file.fileno(), COLD_BYTES)
+        self.n = 0  # positions added, the same as len() of a dict
+        self.hot_hits = 0
+        self.cold_hits = 0
+        self.misses = 0
+        self._last = None  # (ha, state) of the last cold hit
+
+    def _cold_state(self, ha: int):
+        state = self.cold[ha >> 2] >> ((ha & 3) << 1) & 3
+        if not state:
+            return None
+        return state == 1
+
+    def __contains__(self, ha: int) -> bool:
+        if ha in self.hot:
+            self.hot_hits += 1
+            return True
+        state = self._cold_state(ha)
+        if state is None:
+            self.misses += 1
+            return False
+        self.cold_hits += 1
+        self._last = (ha, state)
+        return True
+
+    def __getitem__(self, ha: int):
+        if ha in self.hot:
+            return self.hot[ha]
+        if self._last is not None and self._last[0] == ha:
+            return self._last[1]
+        state = self._cold_state(ha)
+        if state is None:
+            raise KeyError(ha)
+        return state
+
+    def get(self, ha: int, default=None):
+        """Same as dict.get, the lookup API of `solve.find_state`"""
+        if ha in self:
+            return self[ha]
+        return default
+
+    def __setitem__(self, ha: int, state) -> None:
+        if ha not in self.hot:
+            self.n += 1
+        self.hot[ha] = state
+        if len(self.hot) > self.capacity:
+            self._evict()
+
+    def setdefault(self, ha: int, default=None):
+        if ha in self:
+            return self[ha]
+        self[ha] = default
+        return default
+
+    def update(self, pairs) -> None:
+        for ha, state in pairs:
+            self[ha] = state
+
+    def items(self):
+        """The items of the hot tier, in the order they were added"""
+        return self.hot.items()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _evict(self) -> None:
+        """Move the oldest 1/8 of the hot tier to the cold tier"""
+        n = len(self.hot) - self.capacity * 7 // 8
+        if n <= 0:
+            return
+        evicted = [(ha, state) for ha, state in islice(self.hot.items(), n)
+                   if state is not None]
+        if not evicted:
+            return
+        ha = np.array([ha for ha, _ in evicted], dtype=np.int64)
+        state = np.array([1 if s else 2 for _, s in evicted], dtype=np.uint8)
+        shift = ((ha & 3) << 1).astype(np.uint8)
+        cold = np.frombuffer(self.cold, dtype=np.uint8)
+        # a position evicted again replaces its old state
+        np.bitwise_and.at(cold, ha >> 2, ~(np.uint8(3) << shift))
+        np.bitwise_or.at(cold, ha >> 2, state << shift)
+        for ha, _ in evicted:
+            del self.hot[ha]
+        self._last = None
+
+    def shrink(self, capacity: int) -> None:
+        """Set a smaller capacity and evict now"""
+        self.capacity = capacity
+        if len(self.hot) > capacity:
+            self._evict()
+
+    def report(self) -> str:
+        """Return the hit rates of the tiers"""
+        lookups = max(self.hot_hits + self.cold_hits + self.misses, 1)
+        return (f"hot {len(self.hot)}/{self.capacity} "
+                f"hit {self.hot_hits / lookups:.1%}, "
+                f"cold hit {self.cold_hits / lookups:.1%}, "
+                f"miss {self.misses / lookups:.1%}")
+
+    def flush(self) -> None:
+        """Write the cold tier to disk"""
+        self.cold.flush()
+
+    def close(self) -> None:
+        self.cold.close()
+        self._file.close()
+
+
+#
+# [Bounded entry]
+# ENTRY_BYTES = 8 bytes for each position (a uint64), WAYS entries in a
+# bucket, the bucket of a position is a multiplicative hash of its index:
+#   bit 0-31:  canonical index
+#   bit 32-33: 0: empty, 1: True (O win), 2: False (O lose)
+#   bit 34-63: weight, the values stored while the position was in progress
+#              (the size of its subtree), 0 for the positions decided
+#              without a search
+# The first WAYS - 1 entries of a full bucket are replaced by weight (by a
+# new position at least as heavy), the last one by any new position.
+# A budget of M MiB holds M * 2**20 / 8 positions (131,072 per MiB), a dict
+# of board_state takes ~100 bytes for each position. The positions in
+# progress (None, on the path of the search) are in a dict and are never
+# evicted.
+#
+
+ENTRY_BYTES = 8
+WAYS = 4
+_HASH = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+_MAX_WEIGHT = (1 << 30) - 1
+
+
+class BoundedTable:
+    """A board_state (see solve.py) in a fixed number of bytes
+
+    When the bucket of a new position is full, it replaces the entry with
+    the smallest weight (see [Bounded entry]) if it weighs at least as
+    much, else the last entry of the bucket, so the positions that took a
+    large search to solve stay the longest and the light new ones stay
+    for a while.
+
+    Parameters
+    ----------
+    megabytes : float
+        the budget of the entries in MiB
+    """
+
+    def __init__(self, megabytes: float) -> None:
+        self.buckets = max(int(megabytes * 2**20) // (ENTRY_BYTES * WAYS), 1)
+        self._mmap = mmap.mmap(-1, self.buckets * WAYS * ENTRY_BYTES)
+        self.slots = memoryview(self._mmap).cast("Q")
+        self.in_progress = {}  # ha: `stores` when it was started
+        self.entries = 0  # slots used
+        self.stores = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the values stored since the last checkpoint (ha | state << 32),
+        # None: not logged, see `datamanager.Checkpoint`
+        self.log = None
+        self._last = None  # (ha, state) of the last hit
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+    def _bucket(self, ha: int) -> int:
+        return (ha * _HASH & _MASK64) % self.buckets * WAYS
+
+    def _state(self, ha: int):
+        """Return the state of a stored position, None if not stored"""
+        slots = self.slots
+        base = self._bucket(ha)
+        for i in range(base, base + WAYS):
+            slot = slots[i]
+            if slot & 0xFFFFFFFF == ha and slot >> 32 & 3:
+                return slot >> 32 & 3 == 1
+        return None
+
+    def __contains__(self, ha: int) -> bool:
+        if ha in self.in_progress:
+            self.hits += 1
+            return True
+        state = self._state(ha)
+        if state is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        self._last = (ha, state)
+        return True
+
+    def __getitem__(self, ha: int):
+        if ha in self.in_progress:
+            return None
+        if self._last is not None and self._last[0] == ha:
+            return self._last[1]
+        state = self._state(ha)
+        if state is None:
+            raise KeyError(ha)
+        return state
+
+    def get(self, ha: int, default=None):
+        """Same as dict.get, the lookup API of `solve.find_state`"""
+        if ha in self:
+            return self[ha]
+        return default
+
+    def _store(self, ha: int, state: bool, weight: int) -> None:
+        entry = (ha | (1 if state else 2) << 32
+                 | min(weight, _MAX_WEIGHT) << 34)
+        slots = self.slots
+        base = self._bucket(ha)
+        empty = victim = None
+        for i in range(base, base + WAYS):
+            slot = slots[i]
+            if not slot >> 32 & 3:
+                if empty is None:
+                    empty = i
+            elif slot & 0xFFFFFFFF == ha:
+                slots[i] = entry  # a new state of the same position
+                return
+            elif i < base + WAYS - 1 and (
+                    victim is None or slot >> 34 < slots[victim] >> 34):
+                victim = i
+        if empty is not None:
+            self.entries += 1
+            slots[empty] = entry
+        else:
+            self.evictions += 1
+            if entry >> 34 < slots[victim] >> 34:
+                victim = base + WAYS - 1  # the always-replace entry
+            slots[victim] = entry
+
+    def __setitem__(self, ha: int, state) -> None:
+        self.stores += 1
+        self._last = None
+        if state is None:
+            self.in_progress[ha] = self.stores
+            return
+        start = self.in_progress.pop(ha, None)
+        self._store(ha, state, 0 if start is None else self.stores - start)
+        if self.log is not None:
+            self.log.append(ha | (1 if state else 2) << 32)
+
+    def setdefault(self, ha: int, default=None):
+        if ha in self:
+            return self[ha]
+        self[ha] = default
+        return default
+
+    def update(self, pairs) -> None:
+        """Store the pairs (ha, state), not logged"""
+        for ha, state in pairs:
+            if state is None:
+                self.in_progress.setdefault(ha, self.stores)
+            else:
+                self._store(ha, state, 0)
+        self._last = None
+
+    def take_log(self) -> list:
+        """Return the (ha, state) stored since the last call, starts the
+        log at the first call"""
+        log, self.log = self.log, array("Q")
+        if log is None:
+            return []
+        return [(entry & 0xFFFFFFFF, entry >> 32 == 1) for entry in log]
+
+    def items(self):
+        """The positions in progress, then the stored positions"""
+        yield from ((ha, None) for ha in self.in_progress)
+        slots = np.frombuffer(self._mmap, dtype=np.uint64)
+        for begin in range(0, len(slots), 1 << 20):
+            chunk = slots[begin:begin + (1 << 20)]
+            state = chunk >> np.uint64(32) & np.uint64(3)
+            chunk = chunk[state != 0]
+            yield from zip((chunk & np.uint64(0xFFFFFFFF)).tolist(),
+                           (state[state != 0] == 1).tolist())
+
+    def __len__(self) -> int:
+        return self.entries + len(self.in_progress)
+
+    def clear(self) -> None:
+        self._mmap[:] = bytes(len(self._mmap))
+        self.in_progress.clear()
+        self.entries = self.stores = 0
+        self._last = None
+
+    def report(self) -> str:
+        """Return the fill and the hit rate"""
+        lookups = max(self.hits + self.misses, 1)
+        return (f"entries {self.entries}/{self.buckets * WAYS} "
+                f"({self.nbytes / 2**20:.2f} MiB), "
+                f"hit {self.hits / lookups:.1%}, "
+                f"evictions {self.evictions}")
+
+    def close(self) -> None:
+        self.slots.release()
+        self._mmap.close()
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        table = TwoTierTable(Path(directory) / "cold.bin", 1000)
+        reference = {}
+        for _ in range(20000):
+            ha = random.randrange(N_POSITIONS)
+            if ha not in reference:
+                reference[ha] = table[ha] = random.random() < 0.5
+        path = N_POSITIONS - 1
+        table[path] = None  # in progress
+        assert len(table) == len(reference) + 1
+        assert len(table.hot) <= 1000 and table[path] is None
+        for ha, state in reference.items():
+            assert ha in table and table[ha] == state
+        assert 5 not in table or 5 in reference
+        print("Same as dict on", len(reference), "positions,", table.report())
+        # a position evicted again with a new state, then the cold tier
+        # opened again as by --resume
+        ha = next(iter(reference))
+        reference[ha] = table[ha] = not reference[ha]
+        for _ in range(2000):
+            table[random.randrange(N_POSITIONS)] = True
+        assert ha not in table.hot and table[ha] == reference[ha]
+        table.flush()
+        table.close()
+        table = TwoTierTable(Path(directory) / "cold.bin", 1000, resume=True)
+        cold = [ha for ha in reference if ha in table]
+        assert all(table[ha] == reference[ha] for ha in cold)
+        assert len(cold) >= len(reference) - 1000
+        print("resume:", len(cold), "positions in the cold tier")
+        table.close()
+
+    # BoundedTable: the same as a dict while nothing is evicted, then the
+    # same results of the dfs solve with a budget far below its positions
+    table = BoundedTable(16)
+    reference = {}
+    for _ in range(20000):
+        ha = random.randrange(N_POSITIONS)
+        if ha not in reference:
+            reference[ha] = table[ha] = random.random() < 0.5
+    table[path] = None
+    assert table.evictions == 0 and len(table) == len(reference) + 1
+    assert table[path] is None and path in table
+    for ha, state in reference.items():
+        assert ha in table and table[ha] == state
+    assert dict(table.items()) == {**reference, path: None}
+    table.close()
+
+    # a full bucket keeps its heavier entries, a new position replaces the
+    # lightest one if as heavy, else the last one (weights 2, 3, 4, 5 in
+    # the only bucket)
+    table = BoundedTable(ENTRY_BYTES * WAYS / 2**20)
+    for ha in range(WAYS + 1):
+        table[ha] = None
+        for i in range(ha + 1 if ha < WAYS else 0):
+            table[N_POSITIONS - 1 - i] = None  # in progress, a store
+        table[ha] = ha < WAYS
+    assert WAYS in table and WAYS - 1 not in table
+    table[WAYS + 1] = None
+    for i in range(2):
+        table[N_POSITIONS - 1 - i] = None
+    table[WAYS + 1] = False
+    assert WAYS + 1 in table and 0 not in table and WAYS in table
+    assert all(ha in table for ha in range(1, WAYS - 1))
+    table.close()
+
+    import time
+
+    import solve
+    from bitboard import BitBoard
+    from ordering import BENCHMARK_POSITIONS
+
+    solve.cutoff = True
+    for megabytes in (None, 1, 0.25, 0.0625):
+        results = []
+        nodes = 0
+        start = time.perf_counter()
+        for key, player in [(0, 1)] + BENCHMARK_POSITIONS:
+            if megabytes is None:
+                solve.board_state_o, solve.board_state_x = {}, {}
+            else:
+                solve.board_state_o = BoundedTable(megabytes / 2)
+                solve.board_state_x = BoundedTable(megabytes / 2)
+            solve.status.nodes = 0
+            results.append(solve.iterative_turns(BitBoard(key), player))
+            nodes += solve.status.nodes
+        if megabytes is None:
+            expected = results
+        assert results == expected
+        print(f"{megabytes or 'dict'} MiB: {nodes} turns, "
+              f"{time.perf_counter() - start:.1f}s",
+              "" if megabytes is None else solve.board_state_o.report())
@@ -0,0 +1,273 @@
+"""Win/draw/loss solve in one traversal
+
+The boolean solver answers "will O win", so a tie and a loss are the same
+False and telling them apart needs a second run from the side of X. Here
+the values are three-valued for the player to move:
+    WIN = 1, DRAW = 0, LOSS = -1
+and the search is a negamax alpha-beta over them. The table keeps a lower
+and an upper bound of every position, so a search with a narrow window
+still leaves what it proved for the next visit.
+
+A tie (`check_win` == 3) is a draw, a position that repeats one on the
+current path is a draw (the game can go on forever), and a player without
+a movement loses (the same as `solve.o_turns`/`solve.x_turns`). A value
+that relies on such a repetition only holds while the repeated positions
+are on the path, it is kept in `repetitions` instead of the table (as the
+disproofs of dfpn.py).
+"""
+
+import mmap
+
+from bitboard import BitBoard
+from indexing import N_POSITIONS
+from solve import similar
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# `ordering.MoveOrdering` of the children searched, see solve.ordering
+ordering = None
+
+#
+# [Entry]
+# 4 bits for each canonical index, 2 positions in a byte, 2 bits for each
+# bound of the value for the player to move:
+#   bit 0-1: lower bound + 1 (0: LOSS, nothing is known)
+#   bit 2-3: 1 - upper bound (0: WIN, nothing is known)
+# so a zero byte is two unknown positions, and lower == upper is exact.
+# 2 bits could only hold an exact value or unknown, the results of a
+# narrow window (a lower or an upper bound) would be lost, so an entry
+# takes a nibble instead.
+#
+
+TABLE_BYTES = (N_POSITIONS + 1) // 2
+
+_NO_REPETITION = frozenset()
+
+
+class WDLTable:
+    """The bounds of the positions with one player to move
+
+    The bytes are an anonymous mapping, only the pages with stored
+    positions use memory.
+    """
+
+    def __init__(self) -> None:
+        self.buf = mmap.mmap(-1, TABLE_BYTES)
+        self.n = 0  # positions stored
+
+    def bounds(self, ha: int) -> tuple:
+        """Return (lower, upper) of a position"""
+        entry = self.buf[ha >> 1] >> ((ha & 1) << 2) & 0xF
+        return (entry & 3) - 1, 1 - (entry >> 2)
+
+    def store(self, ha: int, lower: int, upper: int) -> None:
+        """Narrow the bounds of a position"""
+        old_lower, old_upper = self.bounds(ha)
+        if old_lower == LOSS and old_upper == WIN:
+            self.n += 1
+        # the stored bounds do not depend on the path (see `repetitions`),
+        # they only narrow
+        if max(lower, old_lower) <= min(upper, old_upper):
+            lower, upper = max(lower, old_lower), min(upper, old_upper)
+        i, shift = ha >> 1, (ha & 1) << 2
+        entry = (lower + 1) | (1 - upper) << 2
+        self.buf[i] = self.buf[i] & ~(0xF << shift) & 0xFF | entry << shift
+
+    def __len__(self) -> int:
+        return self.n
+
+    def close(self) -> None:
+        self.buf.close()
+
+
+# tables[player to move - 1]
+tables = [WDLTable(), WDLTable()]
+# repetitions[canonical index * 2 + player - 1]: (lower, upper, the
+# positions repeated) of a position whose bounds rely on repetitions, they
+# only hold while the repeated positions are all on the path
+repetitions = {}
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.nodes = 0  # positions expanded
+
+
+counter = Counter()
+
+
+def _bounds(ha: int, player: int, path: set) -> tuple:
+    """Return (lower, upper, the positions repeated) of a position"""
+    key = ha * 2 + player - 1
+    if key in repetitions:
+        lower, upper, depends = repetitions[key]
+        if depends <= path:
+            return lower, upper, depends
+    return (*tables[player - 1].bounds(ha), _NO_REPETITION)
+
+
+def _store(ha: int, player: int, lower: int, upper: int,
+           depends=_NO_REPETITION) -> None:
+    key = ha * 2 + player - 1
+    depends = depends - {key}
+    if depends:
+        repetitions[key] = lower, upper, depends
+    else:
+        repetitions.pop(key, None)
+        tables[player - 1].store(ha, lower, upper)
+
+
+def _search(board: BitBoard, player: int, alpha: int, beta: int,
+            path: set):
+    """Alpha-beta search of a position, a generator
+
+    Yields (player, alpha, beta) of a child to search after moving the
+    board to it, and receives its (value, the positions repeated) by
+    send(), the value for the player of the child. Returns the same for
+    the player to move, stored by `_store`.
+    """
+    counter.nodes += 1
+    ha = similar(board)
+    lower, upper, depends = _bounds(ha, player, path)
+    if lower >= beta or upper <= alpha or lower == upper:
+        return lower if lower >= beta or lower == upper else upper, depends
+    best = None
+    # a lower bound relies on the best child, an upper bound on all
+    best_depends = depends = _NO_REPETITION
+    children = []
+    # the first loop: finished games, repetitions and stored children
+    for movement in board.available_move(player):
+        board.make_move(movement, player, False)
+        win_status = board.check_win()
+        value = None
+        child_depends = _NO_REPETITION
+        if win_status:
+            value = (WIN if win_status == player else
+                     DRAW if win_status == 3 else LOSS)
+        else:
+            child = similar(board)
+            if child * 2 + 2 - player in path:
+                value = DRAW
+                child_depends = frozenset((child * 2 + 2 - player,))
+            else:
+                child_lower, child_upper, child_depends = _bounds(
+                    child, 3 - player, path)
+                if child_lower == child_upper or -child_upper >= beta:
+                    value = -child_upper
+                else:
+                    children.append(movement)
+        board.unmake_move()
+        if value is None:
+            continue
+        depends |= child_depends
+        if best is None or value > best:
+            best, best_depends = value, child_depends
+            if best >= beta:
+                _store(ha, player, best, WIN, best_depends)
+                return best, best_depends
+    if best is None and not children:
+        _store(ha, player, LOSS, LOSS)  # no movement
+        return LOSS, _NO_REPETITION
+    alpha0 = alpha
+    if best is not None:
+        alpha = max(alpha, best)
+    if ordering is not None:
+        children = ordering.order(board, player, children)
+    key = ha * 2 + player - 1
+    path.add(key)
+    for movement in children:
+        if alpha >= beta:
+            break
+        board.make_move(movement, player, False)
+        value, child_depends = yield 3 - player, -beta, -alpha
+        value = -value
+        board.unmake_move()
+        depends |= child_depends
+        if best is None or value > best:
+            best, best_depends = value, child_depends
+            if value > alpha:
+                alpha = value
+                if ordering is not None and alpha >= beta:
+                    ordering.cutoff(board, player, movement)
+    path.discard(key)
+    if best >= beta:
+        depends = best_depends
+        _store(ha, player, best, WIN, depends)
+    elif best <= alpha0:
+        _store(ha, player, LOSS, best, depends)
+    else:
+        _store(ha, player, best, best, depends)
+    return best, depends - {key}
+
+
+def wdl_turns(board: BitBoard, player: int = 1) -> int:
+    """Return the value of the board for the player to move
+
+    The children are searched through an explicit stack of `_search`
+    generators, the board is changed in place and restored.
+
+    Returns
+    -------
+    int
+        WIN, DRAW or LOSS
+    """
+    path = set()
+    stack = [_search(board, player, LOSS, WIN, path)]
+    value = None
+    while True:
+        try:
+            request = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value[0]
+            value = stop.value
+            continue
+        value = None
+        stack.append(_search(board, *request, path))
+
+
+def clear() -> None:
+    """Empty the tables"""
+    global tables
+    for table in tables:
+        table.close()
+    tables = [WDLTable(), WDLTable()]
+    repetitions.clear()
+
+
+if __name__ == "__main__":
+    import time
+
+    import solve
+    from ordering import BENCHMARK_POSITIONS
+
+    # the boolean answer of solve.py is WIN for O, and for X the boolean
+    # answer is "O will not win", i.e. a DRAW or a WIN of X
+    solve.cutoff = True
+    for key, player in [(0, 1)] + BENCHMARK_POSITIONS:
+        clear()
+        counter.nodes = 0
+        start = time.time()
+        value = wdl_turns(BitBoard(key), player)
+        t = time.time() - start
+        solve.board_state_o.clear()
+        solve.board_state_x.clear()
+        o_wins = solve.iterative_turns(BitBoard(key), player)
+        assert o_wins == (value == (WIN if player == 1 else LOSS))
+        name = {WIN: "win", DRAW: "draw", LOSS: "loss"}[value]
+        print(f"{key} {player}: {name} for the player to move, "
+              f"{counter.nodes} nodes, {t:.2f}s")
+
+    # the tables kept from one position to the next, the stored values do
+    # not depend on the path they were found on
+    clear()
+    values = [wdl_turns(BitBoard(key), player)
+              for key, player in BENCHMARK_POSITIONS + [(0, 1)]]
+    for (key, player), value in zip(BENCHMARK_POSITIONS + [(0, 1)], values):
+        clear()
+        assert wdl_turns(BitBoard(key), player) == value
+    print("same values with the tables shared,", len(repetitions),
+          "positions rely on repetitions")
@@ -0,0 +1,190 @@
+"""Zobrist keys of the 8 symmetries, updated by every movement
+
+`solve.similar` ranks the board and looks up the 8 symmetries of the index
+(see symmetry.py) for every child. A `ZobristBoard` keeps instead the
+64-bit Zobrist key of each of the 8 symmetry boards and changes them with
+the XOR of the chess that moved, so the key shared by all symmetry boards
+is the minimum of 8 integers. The keys are not an exact index: two
+positions have the same key with a probability of about n**2 / 2**65, and
+the tables keyed by them are dicts (see `solve.zobrist`).
+
+Set `verify` to True to check the keys against a full recomputation after
+every movement and to check that no two canonical positions share a key.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+from bitboard import POSITION_SYMMETRY, BitBoard
+from symmetry import canonical_key
+
+#
+# [Zobrist key]
+# KEYS[bit]: a random 64-bit integer for each bit of `BitBoard.key`
+# (player, layer, cell), from a fixed seed so the keys are the same in
+# every process. The key of the s-th symmetry board (s as in
+# `BitBoard.symmetric_keys`) is the XOR of KEYS[bit after the symmetry s]
+# of its chess, DELTA[bit][s] is the change of it when the chess at bit is
+# put or taken.
+#
+
+KEYS = np.random.default_rng(0x60BB1E7).integers(
+    0, 2**64, 54, dtype=np.uint64).tolist()
+DELTA = [
+    tuple(KEYS[bit // 27 * 27 + POSITION_SYMMETRY[s][bit % 27]]
+          for s in range(8))
+    for bit in range(54)
+]
+# MOVE_DELTA[pre_bit * 54 + bit]: the change of a move from pre_bit to bit
+MOVE_DELTA = [tuple(a ^ b for a, b in zip(DELTA[pre_bit], DELTA[bit]))
+              for pre_bit in range(54) for bit in range(54)]
+
+# check the keys after every movement, see `check_keys`
+verify = False
+# canonical key: canonical index, of the positions seen by `check_keys`
+_seen = {}
+
+
+def zobrist_keys(key: int) -> list:
+    """Return the 8 Zobrist keys of a `BitBoard.key` computed from scratch"""
+    keys = [0] * 8
+    while key:
+        low = key & -key
+        delta = DELTA[low.bit_length() - 1]
+        keys = [z ^ d for z, d in zip(keys, delta)]
+        key ^= low
+    return keys
+
+
+def check_keys(board: ZobristBoard) -> None:
+    """Check the keys of a board against a full recomputation and the
+    canonical key against the canonical index, raise AssertionError"""
+    assert board.zobrist == zobrist_keys(board.key), (
+        f"incremental Zobrist keys differ at {board.key}")
+    z = min(board.zobrist)
+    index = canonical_key(board.key)
+    assert _seen.setdefault(z, index) == index, (
+        f"Zobrist collision: {_seen[z]} and {index}")
+
+
+class ZobristBoard(BitBoard):
+    """A `BitBoard` with the Zobrist keys of its 8 symmetry boards
+
+    zobrist:
+        list of 8 int, see [Zobrist key]. min(zobrist) is the same for all
+        symmetry boards.
+    """
+
+    def __init__(self, board=None, history=None):
+        super().__init__(board, history)
+        self.zobrist = zobrist_keys(self.key)
+        # the keys before each `make_move`, indexed by the ply
+        self.zobrist_undo = [None] * len(self.undo_moves)
+
+    def copy(self) -> ZobristBoard:
+        board = ZobristBoard.__new__(ZobristBoard)
+        board.key = self.key
+        board.history = self.history.copy()
+        board.chess = [self.chess[0].copy(), self.chess[1].copy()]
+        board.ply = self.ply
+        board.undo_moves = self.undo_moves.copy()
+        board.undo_players = self.undo_players.copy()
+        board.zobrist = self.zobrist.copy()
+        board.zobrist_undo = self.zobrist_undo.copy()
+        return board
+
+    def _changed(self, old_key: int) -> None:
+        """Update the keys with the bits changed since old_key"""
+        changed = old_key ^ self.key
+        zobrist = self.zobrist
+        while changed:
+            low = changed & -changed
+            zobrist = [z ^ d for z, d in
+                       zip(zobrist, DELTA[low.bit_length() - 1])]
+            changed ^= low
+        self.zobrist = zobrist
+        if verify:
+            check_keys(self)
+
+    def put(self, pos: int, player: int):
+        key = self.key
+        super().put(pos, player)
+        self._changed(key)
+
+    def move(self, pre_pos: int, pos: int, player: int):
+        key = self.key
+        super().move(pre_pos, pos, player)
+        self._changed(key)
+
+    def make_move(self, movement: tuple, player: int,
+                  check: bool = True) -> bool:
+        if not super().make_move(movement, player, check):
+            return False
+        shift = (player-1)*27
+        if movement[0] == 0:
+            delta = DELTA[shift + movement[1]]
+        else:
+            pre_pos, pos = movement[1]
+            delta = MOVE_DELTA[(shift + pre_pos) * 54 + shift + pos]
+        ply = self.ply - 1
+        if ply == len(self.zobrist_undo):
+            self.zobrist_undo += [None] * ply
+        self.zobrist_undo[ply] = self.zobrist
+        self.zobrist = [z ^ d for z, d in zip(self.zobrist, delta)]
+        if verify:
+            check_keys(self)
+        return True
+
+    def unmake_move(self):
+        super().unmake_move()
+        self.zobrist = self.zobrist_undo[self.ply]
+        if verify:
+            check_keys(self)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    import solve
+    from ordering import BENCHMARK_POSITIONS
+
+    # the keys of the symmetry boards are a permutation of each other
+    random.seed(0)
+    board = ZobristBoard()
+    verify = True
+    player = 1
+    for _ in range(2000):
+        movements = board.available_move(player)
+        if board.check_win() or not movements:
+            board = ZobristBoard()
+            player = 1
+            continue
+        board.make_move(random.choice(movements), player, False)
+        for key in board.symmetric_keys():
+            assert sorted(zobrist_keys(key)) == sorted(board.zobrist)
+        if random.random() < 0.3:
+            board.unmake_move()
+        else:
+            player = 3 - player
+    print("Zobrist keys checked on 2000 movements,", len(_seen),
+          "canonical positions")
+
+    # the dfs with the Zobrist keys, then with the verification
+    solve.cutoff = True
+    results = {}
+    for mode in ("index", "zobrist", "verify"):
+        solve.zobrist = mode != "index"
+        verify = mode == "verify"
+        _seen.clear()
+        start = time.perf_counter()
+        results[mode] = []
+        for key, player in [(0, 1)] + BENCHMARK_POSITIONS:
+            solve.board_state_o.clear()
+            solve.board_state_x.clear()
+            board = ZobristBoard(key) if solve.zobrist else BitBoard(key)
+            results[mode].append(solve.iterative_turns(board, player))
+        print(f"{mode}: {time.perf_counter() - start:.1f}s")
+    assert results["index"] == results["zobrist"] == results["verify"]
+    print("same results,", len(_seen), "canonical positions checked")